@@ -0,0 +1,256 @@
+"""
+Native activation of extracted conda environments.
+
+Instead of wrapping every command in `conda run`, which starts a conda
+interpreter and a temporary shell per launch, floability computes what
+activating an environment changes (PATH, CONDA_PREFIX, variables from
+conda-meta/state and the effects of etc/conda/activate.d scripts) once per
+environment, caches it in the environment, and runs binaries from the
+environment's bin/ directory directly with those variables applied.
+
+Only the variables activation changes are cached, as prefixes or suffixes
+added to the caller's value where possible, so the cache applies to callers
+with any environment. A value that replaces the caller's value outright is
+only reused by callers that had the same value before activation.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+ACTIVATION_CACHE_NAME = ".floability_activation.json"
+
+# Bump when the way activation is captured changes
+ACTIVATION_CACHE_VERSION = 2
+
+# Variables bash maintains itself, which are not part of an activation
+SHELL_VARIABLES = {"_", "SHLVL", "PWD", "OLDPWD"}
+
+# Activations captured by this process, by environment, for callers the
+# cached activation does not apply to (the environment itself is read-only)
+_captured: Dict[str, dict] = {}
+
+# Per-run directory that packages installed during a run go to, since the
+# shared extracted environment is read-only
+RUN_USER_BASE_NAME = "python_user"
+
+
+def _activation_inputs(env_dir: Path) -> List[List]:
+    """
+    Return the files that determine the activation of env_dir with their
+    modification times, used to tell whether a cached activation is current.
+    """
+
+    inputs = []
+    state_file = env_dir / "conda-meta" / "state"
+    activate_dir = env_dir / "etc" / "conda" / "activate.d"
+    candidates = [state_file] + sorted(activate_dir.glob("*.sh"))
+    for path in candidates:
+        try:
+            inputs.append([str(path), os.stat(path).st_mtime_ns])
+        except FileNotFoundError:
+            pass
+    return inputs
+
+
+def _base_variables(env_dir: Path) -> Dict[str, str]:
+    variables = {
+        "CONDA_PREFIX": str(env_dir),
+        "CONDA_DEFAULT_ENV": str(env_dir),
+        "CONDA_SHLVL": "1",
+        "CONDA_PROMPT_MODIFIER": f"({env_dir}) ",
+    }
+
+    state_file = env_dir / "conda-meta" / "state"
+    if state_file.is_file():
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        variables.update(
+            {name: str(value) for name, value in state.get("env_vars", {}).items()}
+        )
+    return variables
+
+
+def capture_activation(
+    env_dir: Path, base: Optional[Mapping[str, str]] = None
+) -> Tuple[Dict[str, Dict[str, str]], Dict[str, Optional[str]]]:
+    """
+    Compute the changes activating env_dir makes to base (os.environ by
+    default), as a dict mapping variable names to {"prepend": prefix} or
+    {"append": suffix} (for PATH-like variables), {"set": value} or
+    {"unset": ""}. Also return the values in base that the "set" changes
+    were derived from, which a caller must have for the changes to apply.
+
+    activate.d scripts are sourced once in bash and their effect is captured,
+    so their results are reused without running a shell on every launch.
+    """
+
+    env_dir = Path(env_dir)
+    base = dict(os.environ if base is None else base)
+    base_variables = _base_variables(env_dir)
+    before = dict(base)
+    before.update(base_variables)
+    before["PATH"] = f"{env_dir / 'bin'}{os.pathsep}{base.get('PATH', '')}"
+
+    after = before
+    scripts = sorted((env_dir / "etc" / "conda" / "activate.d").glob("*.sh"))
+    if scripts:
+        source = "".join(f'. "{script}" >/dev/null 2>&1\n' for script in scripts)
+        output = subprocess.run(
+            ["bash", "--noprofile", "--norc", "-c", f"{source}env -0"],
+            env=before,
+            check=True,
+            capture_output=True,
+        ).stdout
+        after = {}
+        for item in output.split(b"\0"):
+            name, sep, value = item.decode("utf-8", "replace").partition("=")
+            if sep and name not in SHELL_VARIABLES:
+                after[name] = value
+
+    changes = {}
+    depends_on = {}
+    for name, value in after.items():
+        original = base.get(name)
+        if value == original:
+            continue
+        # An empty or missing variable extended by "$VAR:..." style scripts
+        # leaves a separator behind, which still marks a prefix or suffix
+        original = original or ""
+        if value.endswith(os.pathsep + original):
+            changes[name] = {"prepend": value[: len(value) - len(original)]}
+        elif value.startswith(original + os.pathsep):
+            changes[name] = {"append": value[len(original) :]}
+        else:
+            changes[name] = {"set": value}
+            # Variables activation sets itself do not depend on the caller
+            if name not in base_variables:
+                depends_on[name] = base.get(name)
+    for name in base:
+        if name not in after and name not in SHELL_VARIABLES:
+            changes[name] = {"unset": ""}
+    return changes, depends_on
+
+
+def _applies(cached: dict, inputs: List[List], base: Mapping[str, str]) -> bool:
+    return (
+        cached.get("version") == ACTIVATION_CACHE_VERSION
+        and cached.get("inputs") == inputs
+        and all(
+            base.get(name) == value for name, value in cached["depends_on"].items()
+        )
+    )
+
+
+def get_activation(
+    env_dir: str, base: Optional[Mapping[str, str]] = None
+) -> Dict[str, Dict[str, str]]:
+    """
+    Return the activation changes of env_dir for base (os.environ by default),
+    captured on first use and cached in the environment until its activation
+    scripts or state change, or a caller's environment differs in a variable
+    the cached changes were derived from.
+    """
+
+    env_dir = Path(env_dir)
+    base = os.environ if base is None else base
+    cache_file = env_dir / ACTIVATION_CACHE_NAME
+    inputs = _activation_inputs(env_dir)
+
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if _applies(cached, inputs, base):
+            return cached["changes"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    captured = _captured.get(str(env_dir))
+    if captured is not None and _applies(captured, inputs, base):
+        return captured["changes"]
+
+    changes, depends_on = capture_activation(env_dir, base)
+    cache = {
+        "version": ACTIVATION_CACHE_VERSION,
+        "inputs": inputs,
+        "changes": changes,
+        "depends_on": depends_on,
+    }
+    _captured[str(env_dir)] = cache
+
+    temp_file = cache_file.with_name(f"{ACTIVATION_CACHE_NAME}.{os.getpid()}")
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        # Extracted environments are read-only once they are ready; the
+        # activation is still kept for this process
+        print(f"[environment] Could not cache activation of {env_dir}: {e}")
+
+    return changes
+
+
+def activated_environ(
+    env_dir: str, base: Optional[Mapping[str, str]] = None
+) -> Dict[str, str]:
+    """
+    Return a copy of base (os.environ by default) with env_dir activated.
+    """
+
+    environ = dict(os.environ if base is None else base)
+    for name, change in get_activation(env_dir, environ).items():
+        if "prepend" in change:
+            environ[name] = change["prepend"] + environ.get(name, "")
+        elif "append" in change:
+            environ[name] = environ.get(name, "") + change["append"]
+        elif "set" in change:
+            environ[name] = change["set"]
+        else:
+            environ.pop(name, None)
+    return environ
+
+
+def run_variables(
+    run_dir: str, variables: Mapping[str, str], env_dir: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Return the variables to set for the processes of a run: the given ones
+    (e.g. VINE_MANAGER_NAME) and, with a shared environment env_dir, a
+    per-run user site in run_dir that pip installs into instead of env_dir.
+    """
+
+    result = {name: str(value) for name, value in variables.items()}
+    if env_dir:
+        result["PYTHONUSERBASE"] = os.path.join(
+            os.path.abspath(run_dir), RUN_USER_BASE_NAME
+        )
+        result["PIP_USER"] = "1"
+    return result
+
+
+def activated_command(
+    cmd: List[str],
+    env_dir: Optional[str] = None,
+    variables: Optional[Mapping[str, str]] = None,
+) -> Tuple[List[str], Optional[Dict[str, str]]]:
+    """
+    Return cmd with its program resolved in env_dir's bin/ directory, and the
+    environment to run it with, which also has the per-run variables set.
+    Without env_dir or variables, cmd runs unchanged in the current
+    environment (None).
+    """
+
+    if not env_dir and not variables:
+        return cmd, None
+
+    environ = activated_environ(env_dir) if env_dir else dict(os.environ)
+    environ.update({name: str(value) for name, value in (variables or {}).items()})
+    if not env_dir:
+        return cmd, environ
+
+    program = shutil.which(cmd[0], path=environ.get("PATH")) or cmd[0]
+    return [program] + list(cmd[1:]), environ
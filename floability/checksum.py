@@ -0,0 +1,247 @@
+"""
+Checksum helpers used to verify fetched data.
+
+Hashing can be fused into a download or copy stream with new_hasher(), or run
+over an existing file with compute_checksum(), which reads through a large
+reusable buffer. xxhash and blake3 are optional dependencies that are only
+needed when a data spec asks for them. VerificationCache remembers digests of
+unchanged files across runs.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_ALGORITHM = "md5"
+
+# Reads of this size keep hashing throughput close to disk bandwidth
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Verification database, created under the floability base directory
+VERIFICATION_DB_NAME = "flo_verification.db"
+
+HASHLIB_ALGORITHMS = {
+    "md5",
+    "sha1",
+    "sha224",
+    "sha256",
+    "sha384",
+    "sha512",
+    "blake2b",
+    "blake2s",
+}
+
+# Names accepted in data specs, mapped to the xxhash constructor
+XXHASH_ALGORITHMS = {
+    "xxhash": "xxh64",
+    "xxh32": "xxh32",
+    "xxh64": "xxh64",
+    "xxh3_64": "xxh3_64",
+    "xxh3_128": "xxh3_128",
+    "xxh128": "xxh128",
+}
+
+
+def new_hasher(algorithm: str = DEFAULT_ALGORITHM):
+    """
+    Return a new hash object for algorithm, supporting update() and hexdigest().
+    Raise ValueError for unknown algorithms or missing optional packages.
+    """
+
+    name = algorithm.lower()
+
+    if name in HASHLIB_ALGORITHMS:
+        return hashlib.new(name)
+
+    if name in XXHASH_ALGORITHMS:
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError(
+                f"Checksum algorithm '{algorithm}' requires the 'xxhash' package."
+            )
+        return getattr(xxhash, XXHASH_ALGORITHMS[name])()
+
+    if name == "blake3":
+        try:
+            import blake3
+        except ImportError:
+            raise ValueError(
+                f"Checksum algorithm '{algorithm}' requires the 'blake3' package."
+            )
+        return blake3.blake3()
+
+    raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+
+
+def update_from_file(
+    hasher,
+    file_path: Path,
+    length: Optional[int] = None,
+    buffer_size: int = HASH_BUFFER_SIZE,
+) -> None:
+    """
+    Feed the first length bytes of file_path (all of it if None) into hasher,
+    reading through a single reusable buffer.
+    """
+
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    remaining = length
+
+    with file_path.open("rb", buffering=0) as f:
+        while remaining is None or remaining > 0:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            hasher.update(view[:size])
+
+
+def compute_checksum(
+    file_path: Path,
+    algorithm: str = DEFAULT_ALGORITHM,
+    buffer_size: int = HASH_BUFFER_SIZE,
+) -> Optional[str]:
+    """
+    Compute the checksum of a file and return the hex digest.
+    Return None if file_path is not a file or cannot be read.
+    """
+
+    if not file_path.is_file():
+        return None
+
+    hasher = new_hasher(algorithm)
+    try:
+        update_from_file(hasher, file_path, buffer_size=buffer_size)
+    except IOError as e:
+        print(f"Error computing {algorithm} for {file_path}: {e}")
+        return None
+    return hasher.hexdigest()
+
+
+def copy_file_with_checksum(
+    source_path: Path,
+    dest: Path,
+    algorithm: str = DEFAULT_ALGORITHM,
+    buffer_size: int = HASH_BUFFER_SIZE,
+) -> str:
+    """
+    Copy source_path to dest (with metadata, like shutil.copy2) while hashing
+    the bytes as they pass, so the copy never has to be read back to verify it.
+    Return the hex digest.
+    """
+
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    with source_path.open("rb", buffering=0) as src, dest.open(
+        "wb", buffering=0
+    ) as dst:
+        while True:
+            size = src.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+            dst.write(view[:size])
+
+    shutil.copystat(source_path, dest)
+    return hasher.hexdigest()
+
+
+class VerificationCache:
+    """
+    On-disk record of file checksums, stored in a small sqlite database.
+
+    A recorded digest is trusted for as long as the file keeps the same device,
+    inode, size and modification time, so unchanged files are not reread to be
+    verified again. Safe to share between threads and between processes.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), timeout=30, check_same_thread=False
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS verified (
+                    path TEXT NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    dev INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (path, algorithm)
+                )
+                """
+            )
+
+    @staticmethod
+    def _key(file_path: Path) -> str:
+        return os.path.abspath(file_path)
+
+    def lookup(self, file_path: Path, algorithm: str) -> Optional[str]:
+        """
+        Return the recorded digest of file_path if the file is unchanged since
+        it was recorded, otherwise None.
+        """
+
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dev, inode, size, mtime_ns, digest FROM verified "
+                "WHERE path = ? AND algorithm = ?",
+                (self._key(file_path), algorithm.lower()),
+            ).fetchone()
+
+        if row is None:
+            return None
+        if tuple(row[:4]) != (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns):
+            return None
+        return row[4]
+
+    def record(self, file_path: Path, algorithm: str, digest: str) -> None:
+        """
+        Record digest as the checksum of file_path in its current state.
+        """
+
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verified "
+                "(path, algorithm, dev, inode, size, mtime_ns, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(file_path),
+                    algorithm.lower(),
+                    st.st_dev,
+                    st.st_ino,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    digest,
+                ),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
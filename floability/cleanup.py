@@ -1,15 +1,29 @@
 # cleanup.py
 """
-Manages subprocess cleanup. Now we send SIGINT to each process so they can do
-their own shutdown (e.g. vine_factory removing workers), then we fallback to
-terminate() if they're still alive.
+Manages subprocess cleanup. We send SIGINT to each process group so they can
+do their own shutdown (e.g. vine_factory removing workers), then escalate to
+SIGTERM and finally SIGKILL for groups that are still alive. Each stage waits
+only until every process has exited, up to a deadline shared by all of them.
 """
 
+import selectors
 import signal
 import sys
 import time
 import os
-import shutil
+
+from .utils import remove_tree
+
+# Seconds each stage of the shutdown waits for processes to exit
+SHUTDOWN_STAGES = [
+    (signal.SIGINT, 2.0),
+    (signal.SIGTERM, 2.0),
+    (signal.SIGKILL, 1.0),
+]
+
+# How often process groups whose leader has exited are checked, since their
+# remaining members cannot be waited for
+GROUP_POLL_INTERVAL = 0.05
 
 
 class CleanupManager:
@@ -20,57 +34,109 @@ class CleanupManager:
     def __init__(self):
         self.subprocesses = []
         self.directories = []
+        self.process_groups = {}
 
     def register_subprocess(self, proc):
+        if proc is None:
+            return
         self.subprocesses.append(proc)
+        try:
+            pgid = os.getpgid(proc.pid)
+        except ProcessLookupError:
+            pgid = None
+        # Never signal floability's own group, only the process itself
+        if pgid != os.getpgrp():
+            self.process_groups[proc.pid] = pgid
 
     def register_directory(self, directory):
         self.directories.append(directory)
 
+    def _group_alive(self, proc) -> bool:
+        pgid = self.process_groups.get(proc.pid)
+        if pgid is None:
+            return False
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _is_running(self, proc) -> bool:
+        return proc.poll() is None or self._group_alive(proc)
+
+    def _signal(self, proc, sig) -> None:
+        pgid = self.process_groups.get(proc.pid)
+        try:
+            if pgid is None:
+                proc.send_signal(sig)
+            else:
+                os.killpg(pgid, sig)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            print(
+                f"[cleanup] Warning: could not send {sig.name} to pid={proc.pid}: {e}"
+            )
+
+    def _wait_for_exit(self, procs, deadline: float) -> None:
+        """
+        Wait until procs and their process groups have exited, or until
+        deadline. Exits of the processes themselves wake us through pidfds.
+        """
+
+        selector = selectors.DefaultSelector()
+        try:
+            for proc in procs:
+                if proc.poll() is not None:
+                    continue
+                try:
+                    pidfd = os.pidfd_open(proc.pid)
+                except (AttributeError, OSError):
+                    continue
+                selector.register(pidfd, selectors.EVENT_READ, proc)
+
+            while True:
+                running = [proc for proc in procs if self._is_running(proc)]
+                timeout = deadline - time.monotonic()
+                if not running or timeout <= 0:
+                    return
+
+                # Without a pidfd for each running process, check again soon
+                if len(selector.get_map()) < len(running):
+                    timeout = min(timeout, GROUP_POLL_INTERVAL)
+
+                for key, _ in selector.select(timeout):
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    key.data.poll()
+        finally:
+            for key in list(selector.get_map().values()):
+                os.close(key.fd)
+            selector.close()
+
     def cleanup(self):
-        print(
-            "[cleanup] Sending SIGINT to all subprocesses so they can do their own cleanup..."
-        )
+        for sig, grace in SHUTDOWN_STAGES:
+            running = [proc for proc in self.subprocesses if self._is_running(proc)]
+            if not running:
+                break
 
-        # 1) Send SIGINT
-        for proc in self.subprocesses:
-            if proc.poll() is None:  # still running
+            if sig == signal.SIGINT:
                 print(
-                    f"[cleanup] SIGINT -> pid={proc.pid}, pgid={os.getpgid(proc.pid)}"
+                    "[cleanup] Sending SIGINT to all subprocesses so they can do "
+                    "their own cleanup..."
                 )
-                try:
-                    # proc.send_signal(signal.SIGINT)
-                    os.killpg(os.getpgid(proc.pid), signal.SIGINT)
-                except Exception as e:
-                    print(
-                        f"[cleanup] Warning: could not send SIGINT to pid={proc.pid}: {e}"
-                    )
-
-        # 2) Give them a moment to exit
-        time.sleep(2)
-
-        # 3) Anyone still running, we call terminate()
-        for proc in self.subprocesses:
-            if proc.poll() is None:
-                print(
-                    f"[cleanup] Process pid={proc.pid} still alive; calling terminate()"
-                )
-                try:
-                    # proc.terminate()
-                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-                except Exception as e:
-                    print(f"[cleanup] Warning: could not terminate pid={proc.pid}: {e}")
-
-        # Optional: final wait to ensure they're gone
-        for proc in self.subprocesses:
-            try:
-                proc.wait(timeout=2)
-            except:
-                pass
+            for proc in running:
+                pgid = self.process_groups.get(proc.pid)
+                print(f"[cleanup] {sig.name} -> pid={proc.pid}, pgid={pgid}")
+                self._signal(proc, sig)
+
+            self._wait_for_exit(running, time.monotonic() + grace)
 
         for directory in self.directories:
             print(f"[cleanup] Cleaning up directory: {directory}")
-            shutil.rmtree(directory, ignore_errors=True)
+            remove_tree(directory)
 
         print("[cleanup] All subprocesses cleaned up.")
 
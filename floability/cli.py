@@ -4,18 +4,52 @@ Floability CLI: main entry point for running distributed Jupyter-based workflows
 """
 
 import argparse
+import datetime
 import time
 import os
 import subprocess
+import sys
 import uuid
 from pathlib import Path
 
-from .environment import create_conda_pack_from_yml
-from .resource_provisioner import start_vine_factory
+from .environment import (
+    create_conda_pack_from_yml,
+    get_extracted_environment,
+    export_lockfile,
+    get_worker_pack,
+    is_environment_pack,
+    PACK_FORMATS,
+    DEFAULT_PACK_FORMAT,
+)
+from .activation import activated_command, run_variables
+from .layers import is_delta_pack
+from .resource_provisioner import start_vine_factory, watch_for_first_worker
 from .cleanup import CleanupManager, install_signal_handlers
-from .jupyter_runner import start_jupyterlab, execute_notebook
-from .utils import create_unique_directory, safe_extract_tar, update_manager_name_in_env
-from .data_handler import ensure_data_is_fetched
+from .supervisor import DEFAULT_MAX_RESTARTS, RESTART_POLICIES, Supervisor
+from .jupyter_runner import (
+    JUPYTER_READY_TIMEOUT,
+    execute_notebook,
+    read_jupyter_config,
+    start_jupyterlab,
+)
+from .utils import (
+    create_unique_directory,
+    parse_size,
+    format_size,
+    LINK_MODES,
+    DEFAULT_LINK_MODE,
+)
+from .data_handler import ensure_data_is_fetched, DataFetchError, DEFAULT_FETCH_JOBS
+from .data_store import DataStore, DATA_STORE_DIR_NAME
+from .pack_registry import (
+    REGISTRY_TOKEN_ENV,
+    FilesystemPackRegistry,
+    PackRegistryError,
+    open_pack_registry,
+    serve_pack_registry,
+)
+from .pipeline import StartupPipeline, StartupError
+from .report import start_report, timed_phase, load_report, summarize_report
 
 
 def get_parsed_arguments() -> argparse.Namespace:
@@ -55,11 +89,100 @@ def get_parsed_arguments() -> argparse.Namespace:
         default=".",
         help="Path to the root of the backpack for 'backpack' source_type files (default='.')",
     )
+    fetch_parser.add_argument(
+        "--base-dir",
+        default="/tmp",
+        help="Base directory for floability cache files (default=/tmp).",
+    )
+    _add_fetch_args(fetch_parser)
+
+    # cache sub-command
+    cache_parser = subparsers.add_parser(
+        "cache", help="Inspect or trim the shared data store"
+    )
+    cache_subparsers = cache_parser.add_subparsers(
+        dest="cache_command", help="Cache sub-commands"
+    )
+    cache_ls_parser = cache_subparsers.add_parser(
+        "ls", help="List objects in the shared data store"
+    )
+    cache_gc_parser = cache_subparsers.add_parser(
+        "gc", help="Evict least recently used objects from the shared data store"
+    )
+    cache_gc_parser.add_argument(
+        "--max-size",
+        default="0",
+        help="Evict until the store is at most this size, e.g. 50G (default=0).",
+    )
+    for parser_ in (cache_ls_parser, cache_gc_parser):
+        parser_.add_argument(
+            "--base-dir",
+            default="/tmp",
+            help="Base directory holding the data store (default=/tmp).",
+        )
 
     # pack sub-command
     pack_parser = subparsers.add_parser(
         "pack", help="Package a notebook into a Floability backpack"
     )
+    pack_parser.add_argument(
+        "--backpack",
+        required=True,
+        help="Path to the Floability backpack directory.",
+    )
+    pack_parser.add_argument(
+        "--environment",
+        help="Path to environment.yml (default=<backpack>/software/environment.yml).",
+    )
+    pack_parser.add_argument(
+        "--base-dir",
+        default="/tmp",
+        help="Base directory for floability cache files (default=/tmp).",
+    )
+    _add_registry_args(pack_parser)
+
+    # registry sub-command
+    registry_parser = subparsers.add_parser(
+        "registry", help="Serve or inspect a shared environment pack registry"
+    )
+    registry_subparsers = registry_parser.add_subparsers(
+        dest="registry_command", help="Registry sub-commands"
+    )
+    registry_serve_parser = registry_subparsers.add_parser(
+        "serve", help="Serve a pack registry directory over HTTP"
+    )
+    registry_serve_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to serve the registry on; use 0.0.0.0 to serve other nodes "
+        f"and set {REGISTRY_TOKEN_ENV} to require a token for publishing "
+        "(default=127.0.0.1).",
+    )
+    registry_serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8780,
+        help="Port to serve the registry on (default=8780).",
+    )
+    registry_serve_parser.add_argument(
+        "--max-size",
+        type=parse_size,
+        help="Evict least recently used packs beyond this size, e.g. 200G "
+        "(default=unlimited).",
+    )
+    registry_ls_parser = registry_subparsers.add_parser(
+        "ls", help="List the packs in a pack registry directory"
+    )
+    for parser_ in (registry_serve_parser, registry_ls_parser):
+        parser_.add_argument("root", help="Directory holding the registry's packs.")
+
+    # report sub-command
+    report_parser = subparsers.add_parser(
+        "report", help="Summarize the timing report of a run"
+    )
+    report_parser.add_argument(
+        "run_dir", help="Run directory (or its run_report.jsonl file)."
+    )
 
     # verify sub-command
     verify_parser = subparsers.add_parser("verify", help="Verify a Floability backpack")
@@ -67,6 +190,54 @@ def get_parsed_arguments() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def _add_fetch_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--fetch-jobs",
+        type=int,
+        default=DEFAULT_FETCH_JOBS,
+        help=f"Number of data items fetched concurrently (default={DEFAULT_FETCH_JOBS}).",
+    )
+    parser.add_argument(
+        "--reverify",
+        action="store_true",
+        help="Rehash existing data items even if they were verified before.",
+    )
+    parser.add_argument(
+        "--data-store",
+        action="store_true",
+        help="Share data items that have a checksum with other runs through the "
+        "data store in --base-dir.",
+    )
+    parser.add_argument(
+        "--data-cache-size",
+        type=parse_size,
+        help="Size budget of the shared data store, e.g. 50G (default=unlimited).",
+    )
+    parser.add_argument(
+        "--link-mode",
+        default=DEFAULT_LINK_MODE,
+        choices=LINK_MODES,
+        help="How filesystem and backpack data is placed at its target location; "
+        f"data items may override it with 'link_mode' (default={DEFAULT_LINK_MODE}).",
+    )
+
+
+def _add_registry_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--pack-registry",
+        default=os.environ.get("FLOABILITY_PACK_REGISTRY"),
+        help="Shared directory or http(s) URL of a registry that environment "
+        "packs are fetched from before building and published to after "
+        "building (default=$FLOABILITY_PACK_REGISTRY).",
+    )
+    parser.add_argument(
+        "--pack-registry-size",
+        type=parse_size,
+        help="Size budget of a directory registry, e.g. 200G; least recently "
+        "used packs are evicted after publishing (default=unlimited).",
+    )
+
+
 def _add_execution_args(parser: argparse.ArgumentError) -> None:
     parser.add_argument(
         "--backpack",
@@ -125,6 +296,7 @@ def _add_execution_args(parser: argparse.ArgumentError) -> None:
         default=".",
         help="Path to the root of the backpack (default='.').",
     )
+    _add_fetch_args(parser)
     parser.add_argument(
         "--compute-spec",
         help="Path to compute.yml file specifying resource requirements.",
@@ -135,6 +307,66 @@ def _add_execution_args(parser: argparse.ArgumentError) -> None:
         help="Skip starting workers (optional).",
     )
     
+    parser.add_argument(
+        "--pack-format",
+        default=DEFAULT_PACK_FORMAT,
+        choices=PACK_FORMATS,
+        help="Archive format of the main environment pack. tar.zst packs and "
+        f"extracts faster; worker packs are always tar.gz (default={DEFAULT_PACK_FORMAT}).",
+    )
+    parser.add_argument(
+        "--layered",
+        action="store_true",
+        help="Build the main environment as a small delta layer over a shared "
+        "base layer of the packages floability requires.",
+    )
+    _add_registry_args(parser)
+    parser.add_argument(
+        "--jupyter-timeout",
+        type=float,
+        default=JUPYTER_READY_TIMEOUT,
+        help="Seconds JupyterLab may take to start before a warning is shown "
+        f"(default={JUPYTER_READY_TIMEOUT}).",
+    )
+    parser.add_argument(
+        "--cell-timeout",
+        type=int,
+        help="Seconds a notebook cell may run in 'floability execute' before "
+        "execution is stopped (default: no limit).",
+    )
+    parser.add_argument(
+        "--prewarm-kernels",
+        type=int,
+        help="Number of kernels to start in JupyterLab before the notebook is "
+        "opened, with the warmup-imports of compute.yml's jupyter_config "
+        "imported (default: prewarm-kernels of jupyter_config, or 0).",
+    )
+    parser.add_argument(
+        "--factory-restart",
+        default="never",
+        choices=RESTART_POLICIES,
+        help="Restart policy of vine_factory. The run ends when vine_factory "
+        "exits and is not restarted (default=never).",
+    )
+    parser.add_argument(
+        "--report-first-worker",
+        action="store_true",
+        help="Poll the catalog server (CATALOG_HOST, default catalog.cse.nd.edu) "
+        "until the first worker connects and record it in the run report.",
+    )
+    parser.add_argument(
+        "--jupyter-restart",
+        default="never",
+        choices=RESTART_POLICIES,
+        help="Restart policy of JupyterLab (default=never).",
+    )
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=DEFAULT_MAX_RESTARTS,
+        help="Maximum number of restarts of each supervised process "
+        f"(default={DEFAULT_MAX_RESTARTS}).",
+    )
     parser.add_argument(
         "--prefer-python",
         action="store_true",
@@ -234,6 +466,52 @@ def resolve_backpack_args(args: argparse.Namespace) -> None:
     args.backpack_root = str(backpack_dir)
 
 
+def resolve_environment_pack(
+    environment: str,
+    args: argparse.Namespace,
+    run_dir: str,
+    pack_format: str = DEFAULT_PACK_FORMAT,
+    log_prefix: str = None,
+    layered: bool = False,
+) -> str:
+    """
+    Return the environment pack for environment: a prebuilt pack as is, or
+    a (cached) pack built from an environment.yml, as a delta layer over the
+    shared base layer if layered.
+    """
+
+    if is_environment_pack(environment):
+        print(f"[floability] Using conda-pack from '{environment}'")
+        return str(Path(environment).resolve())
+
+    print(f"[floability] Creating conda-pack from '{environment}'")
+    return create_conda_pack_from_yml(
+        env_yml=environment,
+        solver="libmamba",
+        force=False,
+        base_dir=args.base_dir,
+        run_dir=run_dir,
+        manager_name=args.manager_name,
+        pack_format=pack_format,
+        log_prefix=log_prefix,
+        registry=open_registry_arg(args),
+        layered=layered,
+    )
+
+
+def open_registry_arg(args: argparse.Namespace):
+    """
+    Return the pack registry given by --pack-registry, or None if there is
+    none or it cannot be opened, in which case packs are only cached locally.
+    """
+
+    try:
+        return open_pack_registry(args.pack_registry, args.pack_registry_size)
+    except PackRegistryError as e:
+        print(f"[registry] {e}")
+        return None
+
+
 def run_floability(
     args: argparse.Namespace, cleanup_manager: CleanupManager, mode="run"
 ) -> None:
@@ -242,175 +520,251 @@ def run_floability(
     Orchestrates data fetching, environment creation/extraction, starting
     workers and JupyterLab, and manages cleanup.
     """
+    run_start = time.monotonic()
     resolve_backpack_args(args)
+    resolved_at = time.monotonic()
 
     run_dir = create_unique_directory(base_dir=args.base_dir, prefix="floability_run")
 
+    report = start_report(run_dir, run_start, command=mode, backpack=args.backpack)
+    report.record("spec_resolution", run_start, resolved_at)
+
     print(
         f"[floability] Floability run directory: {run_dir}. All logs will be stored here."
     )
 
-    # 1) Fetch data if data_spec is provided
-    if args.data_spec:
-        print(f"[floability] Fetching data from {args.data_spec}")
-        ensure_data_is_fetched(args.data_spec, args.backpack_root)
-
     # Generate a unique manager name if none is provided
     if args.manager_name is None:
         args.manager_name = f"floability-{uuid.uuid4()}"
 
     print(f"[floability] Manager name: {args.manager_name}")
 
-    environment_pack = None
-    worker_environment_pack = None
-    env_dir = None
+    # Decide which environment workers get. vine_factory can only ship gzip
+    # packs, so a main pack built as tar.zst is recompressed into a tar.gz
+    # worker pack, and a delta layer is composed with its base into a full pack.
+    worker_environment = args.worker_environment
+    if (
+        args.environment
+        and not worker_environment
+        and not args.no_worker
+        and is_environment_pack(args.environment)
+        and not is_delta_pack(args.environment)
+        and not args.environment.endswith((".tar.gz", ".tgz"))
+    ):
+        print(
+            f"[floability] Workers need a .tar.gz environment; "
+            f"'{args.environment}' cannot be used. Pass --worker-environment."
+        )
+        cleanup_manager.cleanup()
+        sys.exit(1)
 
-    if args.environment:
-        env_file_path = Path(args.environment)
-        ext = Path(args.environment).suffix
+    # 1) Start up as a dependency graph: data fetch and environment builds run
+    #    concurrently, vine_factory is submitted as soon as the worker pack
+    #    exists, and the main environment is extracted once its pack exists.
+    pipeline = StartupPipeline()
+    if args.no_worker:
+        worker_environment = None
 
-        if ext in ["tar", "gz"]:
-            environment_pack = str(env_file_path.resolve())
-            print(f"[floability] Using conda-pack from '{args.environment}'")
-        else:
-            print(f"[floability] Creating conda-pack from '{args.environment}'")
+    # Prefix the output of concurrent builds so it can be told apart
+    concurrent_tasks = [args.data_spec, args.environment, worker_environment]
+    builds_concurrently = sum(bool(task) for task in concurrent_tasks) > 1
 
-            environment_pack = create_conda_pack_from_yml(
-                env_yml=args.environment,
-                solver="libmamba",
-                force=False,
+    if args.data_spec:
+        print(f"[floability] Fetching data from {args.data_spec}")
+        pipeline.add(
+            "data",
+            lambda results: ensure_data_is_fetched(
+                args.data_spec,
+                args.backpack_root,
+                args.fetch_jobs,
                 base_dir=args.base_dir,
-                run_dir=run_dir,
-                manager_name=args.manager_name,
-            )
-
-        env_dir = os.path.join(run_dir, "current_conda_env")
-        os.makedirs(env_dir, exist_ok=True)
-
-        # 2a) Extract the environment
-        try:
-            safe_extract_tar(Path(environment_pack), Path(env_dir))
-        except Exception as e:
-            print(f"[floability] Error extracting environment: {e}")
-            cleanup_manager.cleanup()
-            return
-
-        # 2b) Update the manager name in the environment
-        update_manager_name_in_env(env_dir, args.manager_name)
-
-        # 2c) Run conda-unpack.This fixes the path after extracting the environment
-        try:
-            subprocess.run(
-                [
-                    "conda",
-                    "run",
-                    "--prefix",
-                    env_dir,
-                    "--no-capture-output",
-                    "conda-unpack",
-                ],
-                check=True,
-            )
-        except subprocess.CalledProcessError as e:
-            print(f"[floability] Error running conda-unpack: {e}")
-            cleanup_manager.cleanup()
-            return
+                reverify=args.reverify,
+                data_cache_size=args.data_cache_size,
+                link_mode=args.link_mode,
+                use_data_store=args.data_store,
+            ),
+        )
 
-        cleanup_manager.register_directory(env_dir)
+    if args.environment:
+        pipeline.add(
+            "main_pack",
+            lambda results: resolve_environment_pack(
+                args.environment,
+                args,
+                run_dir,
+                args.pack_format,
+                "[env:main]" if builds_concurrently else None,
+                layered=args.layered,
+            ),
+        )
 
+        # 2) Extract and unpack the environment, or reuse a cached extraction.
+        #    It is shared read-only with other runs and is not modified.
+        pipeline.add(
+            "extract",
+            lambda results: get_extracted_environment(
+                results["main_pack"], args.base_dir
+            ),
+            deps=["main_pack"],
+        )
     else:
         print("[floability] No environment file provided, skipping conda-pack.")
 
-    if args.worker_environment:
-        worker_env_file_path = Path(args.worker_environment)
-        ext = Path(args.worker_environment).suffix
-
-        if ext in ["tar", "gz"]:
-            worker_environment_pack = str(worker_env_file_path.resolve())
-            print(f"[floability] Using conda-pack from '{args.worker_environment}'")
-        else:
-            print(f"[floability] Creating conda-pack from '{args.worker_environment}'")
-
-            worker_environment_pack = create_conda_pack_from_yml(
-                env_yml=args.worker_environment,
-                solver="libmamba",
-                force=False,
-                base_dir=args.base_dir,
-                run_dir=run_dir,
-            )
-    else:
-        worker_environment_pack = environment_pack
-        
-    if environment_pack != worker_environment_pack:
-        print("[floability] Worker environment is different from main environment.")
-        print(f"[floability] Worker environment pack: {worker_environment_pack}")
+    if args.environment and not worker_environment and not args.no_worker:
+        pipeline.add(
+            "worker_pack",
+            lambda results: get_worker_pack(results["main_pack"], args.base_dir),
+            deps=["main_pack"],
+        )
+    elif worker_environment:
+        pipeline.add(
+            "worker_pack",
+            lambda results: resolve_environment_pack(
+                worker_environment,
+                args,
+                run_dir,
+                "tar.gz",
+                "[env:worker]" if builds_concurrently else None,
+            ),
+        )
 
-    # 3) Start vine_factory
+    # 3) Start vine_factory. The supervisor watches it from launch on, while
+    #    the rest of the startup pipeline still runs.
+    supervisor = Supervisor(on_start=cleanup_manager.register_subprocess)
+    supervisor.start()
     if not args.no_worker:
-        print("[floability] Starting vine_factory...")
-        factory_proc = start_vine_factory(
-            batch_type=args.batch_type,
-            manager_name=args.manager_name,
-            min_workers=1,
-            max_workers=args.workers,
-            cores_per_worker=args.cores_per_worker,
-            poncho_env=worker_environment_pack,
-            run_dir=run_dir,
-            scratch_dir=run_dir,
-            config_yml=args.compute_spec,
-        )
-        cleanup_manager.register_subprocess(factory_proc)
+        worker_step = [
+            name for name in ("worker_pack", "main_pack") if name in pipeline.steps
+        ][:1]
+
+        def launch_factory(results):
+            poncho_env = results.get(worker_step[0]) if worker_step else None
+            if poncho_env != results.get("main_pack"):
+                print(
+                    "[floability] Worker environment is different from main environment."
+                )
+                print(f"[floability] Worker environment pack: {poncho_env}")
+
+            print("[floability] Starting vine_factory...")
+            with timed_phase("factory_launch", batch_type=args.batch_type):
+                factory_proc = supervisor.add(
+                    "vine_factory",
+                    lambda: start_vine_factory(
+                        batch_type=args.batch_type,
+                        manager_name=args.manager_name,
+                        min_workers=1,
+                        max_workers=args.workers,
+                        cores_per_worker=args.cores_per_worker,
+                        poncho_env=poncho_env,
+                        run_dir=run_dir,
+                        scratch_dir=run_dir,
+                        config_yml=args.compute_spec,
+                        watch_stderr=False,
+                    ),
+                    restart=args.factory_restart,
+                    max_restarts=args.max_restarts,
+                    output=lambda proc: proc.stderr,
+                    on_output=lambda line: print(
+                        f"[provision] vine_factory error: {line.strip()}"
+                    ),
+                )
+            if args.report_first_worker:
+                watch_for_first_worker(args.manager_name, factory_proc)
+            return factory_proc
+
+        pipeline.add("factory", launch_factory, deps=worker_step)
     else:
-        factory_proc = None
         print("[floability] vine_factory is disabled by --no-worker.")
 
-    if mode == "run":
-        # 4) Always start Jupyter, even if --notebook not provided
-        #    We'll pass None for the notebook_path if not given.
-        print("[floability] Starting JupyterLab...")
-        jupyter_proc = start_jupyterlab(
-            notebook_path=args.notebook,  # None if no notebook is specified
-            port=args.jupyter_port,
-            run_dir=run_dir,
-            conda_env_dir=env_dir,
-        )
-        cleanup_manager.register_subprocess(jupyter_proc)
-    elif mode == "execute":
+    try:
+        results = pipeline.run()
+    except StartupError as e:
+        for name, error in e.failures:
+            if isinstance(error, DataFetchError):
+                print(f"[floability] Error fetching data: {error}")
+            elif isinstance(error, subprocess.CalledProcessError):
+                print(f"[floability] Error running '{name}': {error}")
+            else:
+                print(f"[floability] Error in '{name}': {error}")
+        if e.skipped:
+            print(f"[floability] Skipped: {', '.join(e.skipped)}")
+        print(pipeline.timeline())
+        supervisor.stop("Startup failed")
+        cleanup_manager.cleanup()
+        sys.exit(1)
+
+    print(pipeline.timeline())
+
+    env_dir = results.get("extract")
+
+    # Per-run settings reach this run's processes through their environment
+    variables = run_variables(
+        run_dir, {"VINE_MANAGER_NAME": args.manager_name}, env_dir
+    )
+
+    if mode == "execute":
         if args.prefer_python and args.python_script:
             execute_python_script(
-                script_path=args.python_script, run_dir=run_dir, conda_env_dir=env_dir,
+                script_path=args.python_script,
+                run_dir=run_dir,
+                conda_env_dir=env_dir,
+                variables=variables,
             )
         elif args.notebook:
             execute_notebook(
-                notebook_path=args.notebook, run_dir=run_dir, conda_env_dir=env_dir,
+                notebook_path=args.notebook,
+                run_dir=run_dir,
+                conda_env_dir=env_dir,
+                cell_timeout=args.cell_timeout,
+                variables=variables,
             )
+        supervisor.stop("Execution finished")
         cleanup_manager.cleanup()
+        print("[floability] Exiting main.")
+        return
 
-    # 4) Main loop
-    try:
-        while True:
-            time.sleep(5)
-
-            # Check if factory exited
-            if factory_proc is not None and factory_proc.poll() is not None:
-                print("[floability] vine_factory ended.")
-                break
-
-            # Check if jupyter ended
-            if jupyter_proc is not None and jupyter_proc.poll() is not None:
-                print("[floability] JupyterLab ended.")
-                # Optionally break if you want the entire system to stop
-                # break
-    except KeyboardInterrupt:
-        # The signal handler in cleanup.py typically handles this,
-        # but if we get here, do a final fallback cleanup:
-        print("[floability] KeyboardInterrupt in main loop. Cleaning up...")
-        cleanup_manager.cleanup()
+    # 4) Always start Jupyter, even if --notebook not provided
+    #    We'll pass None for the notebook_path if not given.
+    #    The run goes on while vine_factory does if JupyterLab exits.
+    jupyter_config = read_jupyter_config(args.compute_spec)
+    warmup_imports = jupyter_config.get("warmup-imports") or []
+    prewarm_kernels = args.prewarm_kernels
+    if prewarm_kernels is None:
+        # Imports to warm up ask for one kernel unless a count is given
+        prewarm_kernels = jupyter_config.get(
+            "prewarm-kernels", 1 if warmup_imports else 0
+        )
 
+    print("[floability] Starting JupyterLab...")
+    supervisor.add(
+        "jupyterlab",
+        lambda: start_jupyterlab(
+            notebook_path=args.notebook,  # None if no notebook is specified
+            port=args.jupyter_port,
+            run_dir=run_dir,
+            conda_env_dir=env_dir,
+            ready_timeout=args.jupyter_timeout,
+            prewarm_kernels=prewarm_kernels,
+            warmup_imports=warmup_imports,
+            variables=variables,
+        ),
+        restart=args.jupyter_restart,
+        max_restarts=args.max_restarts,
+        critical=False,
+    )
+
+    # 5) Block until vine_factory exits for good, every supervised process
+    #    has exited, or floability is interrupted
+    reason = supervisor.wait()
+    print(f"[floability] {reason}. Cleaning up...")
+    cleanup_manager.cleanup()
     print("[floability] Exiting main.")
 
 def execute_python_script(
-    script_path: str, run_dir: str, conda_env_dir: str = None
+    script_path: str,
+    run_dir: str,
+    conda_env_dir: str = None,
+    variables: dict = None,
 ) -> None:
     """
     Execute a Python script.
@@ -419,6 +773,7 @@ def execute_python_script(
         script_path: Path to the Python script to execute.
         run_dir: Directory for run-related files.
         conda_env_dir: Path to the conda environment directory, if any.
+        variables: Per-run environment variables to set for the script.
     """
     script_abs_path = os.path.abspath(script_path)
     script_dir = os.path.dirname(script_abs_path)
@@ -440,18 +795,11 @@ def execute_python_script(
             os.chdir(script_dir)
             log.write(f"[floability] Changed working directory to: {script_dir}\n")
             
-            cmd = []
-            if conda_env_dir:
-                # If using a conda environment
-                cmd = [
-                    "conda", "run", 
-                    "--prefix", conda_env_dir, 
-                    "--no-capture-output",
-                    "python", script_name  # Use just the filename since we're in the right directory
-                ]
-            else:
-                # Using system Python
-                cmd = ["python", script_name]  # Use just the filename
+            # Use just the filename since we're in the right directory.
+            # With a conda environment, its python runs with it activated.
+            cmd, env = activated_command(
+                ["python", script_name], conda_env_dir, variables
+            )
             
             cmd_str = " ".join(cmd)
             print(f"[floability] Running command: {cmd_str}")
@@ -464,6 +812,7 @@ def execute_python_script(
                 stderr=subprocess.STDOUT,
                 check=True,
                 text=True,
+                env=env,
             )
             print(f"[floability] Python script execution completed with exit code {result.returncode}")
             print(f"[floability] Logs saved to {log_file}")
@@ -475,6 +824,101 @@ def execute_python_script(
             # Restore the original working directory
             os.chdir(original_dir)
 
+def run_cache_command(args: argparse.Namespace) -> None:
+    """
+    Execute the 'cache ls' and 'cache gc' sub-commands.
+    """
+
+    if args.cache_command not in ("ls", "gc"):
+        print("[cache] No cache command provided. Use 'ls' or 'gc'.")
+        return
+
+    store_dir = Path(args.base_dir) / DATA_STORE_DIR_NAME
+    if not store_dir.is_dir():
+        print(f"[cache] No data store found at {store_dir}")
+        return
+
+    store = DataStore(store_dir)
+    try:
+        if args.cache_command == "ls":
+            entries = store.entries()
+            for entry in reversed(entries):
+                last_used = datetime.datetime.fromtimestamp(entry["last_used"])
+                print(
+                    f"{entry['algorithm']:<8} {entry['digest']:<64} "
+                    f"{format_size(entry['size']):>8}  {last_used:%Y-%m-%d %H:%M}"
+                )
+            total = sum(entry["size"] for entry in entries)
+            print(f"[cache] {len(entries)} objects, {format_size(total)} in {store_dir}")
+
+        else:
+            max_size = parse_size(args.max_size)
+            evicted = store.gc(max_size)
+            freed = sum(entry["size"] for entry in evicted)
+            print(
+                f"[cache] Evicted {len(evicted)} objects ({format_size(freed)}); "
+                f"{format_size(store.total_size())} remaining."
+            )
+    finally:
+        store.close()
+
+
+def run_registry_command(args: argparse.Namespace) -> None:
+    """
+    Execute the 'registry serve' and 'registry ls' sub-commands.
+    """
+
+    if args.registry_command == "serve":
+        serve_pack_registry(
+            args.root,
+            host=args.host,
+            port=args.port,
+            max_size=args.max_size,
+            token=os.environ.get(REGISTRY_TOKEN_ENV),
+        )
+
+    elif args.registry_command == "ls":
+        if not Path(args.root).is_dir():
+            print(f"[registry] No registry found at {args.root}")
+            return
+        entries = FilesystemPackRegistry(args.root).entries()
+        for entry in reversed(entries):
+            last_used = datetime.datetime.fromtimestamp(entry["last_used"])
+            print(
+                f"{entry['name']:<80} {format_size(entry['size']):>8}  "
+                f"{last_used:%Y-%m-%d %H:%M}"
+            )
+        total = sum(entry["size"] for entry in entries)
+        print(f"[registry] {len(entries)} packs, {format_size(total)} in {args.root}")
+
+    else:
+        print("[registry] No registry command provided. Use 'serve' or 'ls'.")
+
+
+def run_pack_command(args: argparse.Namespace) -> None:
+    """
+    Handle the 'pack' sub-command: write the environment lockfile into the
+    backpack's software/ directory, so runs from the backpack skip solving.
+    """
+
+    software_dir = Path(args.backpack).resolve() / "software"
+    env_yml = Path(args.environment or software_dir / "environment.yml")
+
+    if not env_yml.is_file():
+        print(f"[floability] Environment file not found: {env_yml}")
+        return
+
+    try:
+        export_lockfile(
+            str(env_yml),
+            str(software_dir),
+            base_dir=args.base_dir,
+            registry=open_registry_arg(args),
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"[floability] Error building environment for lockfile: {e}")
+
+
 def main():
     """
     Primary entry point for Floability CLI.
@@ -496,9 +940,31 @@ def main():
                 "[floability] No data spec provided. Use --data-spec path/to/data.yml."
             )
             return
-        ensure_data_is_fetched(args.data_spec, args.backpack_root)
+        try:
+            ensure_data_is_fetched(
+                args.data_spec,
+                args.backpack_root,
+                args.fetch_jobs,
+                base_dir=args.base_dir,
+                reverify=args.reverify,
+                data_cache_size=args.data_cache_size,
+                link_mode=args.link_mode,
+                use_data_store=args.data_store,
+            )
+        except DataFetchError as e:
+            print(f"[floability] Error fetching data: {e}")
+            sys.exit(1)
+    elif args.command == "cache":
+        run_cache_command(args)
     elif args.command == "pack":
-        print("[floability] 'pack' command not yet implemented.")
+        run_pack_command(args)
+    elif args.command == "registry":
+        run_registry_command(args)
+    elif args.command == "report":
+        try:
+            print(summarize_report(load_report(args.run_dir)))
+        except FileNotFoundError:
+            print(f"[floability] No run report found in {args.run_dir}")
     elif args.command == "verify":
         print("[floability] 'verify' command not yet implemented.")
     else:
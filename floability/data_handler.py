@@ -2,96 +2,554 @@ import os
 import requests
 import yaml
 import shutil
-import hashlib
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from tqdm import tqdm
 
 from .file_operations import execute_operation
+from .data_store import DATA_STORE_DIR_NAME, DataStore
+from .report import timed_phase
+from .utils import DEFAULT_LINK_MODE, materialize_file, materialize_tree
+from .checksum import (
+    DEFAULT_ALGORITHM,
+    HASH_BUFFER_SIZE,
+    VERIFICATION_DB_NAME,
+    VerificationCache,
+    compute_checksum,
+    copy_file_with_checksum,
+    new_hasher,
+    update_from_file,
+)
+
+DEFAULT_FETCH_JOBS = 4
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_RETRIES = 5
+DOWNLOAD_BACKOFF_SECONDS = 1.0
+DOWNLOAD_TIMEOUT = (30, 300)  # (connect, read) seconds
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Files at least this large are fetched over several connections when the
+# server supports byte ranges. The segment count can be set per data item.
+DEFAULT_DOWNLOAD_SEGMENTS = 4
+SEGMENTED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+
+
+class DataFetchError(Exception):
+    """
+    Raised when one or more data items could not be fetched.
+    Failures are kept in spec order so the report is the same on every run.
+    """
+
+    def __init__(self, failures: List[Tuple[str, Exception]]):
+        self.failures = failures
+        details = "; ".join(f"'{name}': {error}" for name, error in failures)
+        super().__init__(f"Failed to fetch {len(failures)} data item(s): {details}")
+
+
+class ResourceChangedError(Exception):
+    """
+    Raised when a server ignores If-Range because the resource changed
+    while a segmented download was in progress.
+    """
+
+
+class FetchProgress:
+    """
+    Aggregated progress for all data items of a spec. A single byte counter is
+    shared by every download, and the description tracks completed items.
+    """
+
+    def __init__(self, total_items: int):
+        self._lock = threading.Lock()
+        self.total_items = total_items
+        self.done_items = 0
+        self.bar = tqdm(
+            total=0,
+            unit="B",
+            unit_scale=True,
+            desc=self._description(),
+            ncols=80,
+        )
+
+    def _description(self) -> str:
+        return f"Fetching data [{self.done_items}/{self.total_items} items]"
+
+    def add_expected_bytes(self, num_bytes: int) -> None:
+        with self._lock:
+            self.bar.total += num_bytes
+            self.bar.refresh()
+
+    def update(self, num_bytes: int) -> None:
+        with self._lock:
+            self.bar.update(num_bytes)
+
+    def item_done(self) -> None:
+        with self._lock:
+            self.done_items += 1
+            self.bar.set_description_str(self._description())
+
+    def close(self) -> None:
+        self.bar.close()
 
 
 # --------------------------------------------------------------------
 # Utility / Helper Functions. We can move these to a separate module.
 # --------------------------------------------------------------------
-def compute_md5(file_path: Path, chunk_size: int = 4096) -> Optional[str]:
+def compute_md5(file_path: Path, chunk_size: int = HASH_BUFFER_SIZE) -> Optional[str]:
     """
     Compute MD5 checksum of a file and return the hex digest.
     Return None if file_path is not a file.
     """
 
-    if not file_path.is_file():
-        return None
-    hasher = hashlib.md5()
-    try:
-        with file_path.open("rb") as f:
-            for chunk in iter(lambda: f.read(chunk_size), b""):
-                hasher.update(chunk)
-        return hasher.hexdigest()
-    except IOError as e:
-        print(f"Error computing MD5 for {file_path}: {e}")
-        return None
+    return compute_checksum(file_path, "md5", buffer_size=chunk_size)
 
 
-def checksum_matches(file_path: Path, expected_checksum: str) -> bool:
+def checksum_matches(
+    file_path: Path, expected_checksum: str, algorithm: str = DEFAULT_ALGORITHM
+) -> bool:
     """
-    Compare MD5 checksum of file_path with expected_checksum.
+    Compare the checksum of file_path with expected_checksum.
     Return False if file_path does not exist or checksums do not match.
     """
 
-    actual = compute_md5(file_path)
+    actual = compute_checksum(file_path, algorithm)
     if actual is None:
         return False
-    return actual == expected_checksum
+    return actual == expected_checksum.lower()
 
 
-def download_file(url: str, dest: Path, chunk_size: int = 8192) -> None:
+def partial_download_paths(dest: Path) -> Tuple[Path, Path]:
     """
-    Download a file from a URL to dest using streaming to limit memory usage.
-    Uses a temporary file to avoid partial downloads in final location.
+    Return the paths of the partial download and its validator metadata for dest.
     """
 
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    temp_path = dest.with_suffix(".tmp")
+    return (
+        dest.with_name(dest.name + ".part"),
+        dest.with_name(dest.name + ".part.json"),
+    )
+
+
+def load_partial_validator(meta_path: Path, url: str) -> Dict[str, str]:
+    """
+    Load the ETag/Last-Modified validator saved for a partial download of url.
+    Return an empty dict if there is no usable validator.
+    """
 
     try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
+        with meta_path.open("r", encoding="utf-8") as f:
+            validator = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if validator.get("url") != url:
+        return {}
+    return validator
+
+
+def save_partial_validator(meta_path: Path, url: str, headers) -> None:
+    """
+    Record the validator of a response so a later attempt can resume with If-Range.
+    Weak ETags cannot be used with If-Range, so only strong ones are kept.
+    """
 
-            total_size = int(r.headers.get("content-length", 0))
+    etag = headers.get("ETag")
+    if etag and etag.startswith("W/"):
+        etag = None
+
+    validator = {"url": url}
+    if etag:
+        validator["etag"] = etag
+    if headers.get("Last-Modified"):
+        validator["last_modified"] = headers["Last-Modified"]
+
+    with meta_path.open("w", encoding="utf-8") as f:
+        json.dump(validator, f)
+
+
+def _download_attempt(
+    url: str,
+    part_path: Path,
+    meta_path: Path,
+    chunk_size: int,
+    progress: Optional[FetchProgress],
+    algorithm: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Download url into part_path, resuming from the bytes already present when
+    the server still serves the same resource.
+    If algorithm is given, the data is hashed as it streams in and the hex
+    digest of the whole file is returned.
+    """
 
-            with temp_path.open("wb") as f, tqdm(
-                total=total_size,
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    validator = load_partial_validator(meta_path, url)
+    if_range = validator.get("etag") or validator.get("last_modified")
+
+    headers = {}
+    # A preallocated segmented partial cannot be resumed as a single stream
+    if offset and if_range and "segments" not in validator:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = if_range
+    else:
+        offset = 0
+
+    with requests.get(
+        url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT
+    ) as r:
+        if r.status_code == 416:
+            # Nothing left to send: the partial file is already complete
+            content_range = r.headers.get("Content-Range", "")
+            if content_range == f"bytes */{offset}":
+                return compute_checksum(part_path, algorithm) if algorithm else None
+            # Otherwise the partial is stale; start again from scratch
+            part_path.unlink()
+            meta_path.unlink()
+            raise requests.ConnectionError(
+                f"server rejected resume range ({content_range or 'no Content-Range'})"
+            )
+
+        r.raise_for_status()
+
+        if r.status_code == 206:
+            print(f"Resuming download of {url} at byte {offset}")
+            mode = "ab"
+        else:
+            offset = 0
+            mode = "wb"
+            save_partial_validator(meta_path, url, r.headers)
+
+        hasher = new_hasher(algorithm) if algorithm else None
+        if hasher is not None and offset:
+            # Only the resumed prefix has to be read back
+            update_from_file(hasher, part_path, length=offset)
+
+        remaining = int(r.headers.get("content-length", 0))
+        received = 0
+
+        if progress is not None:
+            progress.add_expected_bytes(remaining)
+            pbar = None
+        else:
+            pbar = tqdm(
+                total=offset + remaining,
+                initial=offset,
                 unit="B",
                 unit_scale=True,
                 desc=f"Downloading {url}",
                 ncols=80,
-            ) as pbar:
+            )
+
+        try:
+            with part_path.open(mode) as f:
                 for chunk in r.iter_content(chunk_size=chunk_size):
                     f.write(chunk)
-                    pbar.update(len(chunk))
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    received += len(chunk)
+                    if pbar is not None:
+                        pbar.update(len(chunk))
+                    else:
+                        progress.update(len(chunk))
+        finally:
+            if pbar is not None:
+                pbar.close()
+            elif received < remaining:
+                # The next attempt announces what it still has to fetch
+                progress.add_expected_bytes(received - remaining)
+
+    return hasher.hexdigest() if hasher is not None else None
+
+
+def probe_download(url: str) -> Tuple[int, Dict[str, str]]:
+    """
+    Issue a HEAD request for url and return (size, headers).
+    size is 0 when the server does not report a length.
+    """
 
-        temp_path.replace(dest)
-    except Exception as e:
-        print(f"Failed to download {url} => {dest}: {e}")
-        if temp_path.exists():
-            temp_path.unlink()
-        raise
+    r = requests.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    r.raise_for_status()
+    return int(r.headers.get("content-length", 0)), r.headers
 
 
-def copy_filesystem_source(source_path: Path, dest: Path) -> None:
+def _segment_ranges(size: int, segments: int) -> List[List[int]]:
+    """
+    Split [0, size) into segments as [start, end, bytes_done] entries, with
+    end inclusive as in HTTP Range headers.
+    """
+
+    step = -(-size // segments)
+    return [
+        [start, min(start + step, size) - 1, 0] for start in range(0, size, step)
+    ]
+
+
+def download_file_segmented(
+    url: str,
+    part_path: Path,
+    meta_path: Path,
+    size: int,
+    headers,
+    segments: int,
+    progress: Optional[FetchProgress] = None,
+    max_retries: int = DOWNLOAD_MAX_RETRIES,
+    backoff: float = DOWNLOAD_BACKOFF_SECONDS,
+) -> None:
+    """
+    Download url into part_path over several connections, one per byte range.
+    The file is preallocated and each segment is written in place with
+    os.pwrite. Per-segment progress is saved in meta_path so an interrupted
+    download resumes only the missing ranges.
+    """
+
+    validator = load_partial_validator(meta_path, url)
+    if (
+        part_path.exists()
+        and validator.get("size") == size
+        and "segments" in validator
+    ):
+        ranges = validator["segments"]
+        print(f"Resuming segmented download of {url}")
+    else:
+        save_partial_validator(meta_path, url, headers)
+        validator = load_partial_validator(meta_path, url)
+        ranges = _segment_ranges(size, segments)
+
+    if_range = validator.get("etag") or validator.get("last_modified")
+    validator["size"] = size
+    validator["segments"] = ranges
+    lock = threading.Lock()
+
+    def save_state() -> None:
+        with lock:
+            with meta_path.open("w", encoding="utf-8") as f:
+                json.dump(validator, f)
+
+    remaining = sum(end - start + 1 - done for start, end, done in ranges)
+    if progress is not None:
+        progress.add_expected_bytes(remaining)
+        pbar = None
+    else:
+        pbar = tqdm(
+            total=size,
+            initial=size - remaining,
+            unit="B",
+            unit_scale=True,
+            desc=f"Downloading {url} ({len(ranges)} segments)",
+            ncols=80,
+        )
+
+    def report(num_bytes: int) -> None:
+        if pbar is not None:
+            with lock:
+                pbar.update(num_bytes)
+        else:
+            progress.update(num_bytes)
+
+    def fetch_segment(segment: List[int]) -> None:
+        start, end, _ = segment
+        attempt = 0
+        while start + segment[2] <= end:
+            offset = start + segment[2]
+            try:
+                request_headers = {
+                    "Range": f"bytes={offset}-{end}",
+                    "If-Range": if_range,
+                }
+                with requests.get(
+                    url,
+                    stream=True,
+                    headers=request_headers,
+                    timeout=DOWNLOAD_TIMEOUT,
+                ) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise ResourceChangedError(f"{url} changed during download")
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        chunk = chunk[: end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        segment[2] += len(chunk)
+                        report(len(chunk))
+                    if offset <= end:
+                        raise requests.ConnectionError(
+                            f"segment {start}-{end} ended early at byte {offset}"
+                        )
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                error = e
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRYABLE_STATUS:
+                    raise
+                error = e
+            else:
+                continue
+
+            attempt += 1
+            if attempt > max_retries:
+                raise error
+            save_state()
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(fetch_segment, segment) for segment in ranges]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+    finally:
+        os.close(fd)
+        if pbar is not None:
+            pbar.close()
+        save_state()
+
+
+def download_file(
+    url: str,
+    dest: Path,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    progress: Optional[FetchProgress] = None,
+    max_retries: int = DOWNLOAD_MAX_RETRIES,
+    backoff: float = DOWNLOAD_BACKOFF_SECONDS,
+    segments: int = DEFAULT_DOWNLOAD_SEGMENTS,
+    algorithm: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Download a file from a URL to dest using streaming to limit memory usage.
+    Data is written to a partial file next to dest, which is kept on failure so
+    that the next attempt (or the next run) resumes with a Range request.
+    Transient network errors are retried with exponential backoff.
+    Files of at least SEGMENTED_DOWNLOAD_THRESHOLD bytes are fetched over
+    `segments` connections when the server advertises byte-range support.
+    If progress is given, bytes are reported to the shared progress instead
+    of a per-file progress bar.
+    If algorithm is given, return the hex digest of the downloaded file. Single
+    stream downloads are hashed on the fly; segmented ones arrive out of order
+    and are hashed once complete.
+    """
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part_path, meta_path = partial_download_paths(dest)
+
+    if segments > 1:
+        try:
+            size, headers = probe_download(url)
+        except requests.RequestException as e:
+            print(f"Could not probe {url} ({e}); using a single connection.")
+            size, headers = 0, {}
+
+        has_validator = headers.get("Last-Modified") or (
+            headers.get("ETag") and not headers["ETag"].startswith("W/")
+        )
+        if (
+            size >= SEGMENTED_DOWNLOAD_THRESHOLD
+            and headers.get("Accept-Ranges", "").lower() == "bytes"
+            and has_validator
+        ):
+            try:
+                download_file_segmented(
+                    url,
+                    part_path,
+                    meta_path,
+                    size,
+                    headers,
+                    segments,
+                    progress=progress,
+                    max_retries=max_retries,
+                    backoff=backoff,
+                )
+                digest = compute_checksum(part_path, algorithm) if algorithm else None
+                part_path.replace(dest)
+                meta_path.unlink()
+                return digest
+            except ResourceChangedError as e:
+                print(f"{e}; restarting with a single connection.")
+                part_path.unlink()
+                meta_path.unlink()
+            except Exception as e:
+                print(f"Failed to download {url} => {dest}: {e}")
+                raise
+
+    attempt = 0
+    while True:
+        try:
+            digest = _download_attempt(
+                url, part_path, meta_path, chunk_size, progress, algorithm
+            )
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in RETRYABLE_STATUS:
+                print(f"Failed to download {url} => {dest}: {e}")
+                raise
+            error = e
+        except Exception as e:
+            print(f"Failed to download {url} => {dest}: {e}")
+            raise
+
+        attempt += 1
+        if attempt > max_retries:
+            print(
+                f"Failed to download {url} => {dest} after {attempt} attempts: {error}"
+            )
+            raise error
+
+        delay = backoff * 2 ** (attempt - 1)
+        print(
+            f"Download of {url} interrupted ({error}); "
+            f"retrying in {delay:.1f}s (attempt {attempt}/{max_retries})"
+        )
+        time.sleep(delay)
+
+    part_path.replace(dest)
+    if meta_path.exists():
+        meta_path.unlink()
+    return digest
+
+
+def copy_filesystem_source(
+    source_path: Path,
+    dest: Path,
+    algorithm: Optional[str] = None,
+    link_mode: str = DEFAULT_LINK_MODE,
+) -> Optional[str]:
     """
     Copy a file or directory from the filesystem/backpack to dest.
+    With a link_mode other than 'copy', files are hardlinked, reflinked or
+    symlinked instead, falling back to a copy when that is not possible.
+    If algorithm is given and a file source is copied, it is hashed during the
+    copy and the hex digest is returned.
     """
 
     # Ensure parent directories exist
     dest.parent.mkdir(parents=True, exist_ok=True)
 
     if source_path.is_file():
-        print(f"Copying file {source_path} => {dest}")
-        shutil.copy2(source_path, dest)
+        if link_mode == "copy":
+            print(f"Copying file {source_path} => {dest}")
+            if algorithm:
+                return copy_file_with_checksum(source_path, dest, algorithm)
+            shutil.copy2(source_path, dest)
+        else:
+            used_mode = materialize_file(source_path, dest, link_mode)
+            print(f"Placed file {source_path} => {dest} ({used_mode})")
     elif source_path.is_dir():
-        print(f"Copying directory {source_path} => {dest}")
-        shutil.copytree(source_path, dest, dirs_exist_ok=True)
+        print(f"Copying directory {source_path} => {dest} (link mode: {link_mode})")
+        materialize_tree(source_path, dest, link_mode)
     else:
         print(f"Source not found: {source_path}")
 
@@ -102,12 +560,25 @@ def copy_filesystem_source(source_path: Path, dest: Path) -> None:
 
 
 def fetch_data_item(
-    data_item: Dict[str, Any], backpack_root: Path, target_location: Path
+    data_item: Dict[str, Any],
+    backpack_root: Path,
+    target_location: Path,
+    progress: Optional[FetchProgress] = None,
+    verification_cache: Optional[VerificationCache] = None,
+    data_store: Optional[DataStore] = None,
+    link_mode: str = DEFAULT_LINK_MODE,
 ) -> None:
     """
     Download or copy data item according to source_type.
     For 'backpack' source_type, treat `source` as relative to backpack_root.
-    If verification checksum is present, verify after fetching.
+    If verification checksum is present, verify after fetching. The checksum
+    is computed while the data streams in, using the algorithm named in the
+    verification block (md5 by default), and recorded in verification_cache
+    if one is given.
+    Items with a checksum are taken from data_store when it already holds
+    them, and added to it once verified.
+    Filesystem and backpack sources are placed using the item's link_mode,
+    or the given link_mode if the item does not set one.
     """
 
     name = data_item.get("name")
@@ -116,6 +587,8 @@ def fetch_data_item(
     # target_location = data_item.get("target_location")
     verification_info = data_item.get("verification", {})
     expected_checksum = verification_info.get("checksum")
+    algorithm = verification_info.get("algorithm", DEFAULT_ALGORITHM)
+    link_mode = data_item.get("link_mode", link_mode)
     post_fetch_op = data_item.get("post_fetch", {})
 
     if not name or not source_type or not source or not target_location:
@@ -123,12 +596,34 @@ def fetch_data_item(
         return
 
     target_path = Path(target_location)
+    stream_algorithm = algorithm if expected_checksum else None
+    actual_checksum = None
 
     if not target_path.exists():
         # Decide how to fetch
-        if source_type == "url":
+        if (
+            data_store is not None
+            and expected_checksum
+            and data_store.materialize(
+                algorithm,
+                expected_checksum,
+                target_path,
+                # A copy must not share its inode with the stored object
+                "reflink" if link_mode == "copy" else link_mode,
+            )
+        ):
+            print(f"Using '{name}' from the shared data store => {target_path}")
+            actual_checksum = expected_checksum.lower()
+
+        elif source_type == "url":
             print(f"Downloading from URL for '{name}'...")
-            download_file(source, target_path)
+            actual_checksum = download_file(
+                source,
+                target_path,
+                progress=progress,
+                segments=int(data_item.get("segments", DEFAULT_DOWNLOAD_SEGMENTS)),
+                algorithm=stream_algorithm,
+            )
 
         elif source_type == "filesystem":
             # ---------------------------------------------
@@ -138,11 +633,15 @@ def fetch_data_item(
             # ---------------------------------------------
             # cleaned_source = source.replace("*.crc.nd.eddu:", "")
             # source_path = Path(cleaned_source)
-            copy_filesystem_source(source, target_path)
+            actual_checksum = copy_filesystem_source(
+                Path(source), target_path, stream_algorithm, link_mode
+            )
 
         elif source_type == "backpack":
             source_in_backpack = (backpack_root / source.lstrip("/")).resolve()
-            copy_filesystem_source(source_in_backpack, target_path)
+            actual_checksum = copy_filesystem_source(
+                source_in_backpack, target_path, stream_algorithm, link_mode
+            )
 
         else:
             print(f"Unsupported source type: {source_type} for '{name}'")
@@ -157,8 +656,14 @@ def fetch_data_item(
     # Verify if we have a checksum
     # Todo: decide if we should raise an exception if checksum is missing and what to do if it fails
     if expected_checksum:
-        if checksum_matches(target_path, expected_checksum):
+        if actual_checksum is None:
+            actual_checksum = compute_checksum(target_path, algorithm)
+        if verification_cache is not None and actual_checksum is not None:
+            verification_cache.record(target_path, algorithm, actual_checksum)
+        if actual_checksum == expected_checksum.lower():
             print(f"Checksum verified for '{name}' => {target_path}")
+            if data_store is not None:
+                data_store.add(target_path, algorithm, actual_checksum, link_mode)
         else:
             print(f"Checksum mismatch for '{name}' => {target_path}")
 
@@ -178,10 +683,93 @@ def fetch_data_item(
                 print(f"Post-fetch operation '{operation_name}' failed for '{name}'")
 
 
-def fetch_data_from_spec(data_yml_path: str, backpack_root: str = ".") -> None:
+def fetch_spec_item(
+    item: Dict[str, Any],
+    backpack_root_path: Path,
+    workflow_root_path: Path,
+    progress: Optional[FetchProgress] = None,
+    verification_cache: Optional[VerificationCache] = None,
+    reverify: bool = False,
+    data_store: Optional[DataStore] = None,
+    link_mode: str = DEFAULT_LINK_MODE,
+) -> None:
+    """
+    Fetch a single item of a data spec unless it is already present and verified.
+    An existing file is trusted without rehashing if verification_cache holds a
+    matching digest for it and reverify is False.
+    """
+
+    name = item.get("name", "<unnamed>")
+    target_location = item.get("target_location")
+    verification_info = item.get("verification", {})
+    expected_checksum = verification_info.get("checksum", None)
+    algorithm = verification_info.get("algorithm", DEFAULT_ALGORITHM)
+
+    if not target_location:
+        print(f"Item '{name}' has no 'target_location'; skipping.")
+        return
+
+    target_path = workflow_root_path / target_location
+    already_exists = target_path.exists()
+
+    # If item already exists, optionally verify checksum
+    if already_exists and expected_checksum and target_path.is_file():
+        actual_checksum = None
+        if verification_cache is not None and not reverify:
+            actual_checksum = verification_cache.lookup(target_path, algorithm)
+            if actual_checksum == expected_checksum.lower():
+                print(f"Data item '{name}' already exists and was verified before.")
+                return
+
+        actual_checksum = compute_checksum(target_path, algorithm)
+        if verification_cache is not None and actual_checksum is not None:
+            verification_cache.record(target_path, algorithm, actual_checksum)
+
+        if actual_checksum == expected_checksum.lower():
+            print(f"Data item '{name}' already exists and matches checksum.")
+            return
+        else:
+            print(f"Data item '{name}' exists but checksum mismatch; re-fetching.")
+            target_path.unlink()
+
+    # If item is missing or mismatch, fetch
+    fetch_data_item(
+        item,
+        backpack_root_path,
+        target_path,
+        progress=progress,
+        verification_cache=verification_cache,
+        data_store=data_store,
+        link_mode=link_mode,
+    )
+
+
+def _timed_fetch_spec_item(item: Dict[str, Any], *args) -> None:
+    with timed_phase("data_item", item=item.get("name", "<unnamed>")):
+        fetch_spec_item(item, *args)
+
+
+def fetch_data_from_spec(
+    data_yml_path: str,
+    backpack_root: str = ".",
+    fetch_jobs: int = DEFAULT_FETCH_JOBS,
+    base_dir: Optional[str] = None,
+    reverify: bool = False,
+    data_cache_size: Optional[int] = None,
+    link_mode: str = DEFAULT_LINK_MODE,
+    use_data_store: bool = False,
+) -> None:
     """
     Fetch data from the specification file, if not already present or verified.
     Uses backpack_root as the root for any 'backpack' type sources.
+    Up to fetch_jobs items are fetched concurrently. Raises DataFetchError after
+    all items have finished if any of them failed.
+    If base_dir is given, checksums are remembered in a verification database
+    there, and unchanged files are not rehashed unless reverify is True.
+    If use_data_store is True, items with a checksum are also shared across
+    runs through the data store in base_dir, which is kept under
+    data_cache_size bytes if given.
+    link_mode is the default way of placing filesystem and backpack sources.
     """
 
     spec_path = Path(data_yml_path)
@@ -207,35 +795,77 @@ def fetch_data_from_spec(data_yml_path: str, backpack_root: str = ".") -> None:
     # If the move the workflow to a different location, we need to update this.
     workflow_root_path = backpack_root_path / "workflow"
 
-    for item in data_spec["data"]:
-        name = item.get("name", "<unnamed>")
-        target_location = item.get("target_location")
-        expected_checksum = item.get("verification", {}).get("checksum", None)
-
-        if not target_location:
-            print(f"Item '{name}' has no 'target_location'; skipping.")
-            continue
-
-        target_path = workflow_root_path / target_location
-        already_exists = target_path.exists()
-
-        # If item already exists, optionally verify checksum
-        if already_exists and expected_checksum and target_path.is_file():
-            if checksum_matches(target_path, expected_checksum):
-                print(f"Data item '{name}' already exists and matches checksum.")
-                continue
-            else:
-                print(f"Data item '{name}' exists but checksum mismatch; re-fetching.")
+    items = data_spec["data"]
+    progress = FetchProgress(total_items=len(items))
+    verification_cache = None
+    data_store = None
+    if base_dir:
+        verification_cache = VerificationCache(Path(base_dir) / VERIFICATION_DB_NAME)
+        if use_data_store:
+            data_store = DataStore(
+                Path(base_dir) / DATA_STORE_DIR_NAME, data_cache_size
+            )
 
-        # If item is missing or mismatch, fetch
-        fetch_data_item(item, backpack_root_path, target_path)
-
-
-def ensure_data_is_fetched(data_yml_path: str, backpack_root: str = ".") -> None:
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, fetch_jobs)) as executor:
+            futures = []
+            for item in items:
+                future = executor.submit(
+                    _timed_fetch_spec_item,
+                    item,
+                    backpack_root_path,
+                    workflow_root_path,
+                    progress,
+                    verification_cache,
+                    reverify,
+                    data_store,
+                    link_mode,
+                )
+                future.add_done_callback(lambda _: progress.item_done())
+                futures.append(future)
+
+            # Collect failures in spec order, not completion order
+            failures = []
+            for item, future in zip(items, futures):
+                error = future.exception()
+                if error is not None:
+                    failures.append((item.get("name", "<unnamed>"), error))
+    finally:
+        progress.close()
+        if verification_cache is not None:
+            verification_cache.close()
+        if data_store is not None:
+            data_store.close()
+
+    if failures:
+        for name, error in failures:
+            print(f"Failed to fetch data item '{name}': {error}")
+        raise DataFetchError(failures)
+
+
+def ensure_data_is_fetched(
+    data_yml_path: str,
+    backpack_root: str = ".",
+    fetch_jobs: int = DEFAULT_FETCH_JOBS,
+    base_dir: Optional[str] = None,
+    reverify: bool = False,
+    data_cache_size: Optional[int] = None,
+    link_mode: str = DEFAULT_LINK_MODE,
+    use_data_store: bool = False,
+) -> None:
     """
     Public API to ensure data from data.yml is present and correct.
     If not, fetches it using fetch_data_from_spec.
     """
 
     print("Ensuring data is fetched according to spec...")
-    fetch_data_from_spec(data_yml_path, backpack_root)
+    fetch_data_from_spec(
+        data_yml_path,
+        backpack_root,
+        fetch_jobs,
+        base_dir,
+        reverify,
+        data_cache_size,
+        link_mode,
+        use_data_store,
+    )
@@ -0,0 +1,220 @@
+"""
+Content-addressed store for data items, shared by all runs and backpacks that
+use the same base directory.
+
+Objects are kept under <base_dir>/flo_data_store/objects/<algorithm>/<digest>
+and are linked into target locations instead of being fetched again. An index
+records each object's size, stat and last use, which drives LRU eviction.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .utils import materialize_file
+
+DATA_STORE_DIR_NAME = "flo_data_store"
+
+
+class DataStore:
+    """
+    Content-addressed data store keyed by (algorithm, digest).
+    If max_size is given, least recently used objects are evicted after each
+    addition until the store fits in max_size bytes.
+    """
+
+    def __init__(self, root: Path, max_size: Optional[int] = None):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.root / "index.db"), timeout=30, check_same_thread=False
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    algorithm TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (algorithm, digest)
+                )
+                """
+            )
+
+    def object_path(self, algorithm: str, digest: str) -> Path:
+        return self.objects_dir / algorithm.lower() / digest[:2] / digest
+
+    def lookup(self, algorithm: str, digest: str) -> Optional[Path]:
+        """
+        Return the path of the stored object, or None if it is missing or was
+        modified after it was added (in which case it is dropped).
+        """
+
+        algorithm, digest = algorithm.lower(), digest.lower()
+        path = self.object_path(algorithm, digest)
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT inode, size, mtime_ns FROM objects "
+                "WHERE algorithm = ? AND digest = ?",
+                (algorithm, digest),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if st is None or tuple(row) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            print(f"[cache] Dropping missing or modified object {digest}")
+            self._remove(algorithm, digest)
+            return None
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE objects SET last_used = ? WHERE algorithm = ? AND digest = ?",
+                (time.time(), algorithm, digest),
+            )
+        return path
+
+    def add(
+        self,
+        file_path: Path,
+        algorithm: str,
+        digest: str,
+        link_mode: str = "copy",
+    ) -> Optional[Path]:
+        """
+        Add a verified file to the store. The file is reflinked into the store
+        where possible. Otherwise it is hardlinked if link_mode allows sharing
+        its inode ('hardlink' or 'auto'), and copied in every other case, so
+        that editing the file cannot change the stored object.
+        Return the object path, or None if the file could not be added.
+        """
+
+        algorithm, digest = algorithm.lower(), digest.lower()
+        existing = self.lookup(algorithm, digest)
+        if existing is not None:
+            return existing
+
+        path = self.object_path(algorithm, digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(
+            f".{digest}.{os.getpid()}.{threading.get_ident()}"
+        )
+
+        try:
+            materialize_file(
+                file_path,
+                temp_path,
+                "auto" if link_mode in ("hardlink", "auto") else "reflink",
+            )
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"[cache] Could not add {file_path} to data store: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            return None
+
+        st = os.stat(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO objects "
+                "(algorithm, digest, size, inode, mtime_ns, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    algorithm,
+                    digest,
+                    st.st_size,
+                    st.st_ino,
+                    st.st_mtime_ns,
+                    time.time(),
+                ),
+            )
+
+        if self.max_size is not None:
+            self.gc(self.max_size)
+        return path
+
+    def materialize(
+        self, algorithm: str, digest: str, dest: Path, link_mode: str = "hardlink"
+    ) -> bool:
+        """
+        Place the stored object at dest with the given link mode (see
+        utils.materialize_file), which falls back to a copy if linking is not
+        possible. Return False if the object is not in the store.
+        """
+
+        path = self.lookup(algorithm, digest)
+        if path is None:
+            return False
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        materialize_file(path, dest, link_mode)
+        return True
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        Return all stored objects, least recently used first.
+        """
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT algorithm, digest, size, last_used FROM objects "
+                "ORDER BY last_used"
+            ).fetchall()
+        return [
+            {"algorithm": a, "digest": d, "size": size, "last_used": last_used}
+            for a, d, size, last_used in rows
+        ]
+
+    def total_size(self) -> int:
+        return sum(entry["size"] for entry in self.entries())
+
+    def gc(self, max_size: int = 0) -> List[Dict[str, Any]]:
+        """
+        Evict least recently used objects until the store holds at most
+        max_size bytes. Return the evicted entries.
+        """
+
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        evicted = []
+
+        for entry in entries:
+            if total <= max_size:
+                break
+            self._remove(entry["algorithm"], entry["digest"])
+            total -= entry["size"]
+            evicted.append(entry)
+
+        return evicted
+
+    def _remove(self, algorithm: str, digest: str) -> None:
+        path = self.object_path(algorithm, digest)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM objects WHERE algorithm = ? AND digest = ?",
+                (algorithm, digest),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
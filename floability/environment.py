@@ -1,5 +1,10 @@
 # environment.py
+import bz2
+import contextlib
+import gzip
+import lzma
 import os
+import platform
 import yaml  # pyyaml needed
 import json
 import shutil
@@ -8,6 +13,483 @@ import tempfile
 import subprocess
 import hashlib
 import textwrap
+import threading
+import time
+from pathlib import Path
+
+from .activation import get_activation
+from .layers import (
+    DELTA_MARKER,
+    compose_environment,
+    compose_full_pack,
+    delta_matches_base,
+    is_delta_pack,
+    make_delta_pack,
+)
+from .pack_registry import PackExistsError, PackRegistry, PackRegistryError
+from .prefix_rewriter import unpack_environment
+from .report import timed_phase
+from .utils import (
+    detect_compression,
+    file_lock,
+    hold_shared_lock,
+    make_read_only,
+    open_decompressed,
+    remove_tree,
+    run_logged,
+    safe_extract_tar,
+    try_file_lock,
+)
+
+EXTRACTED_ENV_DIR_NAME = "extracted"
+
+# Number of extracted environments kept in the cache. When a new one is
+# extracted, the least recently used ones beyond it are removed unless a
+# run still uses them.
+EXTRACTED_ENV_LIMIT = 8
+
+# Lock files of the extracted environments this process uses, held shared
+# until it exits so that no other process evicts them
+_environments_in_use = {}
+
+# Formats create_conda_pack_from_yml can produce. vine_factory's --poncho-env
+# only accepts gzip, so worker environments are always packed as tar.gz.
+PACK_FORMATS = ["tar.gz", "tar.zst"]
+DEFAULT_PACK_FORMAT = "tar.gz"
+
+# Suffixes of prebuilt environment packs that can be used directly
+PACK_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.zst", ".tar.bz2", ".tar.xz")
+
+# Read size when recompressing a pack for workers
+REPACK_CHUNK_SIZE = 1 << 20
+
+
+# Bump when the fingerprint's canonical form or the way environments are
+# built changes, so that packs built the old way are not reused
+FINGERPRINT_VERSION = 1
+
+# First line of floability's lockfiles, followed by the environment fingerprint
+LOCKFILE_FINGERPRINT_HEADER = "# floability-fingerprint: "
+
+# Packages added to every environment built from an environment.yml
+REQUIRED_PACKAGES = ["python", "jupyter", "ndcctools", "cloudpickle"]
+
+# Top-level keys of environment.yml that do not affect the built environment
+IGNORED_SPEC_KEYS = {"name", "prefix", "post_install_script"}
+
+
+def conda_subdir() -> str:
+    """
+    Return the conda platform subdir (e.g. linux-64) environments are built for.
+    """
+
+    if os.environ.get("CONDA_SUBDIR"):
+        return os.environ["CONDA_SUBDIR"]
+
+    system = {"Linux": "linux", "Darwin": "osx", "Windows": "win"}.get(
+        platform.system(), platform.system().lower()
+    )
+    machine = platform.machine().lower()
+    arch = {
+        "x86_64": "64",
+        "amd64": "64",
+        "aarch64": "aarch64",
+        "arm64": "arm64" if system == "osx" else "aarch64",
+        "ppc64le": "ppc64le",
+        "i686": "32",
+        "i386": "32",
+    }.get(machine, machine)
+    return f"{system}-{arch}"
+
+
+def _canonical_spec(spec: str) -> str:
+    # 'numpy >=1.24' and 'numpy>=1.24' describe the same requirement
+    return "".join(str(spec).split())
+
+
+def environment_fingerprint(
+    env_data: dict, solver: str, post_install_script: str = None
+) -> str:
+    """
+    Return a sha256 fingerprint of the environment that env_data (the parsed
+    environment.yml, including injected packages and variables) builds.
+
+    Dependencies and pip requirements are compared as sets, so their order,
+    comments, formatting and the environment name do not matter. Channel
+    order is kept because it sets channel priority. The contents of the
+    post-install script, the platform and the solver are part of the key.
+    """
+
+    conda_deps = set()
+    pip_deps = set()
+    other_deps = []
+    for dep in env_data.get("dependencies") or []:
+        if isinstance(dep, dict) and "pip" in dep:
+            pip_deps.update(_canonical_spec(req) for req in dep["pip"] or [])
+        elif isinstance(dep, dict):
+            other_deps.append(dep)
+        else:
+            conda_deps.add(_canonical_spec(dep))
+
+    script_digest = None
+    if post_install_script:
+        with open(post_install_script, "rb") as f:
+            script_digest = hashlib.sha256(f.read()).hexdigest()
+
+    canonical = {
+        "version": FINGERPRINT_VERSION,
+        "platform": conda_subdir(),
+        "solver": solver,
+        "channels": [str(c).strip() for c in env_data.get("channels") or []],
+        "dependencies": sorted(conda_deps),
+        "pip": sorted(pip_deps),
+        "other_dependencies": other_deps,
+        "variables": env_data.get("variables") or {},
+        "post_install_script": script_digest,
+        "other": {
+            key: value
+            for key, value in env_data.items()
+            if key
+            not in IGNORED_SPEC_KEYS | {"channels", "dependencies", "variables"}
+        },
+    }
+    encoded = json.dumps(canonical, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def load_environment_spec(env_yml: str) -> tuple:
+    """
+    Parse env_yml and add the packages and variables floability needs.
+    Return the spec and the absolute path of its post-install script (or None).
+    """
+
+    with open(env_yml, "r") as f:
+        env_data = yaml.safe_load(f) or {}
+
+    if not env_data.get("dependencies"):
+        env_data["dependencies"] = []
+
+    for pkg in REQUIRED_PACKAGES:
+        if pkg not in env_data["dependencies"]:
+            env_data["dependencies"].append(pkg)
+
+    if not env_data.get("variables"):
+        env_data["variables"] = {}
+
+    # Check for post-installation script in the environment YAML
+    post_install_script = env_data.get("post_install_script", None)
+
+    if post_install_script:
+        script_dir = os.path.dirname(os.path.abspath(env_yml))
+        if not os.path.isabs(post_install_script):
+            post_install_script = os.path.join(script_dir, post_install_script)
+
+    if post_install_script and not os.path.exists(post_install_script):
+        print(
+            f"[environment] Post-installation script not found: {post_install_script}"
+        )
+        post_install_script = None
+
+    return env_data, post_install_script
+
+
+def _log(log_prefix: str, message: str) -> None:
+    # A single write per line keeps lines of concurrent builds from merging
+    line = f"{log_prefix} {message}" if log_prefix else message
+    print(f"{line}\n", end="", flush=True)
+
+
+def is_environment_pack(path: str) -> bool:
+    return str(path).endswith(PACK_SUFFIXES)
+
+
+def lockfile_paths(prefix: str) -> tuple:
+    """
+    Return the explicit conda lockfile and pip requirements file that belong
+    to prefix, e.g. a pack path without its archive suffix.
+    """
+
+    for suffix in PACK_SUFFIXES + (".yml", ".yaml"):
+        if prefix.endswith(suffix):
+            prefix = prefix[: -len(suffix)]
+            break
+
+    # A delta layer shares the lockfile of the full environment
+    delta_suffix = DELTA_MARKER.rstrip(".")
+    if prefix.endswith(delta_suffix):
+        prefix = prefix[: -len(delta_suffix)]
+    return f"{prefix}.explicit.txt", f"{prefix}.pip.txt"
+
+
+def read_lockfile_fingerprint(explicit_file: str) -> str:
+    """
+    Return the environment fingerprint recorded in an explicit lockfile,
+    or None if the file is missing or was not written by floability.
+    """
+
+    try:
+        with open(explicit_file, "r") as f:
+            for line in f:
+                if line.startswith(LOCKFILE_FINGERPRINT_HEADER):
+                    return line[len(LOCKFILE_FINGERPRINT_HEADER) :].strip()
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _write_atomic(path: str, content: str) -> None:
+    # Unique per thread: main and worker builds may write the same file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def write_lockfile(
+    env_path: str,
+    explicit_file: str,
+    pip_file: str,
+    fingerprint: str,
+    log_prefix: str = None,
+) -> None:
+    """
+    Record the exact packages installed in env_path: conda packages as an
+    explicit list of URLs with md5 hashes, and pip-installed packages as
+    pinned requirements. Both files carry the environment fingerprint so a
+    lockfile is never applied to a different spec.
+    """
+
+    explicit = subprocess.run(
+        ["conda", "list", "--prefix", env_path, "--explicit", "--md5"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    listing = subprocess.run(
+        ["conda", "list", "--prefix", env_path, "--json"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    pip_packages = sorted(
+        f"{pkg['name']}=={pkg['version']}"
+        for pkg in json.loads(listing)
+        if pkg.get("channel") == "pypi"
+    )
+
+    header = f"{LOCKFILE_FINGERPRINT_HEADER}{fingerprint}\n"
+    _write_atomic(explicit_file, header + explicit)
+    _write_atomic(pip_file, header + "".join(f"{p}\n" for p in pip_packages))
+    _log(log_prefix, f"[environment] Lockfile written: {explicit_file}")
+
+
+def create_environment_from_lockfile(
+    explicit_file: str,
+    pip_file: str,
+    env_path: str,
+    variables: dict,
+    log_prefix: str = None,
+) -> None:
+    """
+    Create the environment at env_path from an explicit lockfile. No
+    dependency solving takes place: conda downloads and links exactly the
+    listed packages, and pip installs the pinned packages without resolving
+    their dependencies.
+    """
+
+    _log(
+        log_prefix,
+        f"[environment] Creating env from lockfile '{explicit_file}' (no solve)...",
+    )
+    cmd_create = [
+        "conda",
+        "create",
+        "--yes",
+        "--prefix",
+        env_path,
+        "--file",
+        explicit_file,
+    ]
+    run_logged(cmd_create, log_prefix)
+
+    with open(pip_file, "r") as f:
+        has_pip_packages = any(
+            line.strip() and not line.startswith("#") for line in f
+        )
+
+    if has_pip_packages:
+        cmd_pip = [
+            os.path.join(env_path, "bin", "python"),
+            "-m",
+            "pip",
+            "install",
+            "--no-deps",
+            "-r",
+            pip_file,
+        ]
+        run_logged(cmd_pip, log_prefix)
+
+    env_vars = [f"{k}={v}" for k, v in variables.items() if v is not None]
+    if env_vars:
+        cmd_vars = ["conda", "env", "config", "vars", "set", "--prefix", env_path]
+        run_logged(cmd_vars + env_vars, log_prefix)
+
+
+def find_lockfile(env_yml: str, pack_file: str, fingerprint: str) -> tuple:
+    """
+    Return the (explicit, pip) lockfile pair to rebuild an environment
+    without solving: the one cached next to pack_file, or else one shipped
+    next to env_yml (e.g. in a backpack's software/ directory). Only
+    lockfiles recorded for the same fingerprint are returned.
+    """
+
+    candidates = (lockfile_paths(pack_file), lockfile_paths(env_yml))
+    for explicit_file, pip_file in candidates:
+        if (
+            read_lockfile_fingerprint(explicit_file) == fingerprint
+            and read_lockfile_fingerprint(pip_file) == fingerprint
+        ):
+            return explicit_file, pip_file
+    return None
+
+
+def pack_environment(
+    env_path: str, output_file: str, pack_format: str, log_prefix: str = None
+) -> None:
+    """
+    Pack the environment at env_path into output_file using all available
+    cores: conda-pack's threaded gzip for tar.gz, and multi-threaded zstd
+    for tar.zst. An uncompressed tar is only used as an intermediate step.
+    """
+
+    if pack_format == "tar":
+        cmd_pack = [
+            "conda-pack",
+            "-p",
+            env_path,
+            "-o",
+            output_file,
+            "--format",
+            "tar",
+            "--force",
+        ]
+        run_logged(cmd_pack, log_prefix)
+
+    elif pack_format == "tar.gz":
+        cmd_pack = [
+            "conda-pack",
+            "-p",
+            env_path,
+            "-o",
+            output_file,
+            "--force",
+            "--n-threads",
+            "-1",
+        ]
+        run_logged(cmd_pack, log_prefix)
+
+    elif pack_format == "tar.zst":
+        if not shutil.which("zstd"):
+            raise RuntimeError("Packing as tar.zst requires the 'zstd' tool.")
+
+        tar_file = output_file[: -len(".zst")]
+        cmd_pack = [
+            "conda-pack",
+            "-p",
+            env_path,
+            "-o",
+            tar_file,
+            "--format",
+            "tar",
+            "--force",
+        ]
+        run_logged(cmd_pack, log_prefix)
+        cmd_compress = ["zstd", "-T0", "-q", "-f", "--rm", tar_file, "-o", output_file]
+        run_logged(cmd_compress, log_prefix)
+
+    else:
+        raise ValueError(f"Unsupported pack format: {pack_format}")
+
+
+def repack_as_gzip(environment_pack: str, output_file: str) -> None:
+    """
+    Recompress environment_pack, e.g. a tar.zst pack, into the tar.gz pack
+    output_file without unpacking it. pigz compresses on all cores when it is
+    available.
+    """
+
+    with contextlib.ExitStack() as stack:
+        stream = stack.enter_context(open_decompressed(Path(environment_pack)))
+        if stream is None:
+            compression = detect_compression(Path(environment_pack))
+            opener = {"gzip": gzip.open, "bzip2": bz2.open, "xz": lzma.open}
+            stream = stack.enter_context(
+                opener.get(compression, open)(environment_pack, "rb")
+            )
+        out = stack.enter_context(open(output_file, "wb"))
+
+        if shutil.which("pigz"):
+            proc = subprocess.Popen(["pigz", "-c"], stdin=subprocess.PIPE, stdout=out)
+            try:
+                shutil.copyfileobj(stream, proc.stdin, REPACK_CHUNK_SIZE)
+            finally:
+                proc.stdin.close()
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, "pigz")
+        else:
+            with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) as dst:
+                shutil.copyfileobj(stream, dst, REPACK_CHUNK_SIZE)
+
+
+def extract_environment_pack(environment_pack: str, dest_dir: str) -> None:
+    """
+    Extract environment_pack into dest_dir. The compression format is detected
+    from the file contents, and pigz or zstd decompress it in a separate
+    process when available, in parallel with unpacking the tar stream.
+    """
+
+    with open_decompressed(Path(environment_pack)) as stream:
+        safe_extract_tar(Path(environment_pack), Path(dest_dir), fileobj=stream)
+
+
+def export_lockfile(
+    env_yml: str,
+    dest_dir: str,
+    solver: str = "libmamba",
+    base_dir: str = "/tmp",
+    registry: PackRegistry = None,
+) -> tuple:
+    """
+    Write the lockfile of the environment built from env_yml into dest_dir,
+    named after env_yml (e.g. environment.explicit.txt and environment.pip.txt).
+    The environment is built and packed into the cache first if no lockfile
+    for it is cached yet. Return the written (explicit, pip) paths.
+    """
+
+    env_data, post_install_script = load_environment_spec(env_yml)
+    fingerprint = environment_fingerprint(env_data, solver, post_install_script)
+    cached = os.path.join(base_dir, "flo_common_env", f"env_{fingerprint}")
+    cached_lockfile = lockfile_paths(cached)
+
+    if read_lockfile_fingerprint(cached_lockfile[0]) != fingerprint:
+        pack_file = create_conda_pack_from_yml(
+            env_yml=env_yml,
+            solver=solver,
+            force=True,
+            base_dir=base_dir,
+            registry=registry,
+        )
+        cached_lockfile = lockfile_paths(pack_file)
+
+    os.makedirs(dest_dir, exist_ok=True)
+    name = os.path.basename(env_yml)
+    dest_lockfile = lockfile_paths(os.path.join(dest_dir, name))
+    for source, dest in zip(cached_lockfile, dest_lockfile):
+        shutil.copyfile(source, dest)
+        print(f"[environment] Lockfile exported to {dest}")
+
+    return dest_lockfile
 
 
 def create_conda_pack_from_yml(
@@ -18,63 +500,333 @@ def create_conda_pack_from_yml(
     base_dir: str = "/tmp",
     run_dir: str = "/tmp",
     manager_name: str = None,
+    pack_format: str = DEFAULT_PACK_FORMAT,
+    log_prefix: str = None,
+    registry: PackRegistry = None,
+    layered: bool = False,
 ) -> str:
+    """
+    Return a pack of the environment described by env_yml, reusing a pack of
+    the same fingerprint from the local cache or from registry, and building
+    (and publishing to registry) only if neither has one.
+
+    With layered, the pack is a delta layer over the shared base layer of
+    REQUIRED_PACKAGES (see layers.py), which is built or fetched first.
+    """
+
     common_env_dir = os.path.join(base_dir, "flo_common_env")
     os.makedirs(common_env_dir, exist_ok=True)
 
+    # manager_name is not written into the pack, which is shared between runs;
+    # each run passes it to its processes instead (see activation.run_variables)
+    env_data, post_install_script = load_environment_spec(env_yml)
+
+    with timed_phase("env_hash", env=env_yml):
+        fingerprint = environment_fingerprint(env_data, solver, post_install_script)
+
+    base_pack = None
+    if layered:
+        base_pack = create_base_layer(
+            env_data, solver, base_dir, pack_format, log_prefix, registry
+        )
+
+    # Name the pack after what it contains, so equivalent specs share it
+    pack_name = f"env_{fingerprint}{DELTA_MARKER if layered else '.'}{pack_format}"
     if output_file is None:
-        # Generate a unique filename based on the hash of the environment file conent
-        with open(env_yml, "r") as f:
-            raw_content = f.read()
-        cleaned_content = "".join(raw_content.split())
-        file_hash = hashlib.md5(cleaned_content.encode("utf-8")).hexdigest()
+        output_file = os.path.join(common_env_dir, pack_name)
 
-        output_file = os.path.join(common_env_dir, f"env_{file_hash}.tar.gz")
+    _log(log_prefix, f"[environment] Output file: {output_file}")
 
-    print(f"[environment] Output file: {output_file}")
+    stale = set()
 
-    if os.path.exists(output_file) and not force:
-        print(
+    def is_current(pack: str) -> bool:
+        # A delta layer is only usable with the base it was computed against
+        if not layered or delta_matches_base(pack, base_pack):
+            return True
+        if pack not in stale:
+            stale.add(pack)
+            _log(
+                log_prefix,
+                f"[environment] '{pack}' was built against a different base "
+                "layer; rebuilding it.",
+            )
+        return False
+
+    if os.path.exists(output_file) and not force and is_current(output_file):
+        _log(
+            log_prefix,
             f"[environment] '{output_file}' already exists. Skipping environment creation."
         )
         return output_file
 
-    required_packages = ["python", "jupyter", "ndcctools", "cloudpickle"]
+    # Concurrent runs needing the same pack wait for a single build
+    requested_at = time.time()
+    with file_lock(f"{output_file}.lock"):
+        if (
+            os.path.exists(output_file)
+            and (not force or os.path.getmtime(output_file) >= requested_at)
+            and is_current(output_file)
+        ):
+            _log(
+                log_prefix,
+                f"[environment] Reusing '{output_file}' built by another process.",
+            )
+            return output_file
 
-    temp_dir = tempfile.mkdtemp(prefix="conda_env_")
-    env_path = os.path.join(temp_dir, "env")
+        # Pack under a temporary name in the same directory (keeping the
+        # format suffix), so the pack appears at output_file only when complete
+        output_dir, output_name = os.path.split(os.path.abspath(output_file))
+        temp_output = os.path.join(output_dir, f".{os.getpid()}_{output_name}")
+        # A delta layer is computed from the full environment, packed as an
+        # uncompressed tar that is not kept, so that only the delta is
+        # compressed
+        full_output = temp_output
+        full_format = pack_format
+        if layered:
+            full_format = "tar"
+            full_output = os.path.join(
+                output_dir, f".{os.getpid()}_full_env_{fingerprint}.tar"
+            )
+        registry_name = pack_name
+        try:
+            if (
+                registry is not None
+                and not force
+                and _fetch_from_registry(
+                    registry, registry_name, temp_output, log_prefix
+                )
+                and is_current(temp_output)
+            ):
+                os.replace(temp_output, output_file)
+                _fetch_lockfile_from_registry(registry, output_file, log_prefix)
+                return output_file
+
+            _build_conda_pack(
+                env_yml,
+                env_data,
+                post_install_script,
+                fingerprint,
+                solver,
+                output_file,
+                full_output,
+                full_format,
+                log_prefix,
+            )
+
+            if layered:
+                with timed_phase("delta", pack=pack_name):
+                    counts = make_delta_pack(
+                        full_output, base_pack, temp_output, pack_format
+                    )
+                _log(
+                    log_prefix,
+                    f"[environment] Delta layer holds {counts['delta']} members, "
+                    f"{counts['from_base']} shared with the base layer "
+                    f"({os.path.getsize(temp_output)} bytes packed, of "
+                    f"{os.path.getsize(full_output)} bytes in the environment)",
+                )
+            os.replace(temp_output, output_file)
+        finally:
+            for path in {temp_output, full_output}:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    _log(log_prefix, f"[environment] Environment successfully packed: {output_file}")
+
+    if registry is not None:
+        try:
+            with timed_phase("registry_publish", pack=registry_name):
+                # The lockfile goes first, so whoever finds the pack finds it too
+                for path in lockfile_paths(output_file):
+                    if os.path.exists(path):
+                        _publish_if_missing(registry, path)
+                registry.publish(output_file, registry_name)
+            _log(
+                log_prefix,
+                f"[registry] Published {registry_name} to {registry.location}",
+            )
+        except PackExistsError:
+            _log(
+                log_prefix,
+                f"[registry] {registry_name} was already published to "
+                f"{registry.location}",
+            )
+        except PackRegistryError as e:
+            # Other nodes build the environment themselves
+            _log(log_prefix, f"[registry] {e}")
+
+    return output_file
+
+
+def _fetch_from_registry(
+    registry: PackRegistry, name: str, dest: str, log_prefix: str = None
+) -> bool:
+    """
+    Copy the pack called name from registry to dest. Return whether it was
+    found; registry errors are reported and treated as a miss.
+    """
 
     try:
-        with open(env_yml, "r") as f:
-            env_data = yaml.safe_load(f)
+        with timed_phase("registry_fetch", pack=name):
+            found = registry.fetch(name, dest)
+    except PackRegistryError as e:
+        _log(log_prefix, f"[registry] {e}")
+        return False
 
-        if "dependencies" not in env_data:
-            env_data["dependencies"] = []
+    if found:
+        _log(log_prefix, f"[registry] Fetched {name} from {registry.location}")
+    else:
+        _log(log_prefix, f"[registry] {name} not in {registry.location}, building")
+    return found
 
-        for pkg in required_packages:
-            if pkg not in env_data["dependencies"]:
-                env_data["dependencies"].append(pkg)
 
-        if "variables" not in env_data:
-            env_data["variables"] = {}
+def _fetch_lockfile_from_registry(
+    registry: PackRegistry, pack_file: str, log_prefix: str = None
+) -> None:
+    """
+    Fetch the lockfile published with the pack at pack_file into place next to
+    it, so the environment can be rebuilt without solving. Packs published
+    without a lockfile are left without one.
+    """
 
-        if manager_name is None:
-            env_data["variables"]["VINE_MANAGER_NAME"] = manager_name
+    for path in lockfile_paths(pack_file):
+        if os.path.exists(path):
+            continue
+        name = os.path.basename(path)
+        temp_path = os.path.join(os.path.dirname(path), f".{os.getpid()}_{name}")
+        try:
+            if registry.fetch(name, temp_path):
+                os.replace(temp_path, path)
+                _log(log_prefix, f"[registry] Fetched {name} from {registry.location}")
+        except PackRegistryError as e:
+            _log(log_prefix, f"[registry] {e}")
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
 
-        # Check for post-installation script in the environment YAML
-        post_install_script = env_data.get("post_install_script", None)
 
-        if post_install_script:
-            script_dir = os.path.dirname(env_yml)
-            if not os.path.isabs(post_install_script):
-                post_install_script = os.path.join(script_dir, post_install_script)
+def _publish_if_missing(registry: PackRegistry, path: str) -> None:
+    try:
+        registry.publish(path, os.path.basename(path))
+    except PackExistsError:
+        pass
 
-        print(
+
+def create_base_layer(
+    env_data: dict,
+    solver: str = "libmamba",
+    base_dir: str = "/tmp",
+    pack_format: str = DEFAULT_PACK_FORMAT,
+    log_prefix: str = None,
+    registry: PackRegistry = None,
+) -> str:
+    """
+    Return the base layer pack for environments using the channels of
+    env_data: REQUIRED_PACKAGES alone, built once and cached like any other
+    environment pack.
+    """
+
+    common_env_dir = os.path.join(base_dir, "flo_common_env")
+    os.makedirs(common_env_dir, exist_ok=True)
+
+    base_spec = {
+        "name": "floability-base",
+        "channels": list(env_data.get("channels") or []),
+        "dependencies": list(REQUIRED_PACKAGES),
+    }
+    encoded = json.dumps(base_spec, sort_keys=True).encode("utf-8")
+    base_yml = os.path.join(
+        common_env_dir, f"base_{hashlib.sha256(encoded).hexdigest()[:16]}.yml"
+    )
+    if not os.path.exists(base_yml):
+        _write_atomic(base_yml, yaml.safe_dump(base_spec))
+
+    return create_conda_pack_from_yml(
+        env_yml=base_yml,
+        solver=solver,
+        base_dir=base_dir,
+        pack_format=pack_format,
+        log_prefix=log_prefix,
+        registry=registry,
+    )
+
+
+def get_worker_pack(environment_pack: str, base_dir: str = "/tmp") -> str:
+    """
+    Return a tar.gz pack workers can use for environment_pack. vine_factory
+    ships a single gzip pack, so a delta layer is composed with its base into
+    a full pack, and a pack in another format is recompressed, in both cases
+    cached next to environment_pack.
+    """
+
+    output_dir, name = os.path.split(os.path.abspath(environment_pack))
+    if is_delta_pack(environment_pack):
+        stem = name.split(DELTA_MARKER)[0]
+    elif detect_compression(Path(environment_pack)) != "gzip":
+        stem = next(
+            name[: -len(suffix)] for suffix in PACK_SUFFIXES if name.endswith(suffix)
+        )
+    else:
+        return environment_pack
+
+    output_file = os.path.join(output_dir, f"{stem}.tar.gz")
+    if os.path.exists(output_file):
+        return output_file
+
+    with file_lock(f"{output_file}.lock"):
+        if os.path.exists(output_file):
+            return output_file
+
+        temp_output = os.path.join(
+            output_dir, f".{os.getpid()}_{os.path.basename(output_file)}"
+        )
+        try:
+            if is_delta_pack(environment_pack):
+                with timed_phase("worker_compose", pack=name):
+                    compose_full_pack(environment_pack, temp_output, base_dir)
+            else:
+                with timed_phase("worker_repack", pack=name):
+                    repack_as_gzip(environment_pack, temp_output)
+            os.replace(temp_output, output_file)
+        finally:
+            if os.path.exists(temp_output):
+                os.unlink(temp_output)
+
+    print(f"[environment] Worker pack created from '{name}': {output_file}")
+    return output_file
+
+
+def _build_conda_pack(
+    env_yml: str,
+    env_data: dict,
+    post_install_script: str,
+    fingerprint: str,
+    solver: str,
+    output_file: str,
+    temp_output: str,
+    pack_format: str,
+    log_prefix: str = None,
+) -> None:
+    """
+    Create the environment described by env_data, record its lockfile next to
+    output_file and pack it into temp_output. With log_prefix, the output of
+    conda and the post-install script is printed behind that prefix.
+    """
+
+    temp_dir = tempfile.mkdtemp(prefix="conda_env_")
+    env_path = os.path.join(temp_dir, "env")
+
+    try:
+        _log(
+            log_prefix,
             f"[environment] Creating environment with the following packages: {env_data['dependencies']} and variables: {env_data['variables']}"
         )
 
         if post_install_script:
-            print(f"[environment] Post-installation script: {post_install_script}")
+            _log(
+                log_prefix,
+                f"[environment] Post-installation script: {post_install_script}",
+            )
 
         # Remove post_install_script from env_data before writing to modified YAML
         if "post_install_script" in env_data:
@@ -85,21 +837,42 @@ def create_conda_pack_from_yml(
         with open(modified_yml, "w") as f:
             yaml.safe_dump(env_data, f)
 
-        print(f"[environment] Creating env from '{env_yml}' with solver={solver}...")
-        cmd_create = [
-            "conda",
-            "env",
-            "create",
-            "--file",
-            modified_yml,
-            "--prefix",
-            env_path,
-            "--solver",
-            solver,
-        ]
-        subprocess.run(cmd_create, check=True)
+        lockfile = find_lockfile(env_yml, output_file, fingerprint)
+        if lockfile:
+            try:
+                with timed_phase("lockfile_create", env=env_yml):
+                    create_environment_from_lockfile(
+                        *lockfile, env_path, env_data["variables"], log_prefix
+                    )
+            except subprocess.CalledProcessError as e:
+                # e.g. a pinned package is no longer available; solve instead
+                _log(
+                    log_prefix,
+                    f"[environment] Could not create env from lockfile: {e}",
+                )
+                shutil.rmtree(env_path, ignore_errors=True)
+                lockfile = None
+
+        if not lockfile:
+            _log(
+                log_prefix,
+                f"[environment] Creating env from '{env_yml}' with solver={solver}..."
+            )
+            cmd_create = [
+                "conda",
+                "env",
+                "create",
+                "--file",
+                modified_yml,
+                "--prefix",
+                env_path,
+                "--solver",
+                solver,
+            ]
+            with timed_phase("solve", env=env_yml, solver=solver):
+                run_logged(cmd_create, log_prefix)
 
-        if post_install_script and os.path.exists(post_install_script):
+        if post_install_script:
             wrapper_script = os.path.join(temp_dir, "exec_script.sh")
 
             script = textwrap.dedent(
@@ -132,29 +905,133 @@ def create_conda_pack_from_yml(
             # Make the wrapper script executable
             os.chmod(wrapper_script, 0o755)
 
-            print(script)
+            _log(log_prefix, script)
 
-            result = subprocess.run(["bash", wrapper_script], check=False)
+            with timed_phase("post_install", env=env_yml):
+                result = run_logged(["bash", wrapper_script], log_prefix, check=False)
 
             if result.returncode != 0:
-                print(
+                _log(
+                    log_prefix,
                     f"[environment] Post-installation script failed with code {result.returncode}"
                 )
                 raise subprocess.CalledProcessError(result.returncode, wrapper_script)
             else:
-                print(f"[environment] Post-installation script executed successfully.")
+                _log(
+                    log_prefix,
+                    f"[environment] Post-installation script executed successfully.",
+                )
 
-        print(f"[environment] Packing environment into '{output_file}'...")
-        cmd_pack = ["conda-pack", "-p", env_path, "-o", output_file, "--force"]
-        subprocess.run(cmd_pack, check=True)
+        explicit_file, pip_file = lockfile_paths(output_file)
+        write_lockfile(env_path, explicit_file, pip_file, fingerprint, log_prefix)
 
-        print(f"[environment] Environment successfully packed: {output_file}")
+        _log(log_prefix, f"[environment] Packing environment into '{output_file}'...")
+        with timed_phase("pack", env=env_yml, format=pack_format):
+            pack_environment(env_path, temp_output, pack_format, log_prefix)
 
     except subprocess.CalledProcessError as e:
-        print(f"[environment] Error creating or packing environment: {e}")
+        _log(log_prefix, f"[environment] Error creating or packing environment: {e}")
         raise
     finally:
-        print(f"[environment] Cleaning up temporary directory: {temp_dir}")
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        _log(log_prefix, f"[environment] Cleaning up temporary directory: {temp_dir}")
+        remove_tree(temp_dir)
 
-    return output_file
+
+def get_extracted_environment(environment_pack: str, base_dir: str = "/tmp") -> str:
+    """
+    Return a directory holding environment_pack extracted and relocated.
+    The directory is cached under <base_dir>/flo_common_env/extracted, keyed by
+    the pack's path, size and modification time, and shared read-only by all
+    runs using the same pack. Per-run settings such as the manager name are
+    passed to each run's processes instead (see activation.run_variables).
+    The directory is kept until this process exits; after that it may be
+    evicted once more than EXTRACTED_ENV_LIMIT environments are cached.
+    """
+
+    pack_path = os.path.realpath(environment_pack)
+    st = os.stat(pack_path)
+    pack_key = hashlib.sha256(
+        f"{pack_path}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")
+    ).hexdigest()[:16]
+    pack_name = os.path.basename(pack_path).split(".")[0]
+
+    extracted_dir = os.path.join(base_dir, "flo_common_env", EXTRACTED_ENV_DIR_NAME)
+    os.makedirs(extracted_dir, exist_ok=True)
+    env_dir = os.path.join(extracted_dir, f"{pack_name}_{pack_key}")
+    ready_marker = os.path.join(env_dir, ".floability_ready")
+
+    # Mark the environment as in use before looking at it, so that it cannot
+    # be evicted from under this run, and record when it was last used
+    in_use_lock = env_dir + ".inuse"
+    if env_dir not in _environments_in_use:
+        _environments_in_use[env_dir] = hold_shared_lock(in_use_lock)
+    os.utime(in_use_lock)
+
+    if os.path.exists(ready_marker):
+        print(f"[environment] Reusing extracted environment: {env_dir}")
+        return env_dir
+
+    with file_lock(env_dir + ".lock"):
+        # Another process may have finished the extraction while we waited
+        if os.path.exists(ready_marker):
+            print(f"[environment] Reusing extracted environment: {env_dir}")
+            return env_dir
+
+        # Leftovers of an interrupted extraction cannot be trusted
+        remove_tree(env_dir)
+        os.makedirs(env_dir)
+
+        try:
+            with timed_phase("extract", pack=pack_path):
+                if is_delta_pack(pack_path):
+                    compose_environment(pack_path, env_dir, base_dir)
+                else:
+                    extract_environment_pack(pack_path, env_dir)
+
+            # Point the files recorded by conda-pack at the new prefix
+            with timed_phase("conda_unpack", pack=pack_path):
+                unpack_environment(env_dir)
+        except Exception:
+            remove_tree(env_dir)
+            raise
+
+        # Capture the activation while the environment can still be written,
+        # then make it read-only so no run can change it for the others
+        get_activation(env_dir)
+        with open(ready_marker, "w") as f:
+            f.write(f"{pack_path}\n")
+        make_read_only(env_dir)
+
+    print(f"[environment] Extracted environment cached at {env_dir}")
+    evict_extracted_environments(extracted_dir)
+    return env_dir
+
+
+def evict_extracted_environments(
+    extracted_dir: str, limit: int = EXTRACTED_ENV_LIMIT
+) -> None:
+    """
+    Remove the extracted environments in extracted_dir beyond the limit most
+    recently used ones, skipping any that a run still uses.
+    """
+
+    entries = []
+    for name in os.listdir(extracted_dir):
+        env_dir = os.path.join(extracted_dir, name)
+        if name.startswith(".") or not os.path.exists(
+            os.path.join(env_dir, ".floability_ready")
+        ):
+            continue
+        in_use_lock = env_dir + ".inuse"
+        last_used = os.path.getmtime(
+            in_use_lock if os.path.exists(in_use_lock) else env_dir
+        )
+        entries.append((last_used, env_dir))
+
+    entries.sort(reverse=True)
+    for _, env_dir in entries[limit:]:
+        with try_file_lock(env_dir + ".inuse") as unused:
+            if not unused:
+                continue
+            remove_tree(env_dir)
+        print(f"[environment] Evicted extracted environment {env_dir}")
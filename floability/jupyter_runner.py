@@ -1,12 +1,20 @@
 # jupyter_runner.py
 
+import glob
+import json
 import subprocess
 import threading
 import sys
 import os
 import time
 import re
+from typing import Callable, Dict, List, Optional
 
+import requests
+import yaml
+
+from .activation import activated_command
+from .report import active_report, record_event, timed_phase
 from .utils import get_system_information
 
 
@@ -38,24 +46,291 @@ def print_instructions_for_accessing_jupyter(port, token, stdout_file):
     print(f"\n{instructions}")
 
 
-def monitor_stdout(stdout_file):
-    with open(stdout_file, "r") as f:
-        while True:
-            line = f.readline()
-            if "http://" in line or "https://" in line:
-                url = line.strip()
-                port_match = re.search(r":(\d+)/", url)
-                port = port_match.group(1) if port_match else "N/A"
-                token_match = re.search(r"token=([a-zA-Z0-9]+)", url)
-                token = token_match.group(1) if token_match else "N/A"
+# Seconds JupyterLab gets to print its URL before a warning is shown
+JUPYTER_READY_TIMEOUT = 120
+
+# Per-run directory for the server's jpserver-<pid>.json and kernel files
+JUPYTER_RUNTIME_DIR_NAME = "jupyter_runtime"
+
+DEFAULT_KERNEL_NAME = "python3"
+
+# Script run by the environment's python to execute notebooks
+NOTEBOOK_ENGINE = os.path.join(os.path.dirname(__file__), "notebook_engine.py")
+
+# Seconds a pre-started kernel may take to start and run its warm-up imports
+KERNEL_START_TIMEOUT = 600
+
+# Seconds between attempts to reach a server that is not listening yet
+SERVER_RETRY_INTERVAL = 0.1
+
+# Run in each pre-started kernel; modules are imported without binding names
+# in the user's namespace
+WARMUP_CODE = """
+def _floability_warmup(names):
+    import importlib
+    failed = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            failed.append(f"{{name}} ({{e}})")
+    if failed:
+        raise ImportError("could not import " + ", ".join(failed))
+try:
+    _floability_warmup({names!r})
+finally:
+    del _floability_warmup
+"""
+
+# Run with the environment's python, which has jupyter_client, to send the
+# warm-up code to all kernels at once and wait for them to finish
+WARMUP_SCRIPT = """
+import json, sys, time
+from jupyter_client import BlockingKernelClient
+
+connection_files, code, timeout = json.loads(sys.argv[1])
+started = time.monotonic()
+pending = {}
+for connection_file in connection_files:
+    client = BlockingKernelClient()
+    client.load_connection_file(connection_file)
+    client.start_channels()
+    client.wait_for_ready(timeout=timeout)
+    pending[client.execute(code, silent=True)] = client
+
+failed = 0
+for msg_id, client in pending.items():
+    while True:
+        reply = client.get_shell_msg(timeout=timeout)
+        if reply["parent_header"].get("msg_id") == msg_id:
+            break
+    if reply["content"]["status"] != "ok":
+        failed += 1
+        print(f"Warm-up failed in a kernel: {reply['content'].get('evalue')}")
+    client.stop_channels()
+print(f"Warm-up imports took {time.monotonic() - started:.1f}s")
+sys.exit(1 if failed else 0)
+"""
+
+
+def read_server_info(runtime_dir: str) -> dict:
+    """
+    Return the connection info JupyterLab wrote to runtime_dir once it is
+    listening (url, port, token, ...), or {} if there is none yet.
+    """
+
+    for path in sorted(glob.glob(os.path.join(runtime_dir, "jpserver-*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return {}
+
+
+def monitor_output(
+    proc,
+    stdout_file: str,
+    runtime_dir: str,
+    started_at: float,
+    timeout: float = JUPYTER_READY_TIMEOUT,
+    on_ready: Optional[Callable[[dict], None]] = None,
+) -> threading.Thread:
+    """
+    Copy JupyterLab's output from its pipe into stdout_file in a background
+    thread, and print access instructions as soon as it prints its URL. The
+    time JupyterLab took to get ready is recorded in the run report; if it is
+    not ready within timeout seconds, a warning is printed instead.
+    on_ready is then called in a thread of its own with the server's info.
+    """
+
+    ready = threading.Event()
+
+    def warn_on_timeout():
+        if ready.wait(timeout):
+            return
+        print(
+            f"[jupyter] Warning: JupyterLab is not ready after {timeout:g}s. "
+            f"Check {stdout_file}."
+        )
+        record_event("jupyter_timeout", timeout=timeout)
+
+    def report_ready(line):
+        elapsed = time.monotonic() - started_at
+        info = read_server_info(runtime_dir)
+
+        url = line.strip()
+        port_match = re.search(r":(\d+)/", url)
+        token_match = re.search(r"token=([a-zA-Z0-9]+)", url)
+        port = info.get("port") or (port_match.group(1) if port_match else "N/A")
+        token = info.get("token") or (token_match.group(1) if token_match else "N/A")
+
+        report = active_report()
+        if report is not None:
+            report.record("jupyter_ready", started_at, time.monotonic(), port=port)
+        print(f"[jupyter] JupyterLab ready after {elapsed:.1f}s.")
+        print_instructions_for_accessing_jupyter(port, token, stdout_file)
+
+        if on_ready is not None:
+            info.setdefault("url", f"http://localhost:{port}/")
+            info.setdefault("token", token)
+            threading.Thread(target=on_ready, args=(info,), daemon=True).start()
+
+    def tee():
+        with open(stdout_file, "a") as log:
+            for line in proc.stdout:
+                log.write(line)
+                log.flush()
+                if not ready.is_set() and ("http://" in line or "https://" in line):
+                    ready.set()
+                    report_ready(line)
+
+        if not ready.is_set():
+            ready.set()
+            print(
+                f"[jupyter] JupyterLab exited before it was ready. See {stdout_file}."
+            )
+
+    threading.Thread(target=warn_on_timeout, daemon=True).start()
+    thread = threading.Thread(target=tee, daemon=True)
+    thread.start()
+    return thread
+
+
+def read_jupyter_config(config_yml: Optional[str]) -> dict:
+    """
+    Return the jupyter_config section of the compute spec config_yml, e.g.
+
+        jupyter_config:
+          prewarm-kernels: 2
+          warmup-imports: [coffea, dask, awkward]
+    """
+
+    if not config_yml:
+        return {}
+    try:
+        with open(config_yml, "r") as f:
+            config = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f"[jupyter] Could not read jupyter_config from '{config_yml}': {e}")
+        return {}
+    return config.get("jupyter_config") or {}
+
+
+def _notebook_kernel_name(notebook_path: str) -> str:
+    try:
+        with open(notebook_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f).get("metadata", {})
+        return metadata.get("kernelspec", {}).get("name") or DEFAULT_KERNEL_NAME
+    except (OSError, ValueError, AttributeError):
+        return DEFAULT_KERNEL_NAME
+
+
+def wait_for_server(base_url: str, headers: dict, timeout: float) -> None:
+    """
+    Wait until the server at base_url answers API requests. It prints its URL
+    just before it starts listening, so the first connections may be refused.
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(
+                f"{base_url}/api/status", headers=headers, timeout=timeout
+            ).raise_for_status()
+            return
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(SERVER_RETRY_INTERVAL)
+
+
+def start_kernels(
+    server_info: dict,
+    count: int,
+    warmup_imports: List[str],
+    notebook_path: Optional[str] = None,
+    runtime_dir: Optional[str] = None,
+    conda_env_dir: Optional[str] = None,
+) -> List[str]:
+    """
+    Start count kernels in the JupyterLab server described by server_info and
+    import warmup_imports in each of them. With notebook_path, the first
+    kernel is started as the notebook's session, so JupyterLab attaches the
+    notebook to it when it is opened; the others can be picked from the
+    running kernels. Return the ids of the kernels started.
+    """
 
-                # todo: verify this approach of getting port and token
+    base_url = server_info["url"].rstrip("/")
+    headers = {"Authorization": f"token {server_info.get('token', '')}"}
+    root_dir = server_info.get("root_dir") or server_info.get("notebook_dir")
+    kernel_name = (
+        _notebook_kernel_name(notebook_path) if notebook_path else DEFAULT_KERNEL_NAME
+    )
 
-                print_instructions_for_accessing_jupyter(port, token, stdout_file)
+    session_path = None
+    if notebook_path:
+        session_path = os.path.relpath(
+            os.path.abspath(notebook_path), root_dir or os.getcwd()
+        )
+        if session_path.startswith(".."):
+            session_path = None
+
+    kernel_ids = []
+    with timed_phase("kernel_prewarm", kernels=count, imports=len(warmup_imports)):
+        try:
+            wait_for_server(base_url, headers, KERNEL_START_TIMEOUT)
+            for i in range(count):
+                if i == 0 and session_path:
+                    r = requests.post(
+                        f"{base_url}/api/sessions",
+                        headers=headers,
+                        json={
+                            "path": session_path,
+                            "name": os.path.basename(session_path),
+                            "type": "notebook",
+                            "kernel": {"name": kernel_name},
+                        },
+                        timeout=KERNEL_START_TIMEOUT,
+                    )
+                    r.raise_for_status()
+                    kernel_ids.append(r.json()["kernel"]["id"])
+                else:
+                    r = requests.post(
+                        f"{base_url}/api/kernels",
+                        headers=headers,
+                        json={"name": kernel_name},
+                        timeout=KERNEL_START_TIMEOUT,
+                    )
+                    r.raise_for_status()
+                    kernel_ids.append(r.json()["id"])
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"[jupyter] Could not start kernel {len(kernel_ids) + 1}: {e}")
+
+        if kernel_ids and warmup_imports and runtime_dir:
+            connection_files = [
+                os.path.join(runtime_dir, f"kernel-{kernel_id}.json")
+                for kernel_id in kernel_ids
+            ]
+            code = WARMUP_CODE.format(names=list(warmup_imports))
+            cmd, env = activated_command(
+                [
+                    "python",
+                    "-c",
+                    WARMUP_SCRIPT,
+                    json.dumps([connection_files, code, KERNEL_START_TIMEOUT]),
+                ],
+                conda_env_dir,
+            )
+            result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            for line in (result.stdout + result.stderr).splitlines():
+                print(f"[jupyter] {line}")
+            if result.returncode != 0:
+                print("[jupyter] Warning: warm-up imports failed in some kernels.")
 
-                break
-            else:
-                time.sleep(1)
+    imported = f", importing {', '.join(warmup_imports)}" if warmup_imports else ""
+    print(f"[jupyter] Started {len(kernel_ids)} of {count} kernel(s){imported}.")
+    return kernel_ids
 
 
 def start_jupyterlab(
@@ -64,7 +339,15 @@ def start_jupyterlab(
     jupyter_ip: str = "0.0.0.0",
     run_dir: str = "/tmp",
     conda_env_dir: str = None,
+    ready_timeout: float = JUPYTER_READY_TIMEOUT,
+    prewarm_kernels: int = 0,
+    warmup_imports: Optional[List[str]] = None,
+    variables: Optional[Dict[str, str]] = None,
 ):
+    """
+    Start JupyterLab in the environment at conda_env_dir, with the per-run
+    variables set for the server and its kernels, and return its process.
+    """
 
     cmd = ["jupyter", "lab", "--no-browser", "--port", str(port), "--ip", jupyter_ip, "--allow-root"]
     if notebook_path:
@@ -75,38 +358,59 @@ def start_jupyterlab(
     )
     print(f"[jupyter] Notebook: {notebook_path if notebook_path else '(none)'}")
 
-    if conda_env_dir:
-        # Use conda run to start JupyterLab within the extracted environment
-        cmd = ["conda", "run", "--prefix", conda_env_dir, "--no-capture-output"] + cmd
+    # Run JupyterLab straight from the extracted environment, activated
+    cmd, env = activated_command(cmd, conda_env_dir, variables)
+
+    # Keep the server's runtime files with the run, where its connection
+    # info is found without searching the user's shared runtime directory
+    runtime_dir = os.path.join(run_dir, JUPYTER_RUNTIME_DIR_NAME)
+    env = dict(os.environ if env is None else env)
+    env["JUPYTER_RUNTIME_DIR"] = runtime_dir
 
     try:
         stdout_file = os.path.join(run_dir, "jupyterlab.stdout")
 
         print(f"[jupyter] JupyterLab stdout: {stdout_file}")
 
-        # note: conda run opens a temprary bash process to run the command.
-        # This bash process is the parent of the jupyterlab process.
-        # That is causing some problem with the cleanup.py script.
-        # this combination seems to work. but we should revisit this.
-        with open(stdout_file, "w") as stdout:
-            proc = subprocess.Popen(
-                cmd,
-                stdout=stdout,
-                stderr=stdout,
-                text=True,
-                # preexec_fn=os.setsid, #todo: revisit cleanup.py for this
-            )
+        # JupyterLab gets its own process group, so cleanup.py can signal it
+        # and its kernels without signaling floability itself. Its output is
+        # read from a pipe, so its URL is seen the moment it is printed.
+        started_at = time.monotonic()
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            env=env,
+            start_new_session=True,
+        )
 
-            print(
-                f"[jupyter] JupyterLab process started with PID {proc.pid} and PGID {os.getpgid(proc.pid)}"
-            )
+        print(
+            f"[jupyter] JupyterLab process started with PID {proc.pid} and PGID {os.getpgid(proc.pid)}"
+        )
 
-            monitor_thread = threading.Thread(
-                target=monitor_stdout, args=(stdout_file,)
+        # Kernels are pre-started as soon as the server accepts requests
+        def on_ready(info):
+            start_kernels(
+                info,
+                prewarm_kernels,
+                warmup_imports or [],
+                notebook_path,
+                runtime_dir,
+                conda_env_dir,
             )
-            monitor_thread.start()
 
-            return proc
+        monitor_output(
+            proc,
+            stdout_file,
+            runtime_dir,
+            started_at,
+            ready_timeout,
+            on_ready if prewarm_kernels > 0 else None,
+        )
+
+        return proc
     except FileNotFoundError:
         print("[jupyter] Error: 'jupyter' not found in your PATH.")
         sys.exit(1)
@@ -119,46 +423,72 @@ def execute_notebook(
     notebook_path: str = None,
     run_dir: str = "/tmp",
     conda_env_dir: str = None,
+    cell_timeout: Optional[int] = None,
+    variables: Optional[Dict[str, str]] = None,
 ):
+    """
+    Execute notebook_path with the nbclient engine (notebook_engine.py) in
+    the environment's python, with the per-run variables set. Progress of
+    each cell is printed as it ends, with cell outputs in notebook_outputs.log
+    and per-cell wall time and kernel memory in notebook_cells.jsonl of
+    run_dir. The executed notebook is written to run_dir; the original is
+    left unchanged.
+    Return whether every cell ran successfully.
+    """
+
+    executed_notebook = os.path.join(run_dir, os.path.basename(notebook_path))
+    log_file = os.path.join(run_dir, "notebook_execution.log")
 
     cmd = [
-        "jupyter",
-        "nbconvert",
-        "--to",
-        "notebook",
-        "--execute",
-        "--inplace",
-        notebook_path,
+        "python",
+        NOTEBOOK_ENGINE,
+        os.path.abspath(notebook_path),
+        "--output",
+        executed_notebook,
+        "--metrics",
+        os.path.join(run_dir, "notebook_cells.jsonl"),
+        "--outputs-log",
+        os.path.join(run_dir, "notebook_outputs.log"),
     ]
+    if cell_timeout:
+        cmd += ["--cell-timeout", str(cell_timeout)]
 
-    if conda_env_dir:
-        # Use conda run to start JupyterLab within the extracted environment
-        cmd = ["conda", "run", "--prefix", conda_env_dir, "--no-capture-output"] + cmd
-
-    try:
-        stdout_file = os.path.join(run_dir, "jupyterlab.stdout")
-
-        print(f"[jupyter] JupyterLab stdout: {stdout_file}")
-
-        with open(stdout_file, "w") as stdout:
-            proc = subprocess.Popen(
-                cmd,
-                stdout=stdout,
-                stderr=stdout,
-                text=True,
-            )
+    # Run the engine straight from the extracted environment, activated
+    cmd, env = activated_command(cmd, conda_env_dir, variables)
 
-            proc.wait()  # Wait for the process to complete
+    print(f"[jupyter] Executing notebook: {notebook_path}")
+    print(f"[jupyter] Notebook execution log: {log_file}")
 
-            if proc.returncode == 0:
-                print(f"[jupyter] Notebook executed successfully: {notebook_path}")
-                return True
-            else:
-                print(f"[jupyter] Error executing notebook: {notebook_path}")
-                return False
+    try:
+        with timed_phase("notebook_execute", notebook=notebook_path):
+            with open(log_file, "w") as log:
+                proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    errors="replace",
+                    env=env,
+                )
+                with proc.stdout:
+                    for line in proc.stdout:
+                        log.write(line)
+                        log.flush()
+                        # Kernel and nbclient logging stays in the log file
+                        if line.startswith(("Cell ", "Executed ")):
+                            print(f"[jupyter] {line.rstrip()}", flush=True)
+                proc.wait()
     except FileNotFoundError:
-        print("[jupyter] Error: 'jupyter' not found in your PATH.")
+        print("[jupyter] Error: 'python' not found in your PATH.")
         sys.exit(1)
     except Exception as e:
         print(f"[jupyter] Failed to execute notebook: {e}")
         sys.exit(1)
+
+    if os.path.exists(executed_notebook):
+        print(f"[jupyter] Executed notebook saved to {executed_notebook}")
+    if proc.returncode == 0:
+        print(f"[jupyter] Notebook executed successfully: {notebook_path}")
+        return True
+    print(f"[jupyter] Error executing notebook: {notebook_path}. See {log_file}.")
+    return False
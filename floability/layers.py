@@ -0,0 +1,418 @@
+"""
+Layered environment packs.
+
+In layered mode a backpack's environment is shipped as a delta layer over a
+base layer holding the packages every floability environment needs (see
+environment.REQUIRED_PACKAGES). The base layer is built once per channel
+list and shared by all backpacks; a delta layer only contains the members of
+the backpack's full pack that are not byte-identical to the base, plus a
+manifest naming the base and listing the paths taken from it.
+
+conda-pack stores files that embed the environment prefix with their
+packages' original placeholders, so the same package packed from two
+different environments produces identical members, and most of the base
+layer is shared exactly.
+"""
+
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+from .prefix_rewriter import read_prefix_records
+from .utils import (
+    file_lock,
+    materialize_file,
+    open_decompressed,
+    remove_tree,
+    safe_extract_tar,
+)
+
+LAYER_MANIFEST_NAME = ".floability_layer.json"
+LAYER_VERSION = 1
+
+# Delta packs are named env_<fingerprint>.delta.<format>
+DELTA_MARKER = ".delta."
+
+BASE_LAYER_DIR_NAME = "layers"
+
+CHUNK_SIZE = 1024 * 1024
+
+# Members larger than this are buffered on disk while being compared
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+def is_delta_pack(path: str) -> bool:
+    return DELTA_MARKER in os.path.basename(str(path))
+
+
+@contextlib.contextmanager
+def _open_pack(pack: str):
+    with open_decompressed(Path(pack)) as stream:
+        with tarfile.open(pack, mode="r|*", fileobj=stream) as tar:
+            yield tar
+
+
+def _copy_hashed(src, dst) -> str:
+    digest = hashlib.sha256()
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        if dst is not None:
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def index_pack(pack: str) -> Dict[str, list]:
+    """
+    Return {path: [kind, ...]} describing the regular files (size, mode and
+    sha256) and symlinks (target) of pack. The index is cached next to the
+    pack for as long as the pack is unchanged.
+    """
+
+    st = os.stat(pack)
+    cache_file = f"{pack}.index.json"
+    key = [st.st_size, st.st_mtime_ns]
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") == LAYER_VERSION and cached.get("key") == key:
+            return cached["members"]
+    except (OSError, ValueError):
+        pass
+
+    members = {}
+    with _open_pack(pack) as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if member.isfile():
+                digest = _copy_hashed(tar.extractfile(member), None)
+                members[name] = ["file", member.size, member.mode, digest]
+            elif member.issym():
+                members[name] = ["symlink", member.linkname]
+
+    temp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({"version": LAYER_VERSION, "key": key, "members": members}, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        print(f"[environment] Could not cache index of {pack}: {e}")
+    return members
+
+
+def _index_digest(members: Dict[str, list]) -> str:
+    encoded = json.dumps(members, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def read_manifest(delta_pack: str) -> dict:
+    """
+    Return the layer manifest of delta_pack, which is its last member.
+    """
+
+    manifest = None
+    with _open_pack(delta_pack) as tar:
+        for member in tar:
+            if member.name == LAYER_MANIFEST_NAME:
+                manifest = json.load(tar.extractfile(member))
+    if manifest is None:
+        raise ValueError(f"'{delta_pack}' has no layer manifest")
+    return manifest
+
+
+def delta_matches_base(delta_pack: str, base_pack: str) -> bool:
+    """
+    Return whether delta_pack was computed against base_pack as it is now.
+    A base layer that was rebuilt or fetched from elsewhere may differ.
+    """
+
+    try:
+        manifest = read_manifest(delta_pack)
+    except (OSError, ValueError, tarfile.TarError):
+        return False
+    return manifest.get("version") == LAYER_VERSION and manifest.get(
+        "base_digest"
+    ) == _index_digest(index_pack(base_pack))
+
+
+def _check_base(base_pack: str, manifest: dict) -> None:
+    # Deltas built from an environment.yml are rebuilt when their base
+    # changes (see create_conda_pack_from_yml); a prebuilt one cannot be
+    if _index_digest(index_pack(base_pack)) != manifest["base_digest"]:
+        raise ValueError(
+            f"Base layer '{base_pack}' changed since the delta layer was built; "
+            "build the delta again from its environment.yml."
+        )
+
+
+def _compress_tar(tar_path: str, output_file: str, pack_format: str) -> None:
+    """
+    Compress the tar file tar_path into output_file, removing tar_path.
+    """
+
+    if pack_format == "tar.zst":
+        if not shutil.which("zstd"):
+            raise RuntimeError("Packing as tar.zst requires the 'zstd' tool.")
+        subprocess.run(
+            ["zstd", "-T0", "-q", "-f", "--rm", tar_path, "-o", output_file],
+            check=True,
+        )
+        return
+
+    if pack_format != "tar.gz":
+        raise ValueError(f"Unsupported pack format: {pack_format}")
+
+    with open(output_file, "wb") as out:
+        if shutil.which("pigz"):
+            subprocess.run(["pigz", "-c", tar_path], stdout=out, check=True)
+        else:
+            with open(tar_path, "rb") as src, gzip.GzipFile(
+                fileobj=out, mode="wb", compresslevel=6
+            ) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.unlink(tar_path)
+
+
+def _add_manifest(tar: tarfile.TarFile, manifest: dict) -> None:
+    data = json.dumps(manifest).encode("utf-8")
+    info = tarfile.TarInfo(LAYER_MANIFEST_NAME)
+    info.size = len(data)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def make_delta_pack(
+    full_pack: str, base_pack: str, output_file: str, pack_format: str
+) -> Dict[str, int]:
+    """
+    Write the members of full_pack that differ from base_pack into the delta
+    pack output_file, followed by a manifest of the members taken from
+    base_pack. Return the number of members in the delta and from the base.
+    """
+
+    base_members = index_pack(base_pack)
+    from_base: List[str] = []
+    hardlinks: Dict[str, str] = {}
+    shared = set()
+    delta_count = 0
+
+    tar_path = f"{output_file}.tar"
+    with _open_pack(full_pack) as tar, tarfile.open(tar_path, "w") as out:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            base = base_members.get(name)
+
+            if member.isfile() and base and base[:3] == [
+                "file",
+                member.size,
+                member.mode,
+            ]:
+                # Same size and mode: compare the contents, keeping them in
+                # case they differ
+                with tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE) as spool:
+                    digest = _copy_hashed(tar.extractfile(member), spool)
+                    if digest == base[3]:
+                        from_base.append(name)
+                        shared.add(name)
+                        continue
+                    spool.seek(0)
+                    out.addfile(member, spool)
+
+            elif member.issym() and base == ["symlink", member.linkname]:
+                from_base.append(name)
+                shared.add(name)
+                continue
+
+            elif member.islnk() and os.path.normpath(member.linkname) in shared:
+                # The link target is only created when the layers are composed
+                hardlinks[name] = os.path.normpath(member.linkname)
+                continue
+
+            elif member.isfile():
+                out.addfile(member, tar.extractfile(member))
+            else:
+                out.addfile(member)
+            delta_count += 1
+
+        _add_manifest(
+            out,
+            {
+                "version": LAYER_VERSION,
+                "base": os.path.basename(base_pack),
+                "base_digest": _index_digest(base_members),
+                "from_base": from_base,
+                "hardlinks": hardlinks,
+            },
+        )
+
+    try:
+        _compress_tar(tar_path, output_file, pack_format)
+    finally:
+        if os.path.exists(tar_path):
+            os.unlink(tar_path)
+
+    return {"delta": delta_count, "from_base": len(from_base)}
+
+
+def find_base_pack(delta_pack: str, base_name: str, base_dir: str) -> str:
+    """
+    Return the path of the base layer base_name of delta_pack, which is kept
+    next to the delta or in the common environment directory.
+    """
+
+    candidates = [
+        os.path.join(os.path.dirname(os.path.abspath(delta_pack)), base_name),
+        os.path.join(base_dir, "flo_common_env", base_name),
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(
+        f"Base layer '{base_name}' of '{delta_pack}' not found in "
+        f"{' or '.join(os.path.dirname(c) for c in candidates)}"
+    )
+
+
+def extract_base_layer(base_pack: str, base_dir: str) -> str:
+    """
+    Return a directory holding base_pack extracted as is, i.e. without its
+    prefixes rewritten, from which delta layers are composed. The directory
+    is cached and shared by all environments built on the base.
+    """
+
+    name = os.path.basename(base_pack).split(".")[0]
+    layers_dir = os.path.join(base_dir, "flo_common_env", BASE_LAYER_DIR_NAME)
+    os.makedirs(layers_dir, exist_ok=True)
+    layer_dir = os.path.join(layers_dir, name)
+    ready_marker = os.path.join(layer_dir, ".floability_ready")
+
+    if os.path.exists(ready_marker):
+        return layer_dir
+
+    with file_lock(layer_dir + ".lock"):
+        if os.path.exists(ready_marker):
+            return layer_dir
+
+        remove_tree(layer_dir)
+        os.makedirs(layer_dir)
+        try:
+            with open_decompressed(Path(base_pack)) as stream:
+                safe_extract_tar(Path(base_pack), Path(layer_dir), fileobj=stream)
+        except Exception:
+            remove_tree(layer_dir)
+            raise
+
+        with open(ready_marker, "w") as f:
+            f.write(f"{base_pack}\n")
+
+    return layer_dir
+
+
+def compose_environment(delta_pack: str, env_dir: str, base_dir: str) -> None:
+    """
+    Extract delta_pack into env_dir and add the members it shares with its
+    base layer from the cached extraction of the base. Shared files are
+    reflinked where the filesystem supports it and copied otherwise, never
+    hardlinked, so that neither rewriting their prefix nor making env_dir
+    read-only modifies the base extraction.
+    """
+
+    with open_decompressed(Path(delta_pack)) as stream:
+        safe_extract_tar(Path(delta_pack), Path(env_dir), fileobj=stream)
+
+    manifest_file = os.path.join(env_dir, LAYER_MANIFEST_NAME)
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    os.unlink(manifest_file)
+
+    base_pack = find_base_pack(delta_pack, manifest["base"], base_dir)
+    _check_base(base_pack, manifest)
+    layer_dir = extract_base_layer(base_pack, base_dir)
+    print(f"[environment] Composing {env_dir} from base layer {manifest['base']}")
+
+    from_base = manifest["from_base"]
+    unpack_script = os.path.join("bin", "conda-unpack")
+    if unpack_script in from_base:
+        shutil.copy2(
+            os.path.join(layer_dir, unpack_script), os.path.join(env_dir, unpack_script)
+        )
+    rewritten = {
+        os.path.normpath(record[0]) for record in read_prefix_records(env_dir) or []
+    }
+
+    for name in from_base:
+        source = os.path.join(layer_dir, name)
+        dest = os.path.join(env_dir, name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.lexists(dest):
+            continue
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), dest)
+            continue
+        materialize_file(Path(source), Path(dest), "reflink")
+        if name in rewritten:
+            # The copy is rewritten in place even if the packed file is not
+            # writable
+            os.chmod(dest, os.stat(dest).st_mode | stat.S_IWUSR)
+
+    for name, target in manifest["hardlinks"].items():
+        os.link(os.path.join(env_dir, target), os.path.join(env_dir, name))
+
+
+def compose_full_pack(delta_pack: str, output_file: str, base_dir: str) -> None:
+    """
+    Write the complete environment of delta_pack and its base layer into the
+    single tar.gz pack output_file, e.g. for vine_factory's --poncho-env.
+    """
+
+    tar_path = f"{output_file}.tar"
+    try:
+        with tarfile.open(tar_path, "w") as out:
+            manifest = None
+            with _open_pack(delta_pack) as tar:
+                for member in tar:
+                    if member.name == LAYER_MANIFEST_NAME:
+                        manifest = json.load(tar.extractfile(member))
+                    elif member.isfile():
+                        out.addfile(member, tar.extractfile(member))
+                    else:
+                        out.addfile(member)
+
+            if manifest is None:
+                raise ValueError(f"'{delta_pack}' has no layer manifest")
+
+            from_base = set(manifest["from_base"])
+            base_pack = find_base_pack(delta_pack, manifest["base"], base_dir)
+            _check_base(base_pack, manifest)
+            with _open_pack(base_pack) as tar:
+                for member in tar:
+                    if os.path.normpath(member.name) not in from_base:
+                        continue
+                    if member.isfile():
+                        out.addfile(member, tar.extractfile(member))
+                    else:
+                        out.addfile(member)
+
+            for name, target in manifest["hardlinks"].items():
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.LNKTYPE
+                info.linkname = target
+                out.addfile(info)
+
+        _compress_tar(tar_path, output_file, "tar.gz")
+    finally:
+        if os.path.exists(tar_path):
+            os.unlink(tar_path)
@@ -0,0 +1,176 @@
+"""
+Notebook execution engine of `floability execute`.
+
+This file is run as a script by the python of the backpack's environment
+(see jupyter_runner.execute_notebook), which has nbclient installed as part
+of jupyter; it must not import anything from floability. It executes the
+notebook in a kernel of that environment and, as each code cell finishes:
+
+- prints a progress line with the cell's status, wall time and kernel memory,
+- appends the cell's metrics as one JSON line to the metrics file,
+- appends the cell's text outputs to the outputs log.
+
+The executed notebook is written to a separate file, also when a cell fails
+or times out, so the original notebook is never modified.
+"""
+
+import os
+import sys
+
+# Run as a script, this file's directory (the floability package) comes first
+# on sys.path, where its modules could shadow those nbclient imports
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(
+    os.path.abspath(__file__)
+):
+    sys.path.pop(0)
+
+import argparse
+import json
+import time
+
+import nbformat
+from nbclient import NotebookClient
+from nbclient.exceptions import CellExecutionError, CellTimeoutError
+
+
+def kernel_memory(pid):
+    """
+    Return the current and peak resident memory of process pid in bytes,
+    or (None, None) where /proc is not available.
+    """
+
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    usage[name] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, TypeError):
+        pass
+    return usage.get("VmRSS"), usage.get("VmHWM")
+
+
+def output_text(output):
+    if output.get("output_type") == "stream":
+        return output.get("text", "")
+    if output.get("output_type") == "error":
+        return "\n".join(output.get("traceback", []))
+    data = output.get("data", {})
+    return data.get("text/plain", "")
+
+
+class CellRecorder:
+    """
+    Hooks of the NotebookClient that time each code cell and record it.
+    """
+
+    def __init__(self, client, total, metrics_file, outputs_file):
+        self.client = client
+        self.total = total
+        self.metrics = open(metrics_file, "a", encoding="utf-8")
+        self.outputs = open(outputs_file, "a", encoding="utf-8")
+        self.count = 0
+        self.current = None
+
+    def close(self):
+        self.metrics.close()
+        self.outputs.close()
+
+    def kernel_pid(self):
+        provisioner = getattr(self.client.km, "provisioner", None)
+        return getattr(provisioner, "pid", None)
+
+    def on_cell_execute(self, cell, cell_index):
+        # Unlike on_cell_start, only called for cells that are executed
+        self.count += 1
+        self.current = (cell_index, time.monotonic())
+
+    def on_cell_executed(self, cell, cell_index, execute_reply):
+        status = execute_reply.get("content", {}).get("status", "ok")
+        self.record(cell, cell_index, status)
+
+    def record(self, cell, cell_index, status):
+        if self.current is None or self.current[0] != cell_index:
+            return
+        duration = time.monotonic() - self.current[1]
+        self.current = None
+        rss, peak_rss = kernel_memory(self.kernel_pid())
+
+        entry = {
+            "cell": cell_index,
+            "execution_count": cell.get("execution_count"),
+            "status": status,
+            "duration": round(duration, 3),
+            "rss": rss,
+            "peak_rss": peak_rss,
+            "outputs": len(cell.get("outputs", [])),
+        }
+        self.metrics.write(json.dumps(entry) + "\n")
+        self.metrics.flush()
+
+        self.outputs.write(f"--- cell {cell_index} [{status}] ---\n")
+        for output in cell.get("outputs", []):
+            text = output_text(output)
+            if text:
+                self.outputs.write(text if text.endswith("\n") else text + "\n")
+        self.outputs.flush()
+
+        memory = f", kernel rss {rss / 1024**2:.0f} MB" if rss else ""
+        print(
+            f"Cell {self.count}/{self.total} (index {cell_index}) {status} "
+            f"in {duration:.2f}s{memory}",
+            flush=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute a notebook with nbclient.")
+    parser.add_argument("notebook")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--metrics", required=True)
+    parser.add_argument("--outputs-log", required=True)
+    parser.add_argument("--cell-timeout", type=int, default=None)
+    args = parser.parse_args()
+
+    nb = nbformat.read(args.notebook, as_version=4)
+    total = sum(
+        1 for cell in nb.cells if cell.cell_type == "code" and cell.source.strip()
+    )
+
+    # The kernel runs in the notebook's directory, as with nbconvert
+    notebook_dir = os.path.dirname(os.path.abspath(args.notebook))
+    client = NotebookClient(
+        nb, timeout=args.cell_timeout, resources={"metadata": {"path": notebook_dir}}
+    )
+    recorder = CellRecorder(client, total, args.metrics, args.outputs_log)
+    client.on_cell_execute = recorder.on_cell_execute
+    client.on_cell_executed = recorder.on_cell_executed
+
+    started = time.monotonic()
+    status = 0
+    try:
+        client.execute()
+    except CellTimeoutError:
+        if recorder.current is not None:
+            index = recorder.current[0]
+            recorder.record(nb.cells[index], index, "timeout")
+        print(f"Cell timed out after {args.cell_timeout}s", flush=True)
+        status = 1
+    except CellExecutionError as e:
+        print(f"Cell failed: {e.ename}: {e.evalue}", flush=True)
+        status = 1
+    finally:
+        recorder.close()
+        nbformat.write(client.nb, args.output)
+
+    print(
+        f"Executed {recorder.count} of {total} code cells in "
+        f"{time.monotonic() - started:.1f}s",
+        flush=True,
+    )
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,509 @@
+"""
+Registry of prebuilt environment packs shared between nodes.
+
+Packs built by create_conda_pack_from_yml are named after the fingerprint of
+their environment (env_<fingerprint>.<format>). A registry keeps packs under
+that name so that a node needing an environment can fetch a pack another node
+built instead of solving and packing it again.
+
+A registry is either a directory on a shared filesystem or the URL of a
+registry served with `floability registry serve`, which keeps its packs in
+a directory the same way. Packs are published under a temporary name and
+linked into place, so readers never see a partial pack, and a published pack
+is never overwritten. Each pack is accompanied by its sha256 digest
+(<name>.sha256), which is verified whenever the pack is fetched. When the
+registry has a size limit, the least recently used packs are evicted after
+each publish.
+
+An HTTP registry listens on localhost unless told otherwise. If it is given a
+token, publishing requires that token (see REGISTRY_TOKEN_ENV).
+"""
+
+import abc
+import hashlib
+import hmac
+import http.server
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from .utils import format_size
+
+# (connect, read) timeouts in seconds for HTTP registries
+REGISTRY_TIMEOUT = (30, 300)
+
+# Temporary files of interrupted publishes older than this are removed
+STALE_TEMP_AGE = 24 * 60 * 60
+
+# A pack without its digest is still being published, unless it is older
+# than this, in which case its publish was interrupted and it may be replaced
+INCOMPLETE_PUBLISH_AGE = 60
+
+CHUNK_SIZE = 1024 * 1024
+
+# Pack names are file names; anything else is rejected by the server
+PACK_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9._-]*$")
+
+# Suffix of the file holding a pack's sha256 digest, and the HTTP header that
+# carries it
+DIGEST_SUFFIX = ".sha256"
+DIGEST_HEADER = "X-Checksum-Sha256"
+
+# Token that an HTTP registry requires for publishing, and that clients send
+REGISTRY_TOKEN_ENV = "FLOABILITY_REGISTRY_TOKEN"
+
+
+class PackRegistryError(Exception):
+    """
+    Raised when a registry cannot be read from or published to.
+    """
+
+
+class PackExistsError(PackRegistryError):
+    """
+    Raised when publishing a pack under a name the registry already holds.
+    """
+
+
+class PackRegistry(abc.ABC):
+    """
+    Interface of pack registries. location describes the registry in
+    messages.
+    """
+
+    location = None
+
+    @abc.abstractmethod
+    def fetch(self, name: str, dest: str) -> bool:
+        """
+        Copy the pack called name into dest and verify its digest. Return
+        whether the registry had it.
+        """
+
+    @abc.abstractmethod
+    def publish(self, path: str, name: str) -> None:
+        """
+        Add the pack at path under name. Raise PackExistsError if the
+        registry already has a pack called name.
+        """
+
+
+class FilesystemPackRegistry(PackRegistry):
+    """
+    Registry in a directory, usually on a filesystem shared by all nodes.
+    A pack's modification time records its last use and drives eviction.
+    """
+
+    def __init__(self, root: str, max_size: Optional[int] = None):
+        self.root = Path(root)
+        self.location = str(self.root)
+        self.max_size = max_size
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise PackRegistryError(f"Cannot create registry {root}: {e}") from e
+
+    def pack_path(self, name: str) -> Path:
+        if not PACK_NAME_PATTERN.match(name) or name.endswith(DIGEST_SUFFIX):
+            raise PackRegistryError(f"Invalid pack name '{name}'")
+        return self.root / name
+
+    def digest_path(self, name: str) -> Path:
+        return self.pack_path(name).with_name(name + DIGEST_SUFFIX)
+
+    def read_digest(self, name: str) -> Optional[str]:
+        """
+        Return the sha256 digest published with the pack called name, or None
+        if there is none (the pack is missing or still being published).
+        """
+
+        try:
+            with open(self.digest_path(name), "r") as f:
+                return f.read().split()[0]
+        except (FileNotFoundError, IndexError):
+            return None
+
+    def _touch(self, path: Path) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            # A read-only registry still serves packs, without LRU order
+            pass
+
+    def fetch(self, name: str, dest: str) -> bool:
+        path = self.pack_path(name)
+        try:
+            expected = self.read_digest(name)
+            if expected is None:
+                return False
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as src, open(dest, "wb") as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    dst.write(chunk)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            raise PackRegistryError(f"Cannot fetch {name} from {self.root}: {e}") from e
+
+        _check_digest(name, sha256.hexdigest(), expected, self.location)
+        self._touch(path)
+        return True
+
+    def publish(self, path: str, name: str) -> None:
+        try:
+            with open(path, "rb") as f:
+                self.publish_from(f, name, os.fstat(f.fileno()).st_size)
+        except OSError as e:
+            raise PackRegistryError(f"Cannot publish {name} to {self.root}: {e}") from e
+
+    def _is_published(self, name: str) -> bool:
+        """
+        Return whether the pack called name is published, or is being
+        published by someone else, and so must not be replaced.
+        """
+
+        try:
+            mtime = self.pack_path(name).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return (
+            self.read_digest(name) is not None
+            or time.time() - mtime < INCOMPLETE_PUBLISH_AGE
+        )
+
+    def publish_from(
+        self, stream, name: str, length: int, expected: Optional[str] = None
+    ) -> None:
+        """
+        Publish a pack of length bytes read from stream, e.g. an HTTP request,
+        and its sha256 digest, which must equal expected if that is given.
+        Raise PackExistsError if the registry already has a pack called name.
+        """
+
+        target = self.pack_path(name)
+        if self._is_published(name):
+            raise PackExistsError(f"{name} is already in {self.location}")
+
+        suffix = f"{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        temp = self.root / f".{name}.{suffix}"
+        temp_digest = self.root / f".{name}{DIGEST_SUFFIX}.{suffix}"
+        try:
+            sha256 = hashlib.sha256()
+            with open(temp, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise PackRegistryError(
+                            f"Upload of {name} ended after {length - remaining} "
+                            f"of {length} bytes"
+                        )
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            digest = sha256.hexdigest()
+            if expected is not None:
+                _check_digest(name, digest, expected, self.location)
+            with open(temp_digest, "w") as f:
+                f.write(f"{digest}  {name}\n")
+
+            # Linking fails if another publisher got there first; a pack left
+            # without a digest by an interrupted publish is replaced
+            try:
+                os.link(temp, target)
+            except FileExistsError:
+                if self._is_published(name):
+                    raise PackExistsError(f"{name} is already in {self.location}")
+                os.replace(temp, target)
+            os.replace(temp_digest, self.digest_path(name))
+        finally:
+            for path in (temp, temp_digest):
+                if path.exists():
+                    path.unlink()
+
+        if self.max_size is not None:
+            self.evict(self.max_size, keep=name)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        Return the packs in the registry, least recently used first.
+        """
+
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".") or path.name.endswith(DIGEST_SUFFIX):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append(
+                {"name": path.name, "size": st.st_size, "last_used": st.st_mtime}
+            )
+        entries.sort(key=lambda entry: entry["last_used"])
+        return entries
+
+    def evict(self, max_size: int, keep: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Remove least recently used packs (never keep) until the registry is at
+        most max_size bytes. Return the removed entries.
+        """
+
+        now = time.time()
+        for path in self.root.glob(".*.tmp"):
+            try:
+                if now - path.stat().st_mtime > STALE_TEMP_AGE:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_size:
+                break
+            if entry["name"] == keep:
+                continue
+            for path in (
+                self.root / entry["name"],
+                self.root / (entry["name"] + DIGEST_SUFFIX),
+            ):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    # Evicted concurrently by another node
+                    pass
+            total -= entry["size"]
+            removed.append(entry)
+            print(
+                f"[registry] Evicted {entry['name']} ({format_size(entry['size'])})"
+            )
+        return removed
+
+
+class HttpPackRegistry(PackRegistry):
+    """
+    Registry served over HTTP: packs are fetched with GET <url>/<name> and
+    published with PUT <url>/<name>, with their sha256 digest in the
+    DIGEST_HEADER header both ways. The server publishes atomically and
+    enforces its own size limit. token is sent as a bearer token.
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None):
+        self.url = url.rstrip("/")
+        self.location = self.url
+        self.token = token
+
+    def fetch(self, name: str, dest: str) -> bool:
+        try:
+            with requests.get(
+                f"{self.url}/{name}", stream=True, timeout=REGISTRY_TIMEOUT
+            ) as r:
+                if r.status_code == 404:
+                    return False
+                r.raise_for_status()
+                expected = r.headers.get("Content-Length")
+                digest = r.headers.get(DIGEST_HEADER)
+                if digest is None:
+                    raise PackRegistryError(f"{self.url} sent {name} without a digest")
+                received = 0
+                sha256 = hashlib.sha256()
+                with open(dest, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        sha256.update(chunk)
+                        f.write(chunk)
+                        received += len(chunk)
+        except (requests.RequestException, OSError) as e:
+            raise PackRegistryError(f"Cannot fetch {name} from {self.url}: {e}") from e
+
+        if expected is not None and int(expected) != received:
+            raise PackRegistryError(
+                f"Fetched {received} of {expected} bytes of {name} from {self.url}"
+            )
+        _check_digest(name, sha256.hexdigest(), digest, self.location)
+        return True
+
+    def publish(self, path: str, name: str) -> None:
+        try:
+            # Avoid uploading a pack the server would refuse
+            r = requests.head(f"{self.url}/{name}", timeout=REGISTRY_TIMEOUT)
+            if r.status_code == 200:
+                raise PackExistsError(f"{name} is already in {self.url}")
+
+            headers = {
+                "Content-Length": str(os.path.getsize(path)),
+                DIGEST_HEADER: file_sha256(path),
+            }
+            if self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            with open(path, "rb") as f:
+                r = requests.put(
+                    f"{self.url}/{name}",
+                    data=f,
+                    headers=headers,
+                    timeout=REGISTRY_TIMEOUT,
+                )
+        except (requests.RequestException, OSError) as e:
+            raise PackRegistryError(f"Cannot publish {name} to {self.url}: {e}") from e
+
+        if r.status_code == 409:
+            raise PackExistsError(f"{name} is already in {self.url}")
+        if not r.ok:
+            raise PackRegistryError(
+                f"Cannot publish {name} to {self.url}: {r.status_code} {r.reason}"
+            )
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _check_digest(name: str, actual: str, expected: str, location: str) -> None:
+    if actual.lower() != expected.strip().lower():
+        raise PackRegistryError(
+            f"sha256 of {name} from {location} is {actual}, expected {expected}"
+        )
+
+
+def open_pack_registry(
+    location: Optional[str], max_size: Optional[int] = None
+) -> Optional[PackRegistry]:
+    """
+    Return the registry at location, an http(s) URL or a directory, or None
+    if no location is configured. max_size only applies to directories; an
+    HTTP registry's size is limited by its server, and is published to with
+    the token in REGISTRY_TOKEN_ENV if that is set.
+    """
+
+    if not location:
+        return None
+    if location.startswith(("http://", "https://")):
+        return HttpPackRegistry(location, os.environ.get(REGISTRY_TOKEN_ENV))
+    return FilesystemPackRegistry(location, max_size)
+
+
+class _RegistryRequestHandler(http.server.BaseHTTPRequestHandler):
+    registry: FilesystemPackRegistry = None
+    token: Optional[str] = None
+
+    def _pack_path(self) -> Optional[Path]:
+        try:
+            return self.registry.pack_path(self.path.lstrip("/"))
+        except PackRegistryError:
+            self.send_error(400, "Invalid pack name")
+            return None
+
+    def _send_pack(self, body: bool) -> None:
+        path = self._pack_path()
+        if path is None:
+            return
+        # Packs still being published have no digest yet
+        digest = self.registry.read_digest(path.name)
+        try:
+            if digest is None:
+                raise FileNotFoundError(path)
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self.send_error(404, "No such pack")
+            return
+
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header(DIGEST_HEADER, digest)
+            self.end_headers()
+            if body:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+                self.registry._touch(path)
+
+    def do_HEAD(self):
+        self._send_pack(body=False)
+
+    def do_GET(self):
+        self._send_pack(body=True)
+
+    def do_PUT(self):
+        if self.token is not None and not hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {self.token}"
+        ):
+            self.send_error(401, "Publishing requires the registry token")
+            return
+        if self._pack_path() is None:
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_error(411, "Content-Length required")
+            return
+
+        try:
+            self.registry.publish_from(
+                self.rfile,
+                self.path.lstrip("/"),
+                int(length),
+                self.headers.get(DIGEST_HEADER),
+            )
+        except PackExistsError as e:
+            self.send_error(409, str(e))
+            return
+        except (PackRegistryError, ValueError) as e:
+            # A truncated upload, or one that does not match its digest
+            self.send_error(400, str(e))
+            return
+        except OSError as e:
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        print(f"[registry] {self.address_string()} {format % args}")
+
+
+def serve_pack_registry(
+    root: str,
+    host: str = "127.0.0.1",
+    port: int = 8780,
+    max_size: Optional[int] = None,
+    token: Optional[str] = None,
+) -> None:
+    """
+    Serve the registry in directory root over HTTP until interrupted. If
+    token is given, publishing requires it as a bearer token.
+    """
+
+    registry = FilesystemPackRegistry(root, max_size)
+    handler = type(
+        "RegistryRequestHandler",
+        (_RegistryRequestHandler,),
+        {"registry": registry, "token": token},
+    )
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    limit = f", up to {format_size(max_size)}" if max_size is not None else ""
+    print(f"[registry] Serving packs in {root} on {host}:{port}{limit}")
+    if token is None and host not in ("127.0.0.1", "localhost", "::1"):
+        print(
+            f"[registry] Warning: anyone who can reach {host}:{port} can publish "
+            f"packs; set {REGISTRY_TOKEN_ENV} to require a token."
+        )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,145 @@
+"""
+Dependency-aware startup pipeline.
+
+run_floability describes its startup (data fetch, environment builds,
+extraction, vine_factory launch) as steps with dependencies. Every step starts
+as soon as the steps it depends on have finished, so that, for example, the
+factory is submitted to the batch system while the manager environment is
+still being extracted and data is still being staged.
+"""
+
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .report import timed_phase
+
+TIMELINE_WIDTH = 40
+
+
+class StartupError(Exception):
+    """
+    Raised when one or more startup steps failed. Steps depending on a failed
+    step are not run and are listed as skipped.
+    """
+
+    def __init__(self, failures: List[Tuple[str, BaseException]], skipped: List[str]):
+        self.failures = failures
+        self.skipped = skipped
+        details = "; ".join(f"'{name}': {error}" for name, error in failures)
+        super().__init__(f"{len(failures)} startup step(s) failed: {details}")
+
+
+class StartupStep:
+    def __init__(self, name: str, func: Callable, deps: Iterable[str]):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.started = None
+        self.finished = None
+        self.error = None
+
+
+class StartupPipeline:
+    """
+    Run steps concurrently in dependency order. Each step's function is called
+    with a dict of the results of all steps finished so far.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.steps: Dict[str, StartupStep] = {}
+        self.results: Dict[str, Any] = {}
+        self.max_workers = max_workers
+        self.start_time = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = ()) -> None:
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dep}'")
+        self.steps[name] = StartupStep(name, func, deps)
+
+    def _run_step(self, step: StartupStep) -> Any:
+        step.started = time.monotonic()
+        try:
+            with self._lock:
+                results = dict(self.results)
+            with timed_phase("startup_step", step=step.name):
+                return step.func(results)
+        finally:
+            step.finished = time.monotonic()
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run all steps and return their results by name.
+        Raise StartupError once every runnable step has finished if any failed.
+        """
+
+        self.start_time = time.monotonic()
+        pending = dict(self.steps)
+        failed = set()
+        skipped = []
+        failures = []
+        running = {}
+
+        max_workers = self.max_workers or max(len(self.steps), 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if any(dep in failed for dep in step.deps):
+                        del pending[name]
+                        failed.add(name)
+                        skipped.append(name)
+                    elif all(dep in self.results for dep in step.deps):
+                        del pending[name]
+                        running[pool.submit(self._run_step, step)] = step
+
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        step.error = error
+                        failed.add(step.name)
+                        failures.append((step.name, error))
+                    else:
+                        with self._lock:
+                            self.results[step.name] = future.result()
+
+        if failures:
+            raise StartupError(failures, skipped)
+        return self.results
+
+    def timeline(self) -> str:
+        """
+        Return a text chart of when each step ran, relative to the start of
+        the pipeline, showing which steps overlapped.
+        """
+
+        ran = [step for step in self.steps.values() if step.started is not None]
+        if not ran:
+            return ""
+
+        end = max(step.finished for step in ran) - self.start_time
+        scale = TIMELINE_WIDTH / end if end > 0 else 0
+        name_width = max(len(step.name) for step in ran)
+
+        lines = [f"[floability] Startup timeline ({end:.1f}s):"]
+        for step in sorted(ran, key=lambda s: s.started):
+            start = step.started - self.start_time
+            finish = step.finished - self.start_time
+            offset = min(int(start * scale), TIMELINE_WIDTH - 1)
+            length = max(int(finish * scale) - offset, 1)
+            bar = " " * offset + "#" * length
+            status = " (failed)" if step.error is not None else ""
+            lines.append(
+                f"  {step.name:<{name_width}} |{bar:<{TIMELINE_WIDTH}}| "
+                f"{start:6.1f}s - {finish:6.1f}s{status}"
+            )
+        return "\n".join(lines)
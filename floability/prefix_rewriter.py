@@ -0,0 +1,227 @@
+"""
+Parallel prefix rewriting of extracted conda environments.
+
+conda-pack records every file that contains the build prefix of the packed
+environment in the _prefix_records manifest of the bin/conda-unpack script it
+ships with the pack. conda-unpack then reads and rewrites those files one after
+another in a single process. floability reads the same manifest and rewrites
+the files itself across a pool of worker processes:
+
+- files are memory-mapped and skipped without being read into memory or
+  written back when the placeholder does not occur in them,
+- binary files are patched in place through the mapping, replacing the
+  placeholder in each NUL-terminated string with the new prefix padded with
+  NULs to the original length, exactly as conda-unpack does,
+- text files containing the placeholder are rewritten with a plain
+  replacement.
+"""
+
+import ast
+import concurrent.futures
+import heapq
+import mmap
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+from typing import List, Optional, Tuple
+
+PrefixRecord = Tuple[str, str, str]
+
+# The manifest is a list literal of (path, placeholder, mode) tuples
+PREFIX_RECORDS_PATTERN = re.compile(
+    rb"^_prefix_records = (\[.*?^\])$", re.MULTILINE | re.DOTALL
+)
+
+# Recorded bytes below which starting another worker process costs more than
+# it saves; files are scanned at several hundred MB/s by a single process
+BYTES_PER_WORKER = 128 * 1024 * 1024
+
+
+def read_prefix_records(env_dir: str) -> Optional[List[PrefixRecord]]:
+    """
+    Return the (path, placeholder, mode) records of the files of env_dir that
+    contain the prefix the environment was packed from, as listed in its
+    bin/conda-unpack script. Return None if the manifest cannot be read.
+    """
+
+    script = os.path.join(env_dir, "bin", "conda-unpack")
+    try:
+        with open(script, "rb") as f:
+            match = PREFIX_RECORDS_PATTERN.search(f.read())
+        if match is None:
+            return None
+        records = ast.literal_eval(match.group(1).decode("utf-8"))
+    except (OSError, ValueError, SyntaxError, UnicodeDecodeError):
+        return None
+
+    if not all(
+        isinstance(record, tuple)
+        and len(record) == 3
+        and record[2] in ("text", "binary")
+        for record in records
+    ):
+        return None
+    return [tuple(record) for record in records]
+
+
+def _binary_replace(mm: mmap.mmap, placeholder: bytes, new_prefix: bytes) -> bool:
+    """
+    Replace placeholder with new_prefix in the NUL-terminated strings of mm,
+    padding each string with NULs so that its length does not change.
+    """
+
+    changed = False
+    pattern = re.compile(re.escape(placeholder) + rb"([^\0]*?)\0")
+    for match in pattern.finditer(mm):
+        string = match.group()
+        occurrences = string.count(placeholder)
+        padding = (len(placeholder) - len(new_prefix)) * occurrences
+        if padding < 0:
+            raise ValueError(
+                f"New prefix {new_prefix!r} is longer than the placeholder "
+                "of a binary file"
+            )
+        replaced = string.replace(placeholder, new_prefix) + b"\0" * padding
+        if replaced != string:
+            mm[match.start() : match.end()] = replaced
+            changed = True
+    return changed
+
+
+def rewrite_file(path: str, placeholder: str, mode: str, new_prefix: str) -> bool:
+    """
+    Replace placeholder with new_prefix in the file at path.
+    Return whether the file changed.
+    """
+
+    placeholder_bytes = placeholder.encode("utf-8")
+    new_prefix_bytes = new_prefix.encode("utf-8")
+
+    with open(path, "rb+") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+
+        with mmap.mmap(f.fileno(), 0) as mm:
+            if mm.find(placeholder_bytes) == -1:
+                return False
+
+            if mode == "binary":
+                changed = _binary_replace(mm, placeholder_bytes, new_prefix_bytes)
+                if changed:
+                    mm.flush()
+            else:
+                data = mm[:].replace(placeholder_bytes, new_prefix_bytes)
+                changed = True
+
+        if mode != "binary":
+            f.seek(0)
+            f.write(data)
+            f.truncate()
+
+    if changed and platform.system() == "Darwin" and platform.machine() == "arm64":
+        # Modified binaries must be re-signed to run on Apple silicon
+        subprocess.run(
+            ["/usr/bin/codesign", "-s", "-", "-f", path], capture_output=True
+        )
+
+    return changed
+
+
+def _rewrite_chunk(records: List[PrefixRecord], env_dir: str) -> int:
+    changed = 0
+    for path, placeholder, mode in records:
+        if rewrite_file(os.path.join(env_dir, path), placeholder, mode, env_dir):
+            changed += 1
+    return changed
+
+
+def _balanced_chunks(
+    sized: List[Tuple[int, PrefixRecord]], count: int
+) -> List[List[PrefixRecord]]:
+    """
+    Split (size, record) pairs into count chunks of records of about the same
+    number of bytes.
+    """
+
+    # Largest files first, each into the currently lightest chunk
+    heap = [(0, i) for i in range(count)]
+    chunks = [[] for _ in range(count)]
+    for size, record in sorted(sized, key=lambda item: item[0], reverse=True):
+        total, i = heapq.heappop(heap)
+        chunks[i].append(record)
+        heapq.heappush(heap, (total + size, i))
+    return [chunk for chunk in chunks if chunk]
+
+
+def rewrite_prefixes(
+    env_dir: str,
+    records: List[PrefixRecord],
+    max_workers: Optional[int] = None,
+) -> int:
+    """
+    Rewrite the prefix placeholders of records to env_dir, across up to
+    max_workers processes (one per CPU by default) when there is enough data
+    to make extra processes worthwhile.
+    Return the number of files that changed.
+    """
+
+    env_dir = os.path.abspath(env_dir)
+    sized = []
+    for record in records:
+        try:
+            size = os.path.getsize(os.path.join(env_dir, record[0]))
+        except OSError:
+            size = 0
+        sized.append((size, record))
+    total_bytes = sum(size for size, _ in sized)
+
+    workers = min(
+        max_workers or os.cpu_count() or 1,
+        total_bytes // BYTES_PER_WORKER + 1,
+        len(records),
+    )
+    if workers <= 1:
+        return _rewrite_chunk(records, env_dir)
+
+    chunks = _balanced_chunks(sized, workers)
+
+    # Callers run in threads of the startup pipeline, which must not be forked
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=len(chunks), mp_context=context
+    ) as pool:
+        futures = [pool.submit(_rewrite_chunk, chunk, env_dir) for chunk in chunks]
+        return sum(future.result() for future in futures)
+
+
+def unpack_environment(env_dir: str, max_workers: Optional[int] = None) -> None:
+    """
+    Point the files of the freshly extracted environment env_dir at its new
+    location. Falls back to running the pack's conda-unpack script if its
+    prefix manifest cannot be read.
+    """
+
+    env_dir = os.path.abspath(env_dir)
+    records = read_prefix_records(env_dir)
+
+    if records is None:
+        print(
+            f"[environment] Could not read the prefix manifest of {env_dir}, "
+            "running conda-unpack"
+        )
+        subprocess.run(
+            [
+                os.path.join(env_dir, "bin", "python"),
+                os.path.join(env_dir, "bin", "conda-unpack"),
+            ],
+            check=True,
+        )
+        return
+
+    changed = rewrite_prefixes(env_dir, records, max_workers)
+    print(
+        f"[environment] Rewrote prefix in {changed} of {len(records)} "
+        f"recorded files of {env_dir}"
+    )
@@ -0,0 +1,192 @@
+"""
+Timing report of a floability run.
+
+Each phase of a run (spec resolution, data items, environment hashing,
+solving, packing, extraction, vine_factory launch, first worker, Jupyter
+ready, ...) is timed with a monotonic clock and appended as one JSON line to
+run_report.jsonl in the run directory. `floability report <run_dir>`
+summarizes the file, so startup time can be compared across releases.
+
+Code deep inside floability records phases through timed_phase() and
+record_event(), which write to the report of the current run and do nothing
+when no report is active (e.g. for `floability fetch`).
+"""
+
+import contextlib
+import datetime
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import __version__
+
+REPORT_FILE_NAME = "run_report.jsonl"
+
+_active_report = None
+
+
+class RunReport:
+    """
+    Append-only JSONL record of the phases of one run. Offsets and durations
+    are in seconds, measured from the start of the run.
+    """
+
+    def __init__(self, run_dir: str, start: Optional[float] = None):
+        self.path = Path(run_dir) / REPORT_FILE_NAME
+        self.start = start if start is not None else time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        phase: str,
+        start: float,
+        end: Optional[float] = None,
+        status: str = "ok",
+        **fields: Any,
+    ) -> None:
+        """
+        Record a phase that began at monotonic time start and ended at end.
+        Without end the entry is an event at a single point in time.
+        """
+
+        entry = {
+            "phase": phase,
+            "start": round(start - self.start, 3),
+            "duration": round(end - start, 3) if end is not None else None,
+            "status": status,
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        entry.update(fields)
+        line = json.dumps(entry, default=str)
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    @contextlib.contextmanager
+    def phase(self, phase: str, **fields: Any):
+        start = time.monotonic()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            self.record(phase, start, time.monotonic(), status, **fields)
+
+
+def start_report(
+    run_dir: str, start: Optional[float] = None, **fields: Any
+) -> RunReport:
+    """
+    Create the report of a run in run_dir and make it the active report.
+    start is the monotonic time the run began, if earlier than now.
+    """
+
+    global _active_report
+    _active_report = RunReport(run_dir, start)
+    _active_report.record(
+        "run_start", _active_report.start, version=__version__, **fields
+    )
+    return _active_report
+
+
+def active_report() -> Optional[RunReport]:
+    return _active_report
+
+
+@contextlib.contextmanager
+def timed_phase(phase: str, **fields: Any):
+    """
+    Time the enclosed block as phase in the active report, if there is one.
+    """
+
+    report = _active_report
+    if report is None:
+        yield
+        return
+
+    with report.phase(phase, **fields):
+        yield
+
+
+def record_event(phase: str, **fields: Any) -> None:
+    """
+    Record that phase happened now in the active report, if there is one.
+    """
+
+    report = _active_report
+    if report is not None:
+        report.record(phase, time.monotonic(), **fields)
+
+
+def load_report(path: str) -> List[Dict[str, Any]]:
+    """
+    Load the entries of a run report, given the file or its run directory.
+    """
+
+    report_path = Path(path)
+    if report_path.is_dir():
+        report_path = report_path / REPORT_FILE_NAME
+
+    entries = []
+    with open(report_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+def summarize_report(entries: List[Dict[str, Any]]) -> str:
+    """
+    Summarize report entries per phase, in the order the phases first began:
+    how often each ran, when it first started, its total and longest duration.
+    """
+
+    phases: Dict[str, Dict[str, Any]] = {}
+    end = 0.0
+    version = None
+
+    for entry in entries:
+        if entry["phase"] == "run_start":
+            version = entry.get("version")
+            continue
+
+        start = entry["start"]
+        duration = entry.get("duration")
+        end = max(end, start + (duration or 0))
+
+        # Startup pipeline steps are listed individually
+        name = entry["phase"]
+        if "step" in entry:
+            name = f"{name}:{entry['step']}"
+
+        summary = phases.setdefault(
+            name,
+            {"count": 0, "first": start, "total": None, "max": None, "failed": 0},
+        )
+        summary["count"] += 1
+        summary["first"] = min(summary["first"], start)
+        if entry.get("status") == "failed":
+            summary["failed"] += 1
+        if duration is not None:
+            summary["total"] = (summary["total"] or 0) + duration
+            summary["max"] = max(summary["max"] or 0, duration)
+
+    lines = [f"floability {version or 'unknown'} run, {end:.1f}s recorded"]
+    lines.append(f"{'phase':<24} {'count':>5} {'start':>9} {'total':>9} {'max':>9}")
+
+    for name, summary in sorted(phases.items(), key=lambda p: p[1]["first"]):
+        total = f"{summary['total']:.2f}s" if summary["total"] is not None else "-"
+        longest = f"{summary['max']:.2f}s" if summary["max"] is not None else "-"
+        failed = f"  ({summary['failed']} failed)" if summary["failed"] else ""
+        lines.append(
+            f"{name:<24} {summary['count']:>5} {summary['first']:>8.2f}s "
+            f"{total:>9} {longest:>9}{failed}"
+        )
+
+    return "\n".join(lines)
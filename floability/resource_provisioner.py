@@ -1,8 +1,82 @@
 import subprocess
-import sys
 import os
 import threading
+import time
+import requests
 import yaml
+from typing import Optional
+
+from .report import record_event
+
+class ProvisionError(Exception):
+    """
+    Raised when vine_factory cannot be configured or launched.
+    """
+
+
+# How often the catalog is asked whether a worker has connected (seconds)
+CATALOG_QUERY_INTERVAL = 15
+
+
+def catalog_query_url() -> str:
+    """
+    Return the query URL of the catalog server TaskVine managers report to,
+    honoring CATALOG_HOST and CATALOG_PORT like the cctools do.
+    """
+
+    host = os.environ.get("CATALOG_HOST", "catalog.cse.nd.edu").split(",")[0]
+    port = os.environ.get("CATALOG_PORT", "9097")
+    if ":" in host:
+        host, port = host.split(":", 1)
+    return f"http://{host}:{port}/query.json"
+
+
+def connected_workers(manager_name: str) -> int:
+    """
+    Return the number of workers connected to the manager named manager_name
+    according to the catalog, or 0 if the manager has not reported yet.
+    """
+
+    response = requests.get(catalog_query_url(), timeout=30)
+    response.raise_for_status()
+
+    for record in response.json():
+        if record.get("type") != "vine_manager":
+            continue
+        if record.get("project") == manager_name:
+            workers = record.get("workers_connected", record.get("workers"))
+            return int(workers or 0)
+    return 0
+
+
+def watch_for_first_worker(
+    manager_name: str, factory_proc, interval: float = CATALOG_QUERY_INTERVAL
+) -> Optional[threading.Thread]:
+    """
+    Poll the catalog (see catalog_query_url) in a background thread until a
+    worker has connected to the manager, then record the first_worker event
+    in the run report. Gives up when vine_factory exits. Return None without
+    polling if there is no factory_proc, e.g. because it was not started.
+    """
+
+    if factory_proc is None:
+        return None
+
+    def watch():
+        while factory_proc.poll() is None:
+            try:
+                workers = connected_workers(manager_name)
+            except (requests.RequestException, ValueError):
+                workers = 0
+            if workers:
+                print(f"[provision] First worker connected to '{manager_name}'.")
+                record_event("first_worker", workers=workers)
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
 
 
 def start_vine_factory(
@@ -15,7 +89,15 @@ def start_vine_factory(
     scratch_dir: str = "/tmp/",
     run_dir: str = "/tmp/",
     config_yml: str = None,
+    watch_stderr: bool = True,
 ):
+    """
+    Launch vine_factory and return its process. Its stderr is printed by a
+    background thread unless watch_stderr is False, in which case the caller
+    must read proc.stderr, e.g. through a Supervisor. Raises ProvisionError
+    if the configuration cannot be read or vine_factory cannot be started.
+    """
+
     cmd = [
         "vine_factory",
         f"-T{batch_type}",
@@ -74,12 +156,10 @@ def start_vine_factory(
             if condor_requirements:
                 cmd.append(f"--condor-requirements={condor_requirements}")
 
-        except FileNotFoundError:
-            print(f"[provision] Error: Cluster config file '{config_yml}' not found.")
-            sys.exit(1)
+        except FileNotFoundError as e:
+            raise ProvisionError(f"Cluster config file '{config_yml}' not found") from e
         except Exception as e:
-            print(f"[provision] Unexpected error loading cluster config: {e}")
-            sys.exit(1)
+            raise ProvisionError(f"Unexpected error loading cluster config: {e}") from e
 
     if poncho_env:
         # from vine_factory help: --poncho-env=<file.tar.gz>
@@ -92,13 +172,14 @@ def start_vine_factory(
 
         print(f"[provision] vine_factory stdout: {stdout_file}")
 
-        with open(stdout_file, "w") as stdout:
+        # Appended to, so the log of a factory that is restarted is kept
+        with open(stdout_file, "a") as stdout:
             proc = subprocess.Popen(
                 cmd,
                 stdout=stdout,
                 stderr=subprocess.PIPE,
                 text=True,
-                preexec_fn=os.setsid,
+                start_new_session=True,
             )
 
             # stderr=stdout, #todo: parse this error for better error handling
@@ -107,13 +188,12 @@ def start_vine_factory(
                     print(f"[provision] vine_factory error: {line.strip()}")
 
             # Start a thread to print stderr
-            stderr_thread = threading.Thread(target=print_stderr, args=(proc,))
-            stderr_thread.start()
+            if watch_stderr:
+                stderr_thread = threading.Thread(target=print_stderr, args=(proc,))
+                stderr_thread.start()
 
             return proc
-    except FileNotFoundError:
-        print("[provision] Error: 'vine_factory' not found in PATH.")
-        sys.exit(1)
+    except FileNotFoundError as e:
+        raise ProvisionError("'vine_factory' not found in PATH") from e
     except Exception as e:
-        print(f"[provision] Unexpected error launching vine_factory: {e}")
-        sys.exit(1)
+        raise ProvisionError(f"Unexpected error launching vine_factory: {e}") from e
@@ -0,0 +1,312 @@
+"""
+Event-driven supervision of floability's long-running child processes.
+
+The supervisor waits on one selector for every event it reacts to: the exit
+of a child (through a pidfd where the platform has os.pidfd_open, through a
+waiter thread otherwise), lines written to a child's output pipe, and wake-ups
+from other threads or signal handlers. Nothing is polled, so a failed
+vine_factory or a Ctrl+C is handled as soon as it happens.
+
+Each process has a restart policy: 'never', 'on-failure' (non-zero exit) or
+'always', limited to max_restarts restarts with exponential backoff. When a
+critical process exits for good, the supervisor stops and the run ends.
+"""
+
+import os
+import selectors
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .report import record_event
+
+RESTART_POLICIES = ["never", "on-failure", "always"]
+DEFAULT_MAX_RESTARTS = 3
+
+# Delay before the first restart of a process, doubled for each further one
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+
+
+class ManagedProcess:
+    """
+    A supervised process, its restart policy and its current state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        start: Callable,
+        restart: str,
+        max_restarts: int,
+        critical: bool,
+        output: Optional[Callable],
+        on_output: Optional[Callable[[str], None]],
+    ):
+        self.name = name
+        self.start = start
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.critical = critical
+        self.output = output
+        self.on_output = on_output
+        self.proc = None
+        self.restarts = 0
+        self.restart_at = None
+        self.exit_fd = None
+        self.running = False
+
+
+class Supervisor:
+    """
+    Start, watch and restart child processes. Run the event loop with start()
+    in a background thread, add processes from any thread, and block in
+    wait() in the main thread until the supervisor stops.
+    """
+
+    def __init__(self, on_start: Optional[Callable] = None):
+        self.on_start = on_start
+        self.reason = None
+        self.processes: Dict[str, ManagedProcess] = {}
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, ("wake", None))
+
+        self._lock = threading.Lock()
+        self._new: List[ManagedProcess] = []
+        self._exited: List[ManagedProcess] = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the loop is already due to wake up
+            pass
+
+    def add(
+        self,
+        name: str,
+        start: Callable,
+        restart: str = "never",
+        max_restarts: int = DEFAULT_MAX_RESTARTS,
+        critical: bool = True,
+        output: Optional[Callable] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Start a process by calling start(), which returns a subprocess.Popen,
+        and supervise it under name. output(proc) may return a pipe of the
+        process whose lines are passed to on_output. Return the process, or
+        None if the supervisor has already stopped.
+        """
+
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"Unknown restart policy: {restart}")
+        if self._stopped.is_set():
+            return None
+
+        managed = ManagedProcess(
+            name, start, restart, max_restarts, critical, output, on_output
+        )
+        self._launch(managed)
+        with self._lock:
+            self.processes[name] = managed
+            self._new.append(managed)
+        self._wake()
+        return managed.proc
+
+    def _launch(self, managed: ManagedProcess) -> None:
+        managed.proc = managed.start()
+        managed.running = True
+        managed.restart_at = None
+        if self.on_start is not None:
+            self.on_start(managed.proc)
+
+    def _watch(self, managed: ManagedProcess) -> None:
+        proc = managed.proc
+        try:
+            managed.exit_fd = os.pidfd_open(proc.pid)
+            self._selector.register(
+                managed.exit_fd, selectors.EVENT_READ, ("exit", managed)
+            )
+        except (AttributeError, OSError):
+            # No pidfds (not Linux, or an old kernel), or the child is gone
+            managed.exit_fd = None
+
+            def wait_for_exit():
+                proc.wait()
+                with self._lock:
+                    self._exited.append(managed)
+                self._wake()
+
+            threading.Thread(target=wait_for_exit, daemon=True).start()
+
+        pipe = managed.output(proc) if managed.output else None
+        if pipe is not None:
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            self._selector.register(
+                fd, selectors.EVENT_READ, ("output", (managed, fd, bytearray()))
+            )
+
+    def _read_output(self, data) -> None:
+        managed, fd, buffer = data
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+
+        if chunk:
+            buffer.extend(chunk)
+        lines = buffer.split(b"\n")
+        if chunk:
+            buffer[:] = lines.pop()
+        else:
+            # End of output: flush a last unterminated line
+            buffer.clear()
+            self._selector.unregister(fd)
+        for line in lines:
+            if line:
+                managed.on_output(line.decode("utf-8", "replace").rstrip("\r"))
+
+    def _handle_exit(self, managed: ManagedProcess) -> None:
+        if managed.exit_fd is not None:
+            self._selector.unregister(managed.exit_fd)
+            os.close(managed.exit_fd)
+            managed.exit_fd = None
+
+        returncode = managed.proc.wait()
+        managed.running = False
+        record_event("process_exit", process=managed.name, returncode=returncode)
+        if self._stopped.is_set():
+            return
+
+        wants_restart = managed.restart == "always" or (
+            managed.restart == "on-failure" and returncode != 0
+        )
+        if wants_restart and managed.restarts < managed.max_restarts:
+            delay = min(
+                RESTART_BACKOFF * 2**managed.restarts, MAX_RESTART_BACKOFF
+            )
+            managed.restart_at = time.monotonic() + delay
+            print(
+                f"[supervisor] {managed.name} exited with code {returncode}; "
+                f"restarting in {delay:g}s "
+                f"({managed.restarts + 1}/{managed.max_restarts})."
+            )
+            return
+
+        if wants_restart:
+            print(
+                f"[supervisor] {managed.name} exited with code {returncode}; "
+                f"giving up after {managed.max_restarts} restarts."
+            )
+        else:
+            print(f"[supervisor] {managed.name} exited with code {returncode}.")
+
+        if managed.critical:
+            self.stop(f"{managed.name} exited")
+
+    def _restart(self, managed: ManagedProcess) -> None:
+        managed.restarts += 1
+        try:
+            self._launch(managed)
+        except (Exception, SystemExit) as e:
+            managed.restart_at = None
+            print(f"[supervisor] Could not restart {managed.name}: {e}")
+            if managed.critical:
+                self.stop(f"{managed.name} could not be restarted")
+            return
+
+        record_event("process_restart", process=managed.name, restarts=managed.restarts)
+        print(f"[supervisor] Restarted {managed.name} (pid {managed.proc.pid}).")
+        self._watch(managed)
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            with self._lock:
+                new, self._new = self._new, []
+                exited, self._exited = self._exited, []
+            for managed in new:
+                self._watch(managed)
+            for managed in exited:
+                self._handle_exit(managed)
+
+            processes = list(self.processes.values())
+            if processes and not any(
+                m.running or m.restart_at is not None for m in processes
+            ):
+                self.stop("All supervised processes exited")
+                break
+
+            now = time.monotonic()
+            due = [m.restart_at for m in processes if m.restart_at is not None]
+            timeout = max(min(due) - now, 0) if due else None
+
+            for key, _ in self._selector.select(timeout):
+                kind, data = key.data
+                if kind == "wake":
+                    try:
+                        while os.read(self._wake_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif kind == "exit":
+                    self._handle_exit(data)
+                elif kind == "output":
+                    self._read_output(data)
+
+            now = time.monotonic()
+            for managed in processes:
+                if self._stopped.is_set():
+                    break
+                if managed.restart_at is not None and managed.restart_at <= now:
+                    self._restart(managed)
+
+    def start(self) -> None:
+        """
+        Run the event loop in a background thread.
+        """
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, reason: str = "Stopped") -> None:
+        """
+        Stop supervising; safe to call from any thread or signal handler.
+        Processes are left running for the cleanup manager to shut down.
+        """
+
+        if not self._stopped.is_set():
+            self.reason = reason
+            self._stopped.set()
+        self._wake()
+
+    def wait(self) -> str:
+        """
+        Block until the supervisor stops, turning SIGINT and SIGTERM into a
+        stop. Must be called from the main thread. Return why it stopped.
+        """
+
+        def handle_signal(sig, frame):
+            self.stop(f"Received {signal.Signals(sig).name}")
+
+        previous = {
+            sig: signal.signal(sig, handle_signal)
+            for sig in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            self._stopped.wait()
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        return self.reason
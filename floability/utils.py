@@ -1,10 +1,17 @@
 import os
+import contextlib
 import time
 import datetime
 import getpass
+import shutil
+import signal
 import socket
+import stat
+import subprocess
+import sys
 import tarfile
 from pathlib import Path
+from typing import Optional
 
 SYSTEM_INFORMATION = None
 
@@ -58,43 +65,461 @@ def get_system_information():
     return SYSTEM_INFORMATION
 
 
-def safe_extract_tar(tar_file: Path, dest_dir: Path) -> None:
+def _is_within_directory(base: str, path: str) -> bool:
+    """
+    Pure string check that the normalized path lies inside base. No filesystem
+    calls are made, so it is cheap enough to run for every archive member.
+    """
+
+    path = os.path.normpath(path)
+    return path == base or path.startswith(base + os.sep)
+
+
+def _check_tar_member(member: tarfile.TarInfo, dest: str, symlinks: set) -> None:
+    """
+    Raise if extracting member into dest could write outside dest.
+    symlinks holds the symlinks extracted so far. Members below one of them
+    are the only ones whose location cannot be checked lexically, so only for
+    those the real path is resolved. Link targets are always resolved through
+    the tree extracted so far, since they may pass through earlier symlinks.
+    """
+
+    name = os.path.normpath(member.name)
+    target = os.path.join(dest, name)
+
+    if os.path.isabs(member.name) or not _is_within_directory(dest, target):
+        raise Exception(f"Tar extraction error: {member.name} is outside {dest}")
+
+    if member.isdev():
+        raise Exception(f"Tar extraction error: {member.name} is a device file")
+
+    parent_dir = os.path.dirname(target)
+    ancestor = os.path.dirname(name)
+    while ancestor:
+        if ancestor in symlinks:
+            parent_dir = os.path.realpath(parent_dir)
+            if not _is_within_directory(dest, parent_dir):
+                raise Exception(
+                    f"Tar extraction error: {member.name} is outside {dest}"
+                )
+            break
+        ancestor = os.path.dirname(ancestor)
+
+    if member.issym():
+        link_target = os.path.join(parent_dir, member.linkname)
+    elif member.islnk():
+        link_target = os.path.join(dest, member.linkname)
+    else:
+        return
+
+    if (
+        os.path.isabs(member.linkname)
+        or not _is_within_directory(dest, link_target)
+        or not _is_within_directory(dest, os.path.realpath(link_target))
+    ):
+        raise Exception(f"Tar extraction error: {member.name} links outside {dest}")
+
+    if member.issym():
+        symlinks.add(name)
+
+
+def safe_extract_tar(
+    tar_file: Path, dest_dir: Path, fileobj=None, use_data_filter: bool = False
+) -> None:
     """
     Safely extract the contents of tar_file into dest_dir.
     This prevents files from escaping the intended extraction directory.
+
+    The archive is read as a stream and each member is checked and extracted
+    as it is reached, so a compressed archive is decompressed exactly once.
+    If fileobj is given, the (uncompressed or compressed) tar stream is read
+    from it instead of from tar_file. With use_data_filter, members also go
+    through tarfile's 'data' filter where the Python version provides it.
     """
 
     print(f"Extracting '{tar_file}' into '{dest_dir}'...")
 
-    with tarfile.open(tar_file, "r:*") as tar:
+    dest = os.path.realpath(dest_dir)
+    data_filter = getattr(tarfile, "data_filter", None)
+    extract_args = {"filter": "fully_trusted"} if data_filter else {}
+    symlinks = set()
+    directories = []
 
-        def is_within_directory(base: Path, target: Path) -> bool:
-            return str(target.resolve()).startswith(str(base.resolve()))
+    with tarfile.open(tar_file, mode="r|*", fileobj=fileobj) as tar:
+        for member in tar:
+            _check_tar_member(member, dest, symlinks)
 
-        for member in tar.getmembers():
-            member_path = dest_dir.joinpath(member.name)
-            if not is_within_directory(dest_dir, member_path):
-                raise Exception(
-                    f"Tar extraction error: {member.name} is outside {dest_dir}"
-                )
+            if use_data_filter and data_filter is not None:
+                member = data_filter(member, dest)
+            else:
+                # Never recreate setuid/setgid/sticky bits or world-writable files
+                member.mode &= ~0o7002
 
-        tar.extractall(path=dest_dir)
+            if member.isdir():
+                # Permissions are applied at the end, so that a read-only
+                # directory does not block extraction of its contents
+                directories.append(member)
+                tar.extract(member, dest, set_attrs=False, **extract_args)
+            else:
+                tar.extract(member, dest, **extract_args)
+
+        # A symlink may point through symlinks that were extracted after it
+        for name in symlinks:
+            if not _is_within_directory(
+                dest, os.path.realpath(os.path.join(dest, name))
+            ):
+                raise Exception(f"Tar extraction error: {name} links outside {dest}")
+
+        directories.sort(key=lambda m: m.name, reverse=True)
+        for member in directories:
+            dir_path = os.path.join(dest, member.name)
+            tar.chown(member, dir_path, numeric_owner=False)
+            tar.utime(member, dir_path)
+            tar.chmod(member, dir_path)
 
     print(f"Extraction complete for '{tar_file}'.")
 
 
-def update_manager_name_in_env(env_dir: str, manager_name: str):
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str) -> int:
     """
-    Adds/updates the VINE_MANAGER_NAME environment variable in the
-    conda environment's activation script.
+    Parse a human readable size such as '500M', '20G' or '1024' into bytes.
     """
 
-    env_vars_dir = os.path.join(env_dir, "etc", "conda", "activate.d")
-    os.makedirs(env_vars_dir, exist_ok=True)
-    env_vars_file = os.path.join(env_vars_dir, "env_vars.sh")
+    text = str(size).strip().upper().rstrip("B").rstrip("I")
+    unit = text[-1] if text and text[-1] in "KMGT" else ""
+    number = text[: len(text) - len(unit)]
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: {size}")
+
+
+def format_size(num_bytes: int) -> str:
+    """
+    Format a number of bytes as a short human readable string.
+    """
+
+    size = float(num_bytes)
+    for unit in ["B", "K", "M", "G"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}" if unit != "B" else f"{int(size)}B"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+# Ways of placing a file at its target location. 'auto' tries a reflink, then
+# a hardlink, and copies only if neither works (e.g. across filesystems).
+LINK_MODES = ["copy", "hardlink", "reflink", "symlink", "auto"]
+DEFAULT_LINK_MODE = "copy"
 
-    with open(env_vars_file, "a", encoding="utf-8") as f:
-        f.write(f"\nexport VINE_MANAGER_NAME={manager_name}\n")
-    print(
-        f"[environment] Updated environment variable VINE_MANAGER_NAME={manager_name} in {env_vars_file}"
+FICLONE = 0x40049409  # from linux/fs.h
+
+
+def reflink_file(source: Path, dest: Path) -> None:
+    """
+    Create dest as a copy-on-write clone of source (Linux FICLONE ioctl).
+    Raises OSError if the filesystem does not support reflinks.
+    """
+
+    import fcntl
+
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+
+def materialize_file(
+    source: Path, dest: Path, link_mode: str = DEFAULT_LINK_MODE
+) -> str:
+    """
+    Place source at dest according to link_mode, falling back to a copy when
+    the requested kind of link is not possible. Return the mode actually used.
+    """
+
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unsupported link mode: {link_mode}")
+
+    if os.path.lexists(dest) and link_mode != "copy":
+        os.unlink(dest)
+
+    if link_mode == "symlink":
+        os.symlink(os.path.abspath(source), dest)
+        return "symlink"
+
+    if link_mode in ("reflink", "auto"):
+        try:
+            reflink_file(source, dest)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.lexists(dest):
+                os.unlink(dest)
+
+    if link_mode in ("hardlink", "auto"):
+        try:
+            os.link(source, dest)
+            return "hardlink"
+        except OSError:
+            pass
+
+    shutil.copy2(source, dest)
+    return "copy"
+
+
+def materialize_tree(
+    source: Path, dest: Path, link_mode: str = DEFAULT_LINK_MODE
+) -> None:
+    """
+    Place the directory source at dest according to link_mode. In 'symlink'
+    mode the directory itself is linked; otherwise each file is materialized.
+    """
+
+    if link_mode == "symlink":
+        if not os.path.lexists(dest):
+            os.symlink(os.path.abspath(source), dest)
+            return
+
+    shutil.copytree(
+        source,
+        dest,
+        copy_function=lambda s, d: materialize_file(Path(s), Path(d), link_mode),
+        dirs_exist_ok=True,
     )
+
+
+# Run by the detached process of remove_tree; the same as make_writable
+# followed by rmtree, without importing floability
+REMOVE_TREE_SCRIPT = """
+import os, shutil, stat, sys
+for dirpath, _, _ in os.walk(sys.argv[1]):
+    try:
+        os.chmod(dirpath, stat.S_IMODE(os.lstat(dirpath).st_mode) | stat.S_IRWXU)
+    except OSError:
+        pass
+shutil.rmtree(sys.argv[1], ignore_errors=True)
+"""
+
+
+def make_writable(root: str) -> None:
+    """
+    Give the owner write access to root and every directory under it again,
+    undoing make_read_only, so that the files in them can be deleted.
+    """
+
+    for dirpath, _, _ in os.walk(root):
+        try:
+            mode = stat.S_IMODE(os.lstat(dirpath).st_mode)
+            os.chmod(dirpath, mode | stat.S_IRWXU)
+        except OSError:
+            pass
+
+
+def _remove_tree_now(path: str) -> None:
+    make_writable(path)
+    shutil.rmtree(path, ignore_errors=True)
+    if os.path.lexists(path):
+        print(f"[cleanup] Could not remove {path}")
+
+
+def remove_tree(path: str, background: bool = True) -> None:
+    """
+    Remove the directory tree at path, including read-only trees such as
+    cached environments. With background, the tree is renamed to a hidden
+    sibling, so that path is free again at once, and deleted by a detached
+    process that may outlive floability. Removing an environment of tens of
+    thousands of files then costs the caller a single rename.
+    """
+
+    if not os.path.lexists(path):
+        return
+    if not background:
+        _remove_tree_now(path)
+        return
+
+    parent, name = os.path.split(os.path.abspath(path))
+    trash = os.path.join(parent, f".{name}.deleting.{os.getpid()}.{time.time_ns()}")
+    try:
+        os.rename(path, trash)
+        subprocess.Popen(
+            [sys.executable, "-c", REMOVE_TREE_SCRIPT, trash],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        for leftover in (path, trash):
+            if os.path.lexists(leftover):
+                _remove_tree_now(leftover)
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: str):
+    """
+    Hold an exclusive fcntl lock on lock_path for the duration of the block,
+    so that only one floability process at a time builds a shared cache entry.
+    """
+
+    import fcntl
+
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Waiting for another floability process holding {lock_path}...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def try_file_lock(lock_path: str):
+    """
+    Like file_lock, but do not wait: yield whether the exclusive lock was
+    taken, and hold it for the duration of the block if so.
+    """
+
+    import fcntl
+
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def hold_shared_lock(lock_path: str):
+    """
+    Take a shared fcntl lock on lock_path and return the open lock file. The
+    lock is held until the file is closed or the process exits, and keeps
+    others from taking it exclusively, e.g. to evict a cache entry in use.
+    """
+
+    import fcntl
+
+    lock_file = open(lock_path, "a")
+    fcntl.flock(lock_file, fcntl.LOCK_SH)
+    return lock_file
+
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def make_read_only(root: str) -> None:
+    """
+    Remove the write permission bits from every file and directory under
+    root, root itself included. Symlinks are left alone.
+    """
+
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        for name in filenames + dirnames:
+            path = os.path.join(dirpath, name)
+            if not os.path.islink(path):
+                mode = os.lstat(path).st_mode
+                os.chmod(path, stat.S_IMODE(mode) & ~WRITE_BITS)
+    os.chmod(root, stat.S_IMODE(os.stat(root).st_mode) & ~WRITE_BITS)
+
+
+# Leading bytes of the compression formats conda-pack archives may use
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"BZh": "bzip2",
+    b"\xfd7zXZ\x00": "xz",
+}
+
+
+def detect_compression(file_path: Path) -> Optional[str]:
+    """
+    Detect the compression of file_path from its first bytes.
+    Return 'gzip', 'zstd', 'bzip2', 'xz', or None for anything else.
+    """
+
+    with open(file_path, "rb") as f:
+        head = f.read(6)
+    for magic, name in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+@contextlib.contextmanager
+def open_decompressed(file_path: Path):
+    """
+    Yield a file object with the decompressed contents of file_path, using a
+    parallel or native decompressor when one is available: pigz for gzip, the
+    zstd command line tool or the zstandard package for zstd. Yield None if
+    no such tool applies, in which case the caller should read the file itself.
+    """
+
+    compression = detect_compression(file_path)
+    command = None
+    if compression == "gzip" and shutil.which("pigz"):
+        command = ["pigz", "-dc", str(file_path)]
+    elif compression == "zstd" and shutil.which("zstd"):
+        command = ["zstd", "-dc", "-q", str(file_path)]
+
+    if command:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+        try:
+            yield proc.stdout
+        finally:
+            proc.stdout.close()
+            if proc.wait() not in (0, -signal.SIGPIPE):
+                raise subprocess.CalledProcessError(proc.returncode, command)
+        return
+
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                f"'{file_path}' is zstd compressed; install the 'zstd' tool "
+                "or the 'zstandard' package to extract it."
+            )
+        with open(file_path, "rb") as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                yield reader
+        return
+
+    yield None
+
+
+def run_logged(
+    cmd: list, log_prefix: Optional[str] = None, check: bool = True
+) -> subprocess.CompletedProcess:
+    """
+    Run cmd like subprocess.run. With log_prefix, the command's stdout and
+    stderr are printed line by line behind the prefix, so that the output of
+    commands running concurrently stays readable when interleaved.
+    """
+
+    if log_prefix is None:
+        return subprocess.run(cmd, check=check)
+
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    )
+    with proc.stdout:
+        for line in proc.stdout:
+            line = line.rstrip()
+            if line:
+                print(f"{log_prefix} {line}", flush=True)
+    proc.wait()
+
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return subprocess.CompletedProcess(cmd, proc.returncode)
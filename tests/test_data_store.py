@@ -0,0 +1,87 @@
+"""
+Tests of data_handler.fetch_data_from_spec with the shared data store: items
+placed as copies must never share their inode with the stored object.
+"""
+
+import hashlib
+import os
+
+import pytest
+import yaml
+
+from floability.data_handler import fetch_data_from_spec
+from floability.data_store import DATA_STORE_DIR_NAME, DataStore
+
+CONTENT = b"floability data store\n"
+DIGEST = hashlib.md5(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def backpack(tmp_path):
+    backpack = tmp_path / "backpack"
+    (backpack / "data").mkdir(parents=True)
+    (backpack / "workflow").mkdir()
+    (backpack / "data" / "a.txt").write_bytes(CONTENT)
+    return backpack
+
+
+def write_spec(backpack, link_mode):
+    spec = {
+        "data": [
+            {
+                "name": "a",
+                "source_type": "backpack",
+                "source": "data/a.txt",
+                "target_location": "a.txt",
+                "link_mode": link_mode,
+                "verification": {"checksum": DIGEST},
+            }
+        ]
+    }
+    spec_path = backpack / "data.yml"
+    spec_path.write_text(yaml.safe_dump(spec))
+    return spec_path
+
+
+def fetch(spec_path, backpack, base_dir):
+    fetch_data_from_spec(
+        str(spec_path), str(backpack), base_dir=str(base_dir), use_data_store=True
+    )
+
+
+def stored_object(base_dir):
+    store = DataStore(base_dir / DATA_STORE_DIR_NAME)
+    try:
+        return store.lookup("md5", DIGEST)
+    finally:
+        store.close()
+
+
+def test_copied_item_does_not_share_inode_with_store(tmp_path, backpack):
+    base_dir = tmp_path / "base"
+    spec_path = write_spec(backpack, "copy")
+    target = backpack / "workflow" / "a.txt"
+
+    fetch(spec_path, backpack, base_dir)
+
+    stored = stored_object(base_dir)
+    assert stored is not None and stored.read_bytes() == CONTENT
+    assert os.stat(target).st_ino != os.stat(stored).st_ino
+
+    # Refetched from the store, the item is still a separate copy
+    target.unlink()
+    fetch(spec_path, backpack, base_dir)
+    assert os.stat(target).st_ino != os.stat(stored).st_ino
+
+    target.write_bytes(b"edited")
+    assert stored.read_bytes() == CONTENT
+
+
+def test_hardlinked_item_may_share_inode_with_store(tmp_path, backpack):
+    base_dir = tmp_path / "base"
+    spec_path = write_spec(backpack, "hardlink")
+
+    fetch(spec_path, backpack, base_dir)
+
+    stored = stored_object(base_dir)
+    assert stored is not None and stored.read_bytes() == CONTENT
@@ -0,0 +1,145 @@
+"""
+Tests of data_handler.download_file against a local HTTP server that supports
+byte ranges: resuming a partial download, a partial that is already complete
+(416), and segmented downloads.
+"""
+
+import hashlib
+import http.server
+import json
+import re
+import threading
+
+import pytest
+
+from floability import data_handler
+from floability.data_handler import download_file, partial_download_paths
+
+CONTENT = bytes(range(256)) * 4096  # 1 MiB
+ETAG = '"floability-test"'
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves CONTENT at every path, honoring Range and If-Range like a static
+    file server, and records each request as (method, Range header, status).
+    """
+
+    requests = None
+
+    def _send(self, body: bool) -> None:
+        size = len(CONTENT)
+        start, end, status = 0, size - 1, 200
+
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == ETAG):
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header)
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+            status = 206
+
+        if status == 206 and start >= size:
+            self.requests.append((self.command, range_header, 416))
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.requests.append((self.command, range_header, status))
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if body:
+            self.wfile.write(CONTENT[start : end + 1])
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+    def do_GET(self):
+        self._send(body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type("Handler", (RangeRequestHandler,), {"requests": []})
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/data.bin", handler.requests
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def write_partial(dest, url, length):
+    part_path, meta_path = partial_download_paths(dest)
+    part_path.write_bytes(CONTENT[:length])
+    meta_path.write_text(json.dumps({"url": url, "etag": ETAG}))
+    return part_path, meta_path
+
+
+def test_resume_partial_download(server, tmp_path):
+    url, requests = server
+    dest = tmp_path / "data.bin"
+    part_path, meta_path = write_partial(dest, url, 1000)
+
+    digest = download_file(url, dest, segments=1, algorithm="sha256")
+
+    assert dest.read_bytes() == CONTENT
+    assert digest == hashlib.sha256(CONTENT).hexdigest()
+    assert requests == [("GET", "bytes=1000-", 206)]
+    assert not part_path.exists() and not meta_path.exists()
+
+
+def test_complete_partial_download(server, tmp_path):
+    url, requests = server
+    dest = tmp_path / "data.bin"
+    write_partial(dest, url, len(CONTENT))
+
+    digest = download_file(url, dest, segments=1, algorithm="sha256")
+
+    assert dest.read_bytes() == CONTENT
+    assert digest == hashlib.sha256(CONTENT).hexdigest()
+    assert requests == [("GET", f"bytes={len(CONTENT)}-", 416)]
+
+
+def test_stale_partial_download_restarts(server, tmp_path):
+    url, requests = server
+    dest = tmp_path / "data.bin"
+    part_path, meta_path = partial_download_paths(dest)
+    part_path.write_bytes(b"x" * 1000)
+    meta_path.write_text(json.dumps({"url": url, "etag": '"changed"'}))
+
+    download_file(url, dest, segments=1)
+
+    assert dest.read_bytes() == CONTENT
+    assert requests == [("GET", "bytes=1000-", 200)]
+
+
+def test_segmented_download(server, tmp_path, monkeypatch):
+    url, requests = server
+    monkeypatch.setattr(data_handler, "SEGMENTED_DOWNLOAD_THRESHOLD", 1)
+    dest = tmp_path / "data.bin"
+
+    digest = download_file(url, dest, segments=4, algorithm="sha256")
+
+    assert dest.read_bytes() == CONTENT
+    assert digest == hashlib.sha256(CONTENT).hexdigest()
+    quarter = len(CONTENT) // 4
+    assert requests[0] == ("HEAD", None, 200)
+    assert sorted(r[1] for r in requests[1:]) == [
+        f"bytes={i * quarter}-{(i + 1) * quarter - 1}" for i in range(4)
+    ]
+    assert all(r[2] == 206 for r in requests[1:])
+    assert not partial_download_paths(dest)[0].exists()
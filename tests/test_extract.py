@@ -0,0 +1,94 @@
+"""
+Tests of utils.safe_extract_tar with archives whose links try to escape the
+extraction directory through other links.
+"""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from floability.utils import safe_extract_tar
+
+
+def make_archive(path, members):
+    """
+    Write a tar archive at path from (name, kind, data or link target) tuples,
+    kind being 'file', 'dir', 'symlink' or 'hardlink'.
+    """
+
+    with tarfile.open(path, "w") as tar:
+        for name, kind, value in members:
+            info = tarfile.TarInfo(name)
+            if kind == "file":
+                info.size = len(value)
+                tar.addfile(info, io.BytesIO(value))
+                continue
+            if kind == "dir":
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+            elif kind == "symlink":
+                info.type = tarfile.SYMTYPE
+                info.linkname = value
+            else:
+                info.type = tarfile.LNKTYPE
+                info.linkname = value
+            tar.addfile(info)
+
+
+@pytest.fixture
+def dest(tmp_path):
+    (tmp_path / "outside_secret").write_text("secret")
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    return dest
+
+
+def test_hardlink_through_symlink_chain_is_rejected(tmp_path, dest):
+    archive = tmp_path / "escape.tar"
+    make_archive(
+        archive,
+        [
+            ("a", "symlink", "."),
+            ("c", "symlink", "a/.."),
+            ("h", "hardlink", "c/outside_secret"),
+        ],
+    )
+
+    with pytest.raises(Exception, match="outside"):
+        safe_extract_tar(archive, dest)
+
+    secret = os.stat(tmp_path / "outside_secret")
+    assert secret.st_nlink == 1
+    assert not os.path.lexists(dest / "h")
+
+
+def test_symlink_redirected_by_later_symlink_is_rejected(tmp_path, dest):
+    archive = tmp_path / "escape.tar"
+    make_archive(archive, [("x", "symlink", "y/.."), ("y", "symlink", ".")])
+
+    with pytest.raises(Exception, match="outside"):
+        safe_extract_tar(archive, dest)
+
+
+def test_links_inside_archive_are_extracted(tmp_path, dest):
+    archive = tmp_path / "env.tar"
+    make_archive(
+        archive,
+        [
+            ("lib", "dir", None),
+            ("lib/libz.so.1.3", "file", b"libz"),
+            ("lib/libz.so.1", "symlink", "libz.so.1.3"),
+            ("lib/libz.so", "symlink", "libz.so.1"),
+            ("lib64", "symlink", "lib"),
+            ("bin", "dir", None),
+            ("bin/libz", "symlink", "../lib64/libz.so"),
+            ("lib/libz-copy.so", "hardlink", "lib/libz.so.1.3"),
+        ],
+    )
+
+    safe_extract_tar(archive, dest)
+
+    assert (dest / "bin" / "libz").read_bytes() == b"libz"
+    assert os.stat(dest / "lib" / "libz-copy.so").st_nlink == 2
@@ -0,0 +1,45 @@
+"""
+Tests of the cache of extracted environments: read-only environments can be
+removed, and eviction keeps the most recently used ones and those in use.
+"""
+
+import os
+
+from floability.environment import evict_extracted_environments
+from floability.utils import hold_shared_lock, make_read_only, remove_tree
+
+
+def make_environment(extracted_dir, name, last_used):
+    env_dir = extracted_dir / name
+    (env_dir / "lib" / "python3").mkdir(parents=True)
+    (env_dir / "lib" / "python3" / "site.py").write_text("")
+    (env_dir / ".floability_ready").write_text("")
+    make_read_only(env_dir)
+    in_use_lock = extracted_dir / f"{name}.inuse"
+    in_use_lock.touch()
+    os.utime(in_use_lock, (last_used, last_used))
+    return env_dir
+
+
+def test_remove_read_only_tree(tmp_path):
+    env_dir = make_environment(tmp_path, "env_a", 0)
+
+    remove_tree(str(env_dir), background=False)
+
+    assert not env_dir.exists()
+
+
+def test_evict_least_recently_used(tmp_path):
+    oldest = make_environment(tmp_path, "env_a", 1000)
+    in_use = make_environment(tmp_path, "env_b", 2000)
+    newest = make_environment(tmp_path, "env_c", 3000)
+
+    lock_file = hold_shared_lock(f"{in_use}.inuse")
+    try:
+        evict_extracted_environments(str(tmp_path), limit=1)
+    finally:
+        lock_file.close()
+
+    assert not oldest.exists()
+    assert in_use.exists()
+    assert newest.exists()
@@ -0,0 +1,61 @@
+"""
+Tests of layered environment packs: composing an environment from a delta
+and its base layer, and detecting a delta whose base layer has changed.
+"""
+
+import io
+import os
+import tarfile
+
+from floability.layers import compose_environment, delta_matches_base, make_delta_pack
+from floability.utils import make_read_only
+
+
+def make_pack(path, files):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+
+def make_layers(tmp_path):
+    common_env_dir = tmp_path / "flo_common_env"
+    common_env_dir.mkdir()
+    base_pack = common_env_dir / "env_base.tar.gz"
+    make_pack(base_pack, {"bin/python": b"python", "lib/site.py": b"site"})
+
+    full_pack = tmp_path / "env_full.tar.gz"
+    make_pack(
+        full_pack,
+        {"bin/python": b"python", "lib/site.py": b"site", "lib/numpy.py": b"numpy"},
+    )
+    delta_pack = common_env_dir / "env_full.delta.tar.gz"
+    counts = make_delta_pack(str(full_pack), str(base_pack), str(delta_pack), "tar.gz")
+    assert counts == {"delta": 1, "from_base": 2}
+    return base_pack, delta_pack
+
+
+def test_compose_does_not_share_base_files(tmp_path):
+    base_pack, delta_pack = make_layers(tmp_path)
+    env_dir = tmp_path / "env"
+    env_dir.mkdir()
+
+    compose_environment(str(delta_pack), str(env_dir), str(tmp_path))
+    make_read_only(env_dir)
+
+    assert (env_dir / "lib" / "numpy.py").read_bytes() == b"numpy"
+    assert (env_dir / "bin" / "python").read_bytes() == b"python"
+    layer_file = tmp_path / "flo_common_env" / "layers" / "env_base" / "bin" / "python"
+    assert os.stat(layer_file).st_ino != os.stat(env_dir / "bin" / "python").st_ino
+    assert os.stat(layer_file).st_mode & 0o200
+
+
+def test_delta_does_not_match_changed_base(tmp_path):
+    base_pack, delta_pack = make_layers(tmp_path)
+    assert delta_matches_base(str(delta_pack), str(base_pack))
+
+    make_pack(base_pack, {"bin/python": b"python 2", "lib/site.py": b"site"})
+
+    assert not delta_matches_base(str(delta_pack), str(base_pack))